@@ -1,7 +1,13 @@
+import copy
+import itertools
+import math
+
 import numpy as np
 import matplotlib.pyplot as plt
 import tpqoa
 
+from backtesting.DatasetRegistry import shared_registry
+
 
 class Backtester:
     """Class implementing a vectorized back-testing framework."""
@@ -23,6 +29,7 @@ class Backtester:
         self._tc = trading_cost
 
         self._results = None
+        self._search_report = None
 
         self._data = self.acquire_data()
         self._data = self.prepare_data()
@@ -30,47 +37,42 @@ class Backtester:
     def acquire_data(self):
         """
         A general function to acquire data of instrument from a source.
+        The data is shared with all backtests of the same instrument, granularity and (covering) range.
 
         Returns:
-            Returns a Pandas dataframe containing downloaded info.
+            Returns a read-only Pandas dataframe containing downloaded info.
         """
-        print("Downloading historical data...")
-
-        oanda = tpqoa.tpqoa("oanda.cfg")
-
-        df = oanda.get_history(
-            self._instrument, self._start, self._end, self._granularity, "M"
-        )
-
-        # only care for the closing price
-        df = df.c.to_frame()
-        df.rename(columns={"c": "price"}, inplace=True)
-
-        df.dropna(inplace=True)
-
-        df["returns"] = np.log(df.div(df.shift(1)))
-
-        print("Download complete.")
-
-        return df
+        return shared_registry("oanda.cfg").get(self._instrument, self._start, self._end, self._granularity)
 
     def prepare_data(self):
         """
-        Prepares data for strategy-specific information.
+        Prepares data for strategy-specific information. Strategies without extra columns use the shared, read-only
+        dataset as is; those that add columns copy it first.
         Returns:
             Returns a Pandas dataframe
         """
-        return self._data.copy()
+        return self._data
 
     def resample(self, granularity):
         """
-        Resamples the instruments' dataset to be in buckets of the passed granularity (IE "W", "D", "H").
+        Resamples the instruments' dataset to be in buckets of the passed granularity (IE "4H", "H", "15min").
+        Buckets of currency pairs are aligned to the trading sessions, so none is padded over a closed market.
 
         Args:
             granularity (string): The new granularity for the dataset
         """
         self._granularity = granularity
-        self._data.resample(granularity)
+
+        calendar = tpqoa.shared("oanda.cfg").instrument_calendar(self._instrument)
+        if calendar is not None:
+            df = calendar.resample(self._data[["price"]], granularity)
+        else:
+            # instruments with their own trading hours, buckets without prices are left out
+            df = self._data[["price"]].resample(granularity).last().dropna()
+        df["returns"] = np.log(df.div(df.shift(1)))
+
+        self._data = df
+        self._data = self.prepare_data()
         return
 
     def get_data(self):
@@ -112,6 +114,63 @@ class Backtester:
         """
         pass
 
+    def search(self, strategy, *ranges):
+        """
+        Searches the parameter grid spanned by ranges with a search strategy (see ParameterSearch) instead of
+        evaluating all of it. Every evaluation is one call of performance_surface for a single parameter combination,
+        on all of the data or on a prefix of it. The number of evaluations used is reported next to the grid size.
+
+        Args:
+            strategy (object): A search strategy, e.g. ParameterSearch.SuccessiveHalving()
+            ranges (tuple(int, int)): The ranges of the parameters, as passed to performance_surface
+
+        Returns:
+            Returns a tuple, (float: max_return, tuple: best_params)
+            -> "max_return" is the greatest return found on the interval [start,end]
+            -> "best_params" are the parameters of max_return, in the order of ranges
+        """
+        grid = np.array(list(itertools.product(*(range(*value_range) for value_range in ranges))))
+        report = {"grid_size": len(grid), "evaluations": 0, "full_evaluations": 0.0}
+
+        def evaluate(rows, fraction):
+            # a shallow copy shares everything but the (prefix of the) data
+            backtest = copy.copy(self)
+            backtest._data = self._data.iloc[:max(1, math.ceil(len(self._data) * fraction))]
+
+            performance = np.full(len(rows), np.nan)
+            for i, row in enumerate(rows):
+                surface = backtest.performance_surface(*((value, value + 1) for value in grid[row]))
+                performance[i] = surface["performance"].iloc[0] if "performance" in surface.columns else surface.iloc[0, 0]
+
+            report["evaluations"] += len(rows)
+            report["full_evaluations"] += len(rows) * fraction
+            return performance
+
+        rows, performance = strategy.search(grid, evaluate)
+        self._search_report = report
+
+        print(f"Search used {report['evaluations']} evaluations ({round(report['full_evaluations'], 1)} on the full data) of a grid of {len(grid)}.")
+
+        if np.isnan(performance).all():
+            return float("nan"), None
+
+        # the first maximum in grid order
+        best = np.nanargmax(performance)
+        return performance[best], tuple(int(value) for value in grid[rows[best]])
+
+    def get_search_report(self):
+        """
+        Getter function to retrieve the evaluations used by the last search() (or optimize(search=...)).
+
+        Returns:
+            Returns a dictionary with the grid_size, the number of evaluations and their cost in evaluations on all
+            of the data (full_evaluations)
+        """
+        if self._search_report is not None:
+            return self._search_report
+        else:
+            print("Please run .search() or .optimize(search=...) first.")
+
     def plot_results(self):
         """
         Plots the results of test() or optimize().
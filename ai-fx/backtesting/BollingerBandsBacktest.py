@@ -1,5 +1,9 @@
 import numpy as np
+import pandas as pd
+
 from backtesting.Backtester import Backtester
+from backtesting.GridEngine import forward_fill, rolling_stats, strategy_performance
+from backtesting.ParallelOptimizer import ParallelOptimizer
 
 
 class BollingerBandsBacktest(Backtester):
@@ -22,6 +26,7 @@ class BollingerBandsBacktest(Backtester):
         """
         self._sma = sma
         self._deviation = deviation
+        self._surface = None
 
         # passes params to the parent class
         super().__init__(
@@ -43,13 +48,23 @@ class BollingerBandsBacktest(Backtester):
             Returns a Pandas dataframe
         """
         df = self._data.copy()
-        df["sma"] = df.price.rolling(self._sma).mean()
-
-        df["lower"] = df["sma"] - (df.price.rolling(self._sma).std() * self._deviation)
-        df["upper"] = df["sma"] + (df.price.rolling(self._sma).std() * self._deviation)
+        self.set_bands(df)
 
         return df
 
+    def set_bands(self, df):
+        """
+        Sets the sma, lower and upper band columns of df for the current sma and deviation values.
+        The band width is the population standard deviation (ddof=0) of the prices in the sma window.
+
+        Args:
+            df (object): A Pandas dataframe with a price column
+        """
+        mean, std = rolling_stats(df["price"], self._sma)
+        df["sma"] = mean
+        df["lower"] = df["sma"] - (std * self._deviation)
+        df["upper"] = df["sma"] + (std * self._deviation)
+
     def set_params(self, sma=None, deviation=None):
         """
         Allows the caller to reset/override the current sma value and the deviation value,
@@ -61,30 +76,11 @@ class BollingerBandsBacktest(Backtester):
         """
         if sma is not None:
             self._sma = sma
-            self._data["sma"] = self._data.price.rolling(self._sma).mean()
-
-            # error with python... https://github.com/pandas-dev/pandas/issues/21786 .std() doesnt work
-            self._data["lower"] = (
-                self._data["sma"]
-                - self._data.price.rolling(self._sma).apply(lambda x: np.std(x))
-                * self._deviation
-            )
-            self._data["upper"] = (
-                self._data["sma"]
-                + self._data.price.rolling(self._sma).apply(lambda x: np.std(x))
-                * self._deviation
-            )
-
         if deviation is not None:
             self._deviation = deviation
-            self._data["lower"] = self._data["sma"] - (
-                self._data.price.rolling(self._sma).apply(lambda x: np.std(x))
-                * deviation
-            )
-            self._data["upper"] = self._data["sma"] + (
-                self._data.price.rolling(self._sma).apply(lambda x: np.std(x))
-                * deviation
-            )
+
+        if sma is not None or deviation is not None:
+            self.set_bands(self._data)
 
     def test(self, mute=False):
         """
@@ -139,9 +135,79 @@ class BollingerBandsBacktest(Backtester):
 
         return performance, out_performance
 
-    def optimize(self, sma_range=(1, 252), dev_range=(1, 3)):
+    def performance_surface(self, sma_range=(1, 252), dev_range=(1, 3)):
+        """
+        Computes the performance of every (sma, deviation) pair at once, with the same results as test() for each
+        pair. The mean and standard deviation of every sma window are computed once and shared by all deviations,
+        whose positions are evaluated together as 2-D arrays.
+
+        Args:
+            sma_range (tuple: int) <DEFAULT = (1, 252)>: The range of sma values, (X,Y) -> X <= sma < Y
+            dev_range (tuple: int) <DEFAULT = (1, 3)>: The range of deviation values, (X,Y) -> X <= deviation < Y
+
+        Returns:
+            Returns a Pandas dataframe of the performance (as returned by test()) with one row per sma and one
+            column per deviation
+        """
+        prices = self._data["price"].to_numpy()
+        returns = self._data["returns"].to_numpy()
+
+        smas = np.arange(*sma_range)
+        devs = np.arange(*dev_range)
+
+        surface = np.full((len(smas), len(devs)), np.nan)
+
+        for row, sma in enumerate(smas):
+            mean, std = rolling_stats(prices, sma)
+
+            # test() keeps the bars from where the bands and the returns exist
+            first = max(sma - 1, 1)
+
+            lower = mean - std * devs[:, None]
+            upper = mean + std * devs[:, None]
+
+            # oversold -> long, overbought -> short, crossing the sma -> neutral, otherwise hold
+            positions = np.where(prices < lower, 1.0, np.nan)
+            positions = np.where(prices > upper, -1.0, positions)
+
+            distance = prices - mean
+            crossed = np.zeros(len(prices), dtype=bool)
+            crossed[first + 1:] = distance[first + 1:] * distance[first:-1] < 0
+            positions = np.where(crossed, 0.0, positions)
+
+            positions = forward_fill(positions, first)
+
+            # the first kept bar has no previous position, test() drops it
+            surface[row] = strategy_performance(
+                positions, returns, np.full(len(devs), first + 1), self._tc
+            )[0]
+
+        return pd.DataFrame(
+            surface, index=pd.Index(smas, name="sma"), columns=pd.Index(devs, name="deviation")
+        )
+
+    def get_surface(self):
+        """
+        Getter function to retrieve the performance surface computed by the last optimize() without search.
+
+        Returns:
+            Returns a Pandas dataframe of the performance of every (sma, deviation) pair
+        """
+        if self._surface is not None:
+            return self._surface
+        else:
+            print("Please run .optimize() (without search) first.")
+
+    def optimize(self, sma_range=(1, 252), dev_range=(1, 3), processes=None, search=None):
         """
         Optimizes the sma and deviation on the interval [start,end] which allows for the greatest return.
+        All pairs are evaluated at once (see performance_surface), the full surface is kept for get_surface().
+
+        Args:
+            sma_range (tuple: int) <DEFAULT = (1, 252)>: The range of sma values, (X,Y) -> X <= sma < Y
+            dev_range (tuple: int) <DEFAULT = (1, 3)>: The range of deviation values, (X,Y) -> X <= deviation < Y
+            processes (int) <DEFAULT = None>: Evaluates the grid on this many processes (see ParallelOptimizer)
+            search (object) <DEFAULT = None>: A search strategy (see ParameterSearch) evaluating only part of the grid
 
         Returns:
             Returns a tuple, (float: max_return, int: best_sma, int: best_dev)
@@ -149,42 +215,40 @@ class BollingerBandsBacktest(Backtester):
             -> "best_sma" is the optimized global best_sma value that maximizes return
             -> "best_dev" is the optimized global best_dev value that maximizes return
         """
-        ###############################################
-        print("Warning: There is a current issue that will cause this optimization to take a long time.")
-        ###############################################
-
         if sma_range[0] >= sma_range[1] or dev_range[0] >= dev_range[1]:
             print("The ranges must satisfy: (X,Y) -> X < Y")
             return
 
         print("Optimizing strategy...")
 
-        max_return = float("-inf")
-        best_sma = -1
-        best_dev = -1
-        for sma in range(sma_range[0], sma_range[1]):
-
-            if sma == sma_range[1] / 4:
-                print("25%...")
-            if sma == sma_range[1] / 2:
-                print("50%...")
-            if sma == sma_range[1] / 1.5:
-                print("75%...")
-
-            for dev in range(dev_range[0], dev_range[1]):
-                self.set_params(sma, dev)
-                current_return = self.test(mute=True)[0]
-
-                if current_return > max_return:
-                    max_return = current_return
-                    best_sma = sma
-                    best_dev = dev
+        if search is not None:
+            # a search evaluates only part of the grid, there is no surface to keep
+            self._surface = None
+            max_return, params = self.search(search, sma_range, dev_range)
+            if params is None:
+                print("No (sma, deviation) pair can be tested on the interval, please check the ranges.")
+                return
+            best_sma, best_dev = params
+        else:
+            self._search_report = None
+            if processes:
+                self._surface = ParallelOptimizer(self, processes).surface(sma_range, dev_range)
+            else:
+                self._surface = self.performance_surface(sma_range, dev_range)
+            if self._surface.isna().all().all():
+                print("No (sma, deviation) pair can be tested on the interval, please check the ranges.")
+                return
+
+            # the first maximum in the order of the sma and deviation values
+            row, column = np.unravel_index(np.nanargmax(self._surface.to_numpy()), self._surface.shape)
+            max_return = self._surface.iloc[row, column]
+            best_sma = int(self._surface.index[row])
+            best_dev = int(self._surface.columns[column])
 
         self.set_params(best_sma, best_dev)
         self.test(mute=True)
 
         print(f"Strategy optimized on interval {self._start} - {self._end}")
-        print(f"Max Return: {round(max_return * 100 - 100, 2) - 100}%, Best SMA: {best_sma} ({self._granularity}), Best Deviation: {best_dev}")
+        print(f"Max Return: {round(max_return * 100 - 100, 2)}%, Best SMA: {best_sma} ({self._granularity}), Best Deviation: {best_dev}")
 
         return max_return, best_sma, best_dev
-
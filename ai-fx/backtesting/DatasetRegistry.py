@@ -0,0 +1,153 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import tpqoa
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def to_timestamp(dati):
+    """Transforms a datetime object or string to a naive UTC pd.Timestamp."""
+    dati = pd.Timestamp(dati)
+    if dati.tzinfo is not None:
+        dati = dati.tz_convert("UTC").tz_localize(None)
+    return dati
+
+
+def read_only(df):
+    """Returns the dataframe backed by one read-only array, so in-place writes to a shared dataset raise."""
+    values = df.to_numpy(dtype="float64", copy=True)
+    values.setflags(write=False)
+    return pd.DataFrame(values, index=df.index, columns=df.columns, copy=False)
+
+
+class DatasetRegistry:
+    """
+    Builds the price datasets of the vectorized backtests once per process and shares them between strategy objects.
+
+    A dataset is the frame of closing prices ("price") and log returns ("returns") of an instrument, granularity and
+    date range, as acquired by Backtester. It is downloaded the first time it is asked for; afterwards the same range
+    is returned as is and any range inside a downloaded one is sliced from it instead of being fetched again.
+    Datasets are read-only: strategies without extra columns use them as they are, others copy them before adding
+    columns (see prepare_data).
+    """
+    def __init__(self, cfg="oanda.cfg"):
+        """
+        Initializes the DatasetRegistry object.
+
+        Args:
+            cfg (string) <DEFAULT = "oanda.cfg">: The OANDA configuration file used for downloads
+        """
+        self._cfg = cfg
+        # (instrument, granularity, price) -> list of (start, end, dataset) of the downloaded ranges
+        self._datasets = {}
+        self._lock = threading.Lock()
+        self.downloads = 0
+
+    def __repr__(self):
+        """Custom Representation."""
+        return f"DatasetRegistry( cfg={self._cfg}, datasets={sum(len(d) for d in self._datasets.values())}, downloads={self.downloads} )"
+
+    def get(self, instrument, start, end, granularity="D", price="M"):
+        """
+        Returns the dataset of instrument on the interval [start, end], downloading it only if no downloaded range
+        covers the interval.
+
+        Args:
+            instrument (string): A string holding the ticker of instrument
+            start (string): The start date of the interval
+            end (string): The end date of the interval
+            granularity (string) <DEFAULT = "D">: Length of each candlestick for the respective instrument
+            price (string) <DEFAULT = "M">: The price component, "M" (mid), "B" (bid) or "A" (ask)
+
+        Returns:
+            Returns a read-only Pandas dataframe with the columns "price" and "returns"
+        """
+        start, end = to_timestamp(start), to_timestamp(end)
+        key = (instrument, granularity, price)
+
+        with self._lock:
+            for first, last, df in self._datasets.get(key, []):
+                if first <= start and end <= last:
+                    return self.slice(df, start, end)
+
+            df = self.download(instrument, start, end, granularity, price)
+            self.downloads += 1
+
+            # ranges inside the new one are no longer needed
+            self._datasets[key] = [
+                (first, last, data) for first, last, data in self._datasets.get(key, [])
+                if not (start <= first and last <= end)
+            ] + [(start, end, df)]
+
+        return df
+
+    def download(self, instrument, start, end, granularity, price):
+        """
+        Downloads the dataset of instrument on the interval [start, end].
+
+        Returns:
+            Returns a read-only Pandas dataframe with the columns "price" and "returns"
+        """
+        print("Downloading historical data...")
+
+        oanda = tpqoa.shared(self._cfg)
+
+        df = oanda.get_history(instrument, start, end, granularity, price, columns=["c"])
+
+        # only care for the closing price
+        df = df.c.to_frame()
+        df.rename(columns={"c": "price"}, inplace=True)
+
+        df.dropna(inplace=True)
+
+        df["returns"] = np.log(df.div(df.shift(1)))
+
+        print("Download complete.")
+
+        return read_only(df)
+
+    @staticmethod
+    def slice(df, start, end):
+        """
+        Slices the interval [start, end] from a dataset. The first return of a slice is unknown, as it would be
+        in a download of the interval itself, so results do not depend on which ranges were downloaded before.
+
+        Returns:
+            Returns a read-only Pandas dataframe with the columns "price" and "returns"
+        """
+        data = df.loc[start:end]
+        if len(data) == len(df):
+            return df
+        if len(data) == 0 or data.index[0] == df.index[0]:
+            return data
+
+        data = data.copy()
+        data.iloc[0, data.columns.get_loc("returns")] = np.nan
+        return read_only(data)
+
+    def clear(self):
+        """Forgets all datasets."""
+        with self._lock:
+            self._datasets.clear()
+
+
+def shared_registry(cfg="oanda.cfg"):
+    """
+    Returns the process-wide DatasetRegistry for the configuration file, creating it on first use.
+
+    Args:
+        cfg (string) <DEFAULT = "oanda.cfg">: The OANDA configuration file used for downloads
+
+    Returns:
+        Returns the DatasetRegistry shared by all backtests using cfg
+    """
+    key = os.path.abspath(cfg)
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = DatasetRegistry(key)
+        return _registries[key]
@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+
+# number of (parameter, bar) cells evaluated at once, bounds the memory of a batch of position series
+BATCH_CELLS = 2 ** 22
+
+
+def rolling_means(values, windows):
+    """
+    Computes the rolling means of values for several windows, each once, with Pandas' rolling kernel. Means that
+    are equal in exact arithmetic (e.g. of flat prices) thus compare exactly as in the test() methods.
+
+    Args:
+        values (array): The values to average, e.g. prices
+        windows (array of int): The window lengths
+
+    Returns:
+        Returns a 2-D array with one row per window; the first window - 1 entries of a row are NaN
+    """
+    values = pd.Series(np.asarray(values, dtype="float64"))
+
+    means = np.full((len(windows), len(values)), np.nan)
+    for row, window in enumerate(windows):
+        means[row] = values.rolling(window).mean().to_numpy()
+    return means
+
+
+def rolling_stats(values, window):
+    """
+    Computes the rolling mean and the rolling (population, ddof=0) standard deviation of values in O(n), with
+    Pandas' running-sum kernels instead of a function call per window.
+
+    Args:
+        values (array): The values, e.g. prices
+        window (int): The window length
+
+    Returns:
+        Returns a tuple of arrays, (mean, std); the first window - 1 entries are NaN
+    """
+    rolling = pd.Series(np.asarray(values, dtype="float64")).rolling(window)
+    return rolling.mean().to_numpy(), rolling.std(ddof=0).to_numpy()
+
+
+def rolling_return_signs(prices, windows):
+    """
+    Computes the signs of the rolling mean log returns of prices for several windows. The log prices are the prefix
+    sums of the log returns, so the mean over a window of w bars is log(p[i] / p[i - w]) / w and its sign is the sign
+    of p[i] - p[i - w]: exact, also where the returns of a window cancel out.
+
+    Args:
+        prices (array): The prices
+        windows (array of int): The window lengths
+
+    Returns:
+        Returns a 2-D array of 1, 0 or -1 with one row per window; NaN where the window is incomplete, as with
+        Pandas' rolling().mean() of the returns
+    """
+    prices = np.asarray(prices, dtype="float64")
+
+    signs = np.full((len(windows), len(prices)), np.nan)
+    for row, window in enumerate(windows):
+        if window < len(prices):
+            signs[row, window:] = np.sign(prices[window:] - prices[:-window])
+    return signs
+
+
+def window_results(prices, returns, windows, trading_cost=0, direction=1):
+    """
+    Evaluates the rolling-mean sign strategies (momentum with direction 1, contrarian with direction -1) of all
+    windows together, in batches of BATCH_CELLS cells.
+
+    Args:
+        prices (array): The prices of the bars
+        returns (array): The log returns of the bars
+        windows (array of int): The window lengths
+        trading_cost (float) <DEFAULT = 0.00>: A static trading cost considered when calculating returns
+        direction (int) <DEFAULT = 1>: 1 to follow the sign of the mean, -1 to trade against it
+
+    Returns:
+        Returns a Pandas dataframe with one row per window and the columns performance, out_performance (as
+        returned by test()) and trades
+    """
+    returns = np.asarray(returns, dtype="float64")
+    windows = np.asarray(windows)
+    batch = max(1, BATCH_CELLS // max(len(returns), 1))
+
+    results = np.full((len(windows), 3), np.nan)
+    for start in range(0, len(windows), batch):
+        positions = direction * rolling_return_signs(prices, windows[start:start + batch])
+
+        # test() keeps the bars from the second one with a position
+        valid = ~np.isnan(positions)
+        first = np.where(valid.any(axis=1), valid.argmax(axis=1) + 1, len(returns))
+
+        results[start:start + batch] = np.column_stack(
+            strategy_performance(positions, returns, first, trading_cost)
+        )
+
+    return pd.DataFrame(
+        results, index=pd.Index(windows, name="window"), columns=["performance", "out_performance", "trades"]
+    )
+
+
+def forward_fill(values, first=0):
+    """
+    Fills the NaN entries of every row with the last value before them, as Pandas' ffill() followed by fillna(0)
+    on the entries from first on does. Entries before first are ignored (and 0).
+
+    Args:
+        values (2-D array): The values, one series per row
+        first (int) <DEFAULT = 0>: The index of the first entry to consider
+
+    Returns:
+        Returns a 2-D array of the filled values
+    """
+    values = np.array(values, dtype="float64")
+    values[:, :first] = np.nan
+
+    # index of the last value that is not NaN up to every entry
+    index = np.where(np.isnan(values), 0, np.arange(values.shape[1]))
+    np.maximum.accumulate(index, axis=1, out=index)
+
+    filled = np.take_along_axis(values, index, axis=1)
+    return np.nan_to_num(filled, nan=0.0)
+
+
+def strategy_performance(positions, returns, first, trading_cost=0):
+    """
+    Evaluates many position series on the same returns at once, exactly as the vectorized test() methods do: the
+    strategy return of a bar is the previous position times the bar's return, every change of position costs
+    trading_cost, and only the bars from first on count (the bars test() keeps after dropping NaN rows).
+
+    Args:
+        positions (2-D array): One position series (1, 0 or -1 per bar) per row
+        returns (array): The log returns of the bars
+        first (array of int): For every row, the index of the first bar that counts
+        trading_cost (float) <DEFAULT = 0.00>: A static trading cost considered when calculating returns
+
+    Returns:
+        Returns a tuple of arrays with one entry per row, (performance, out_performance) as returned by test() and
+        the number of trades; NaN where no bar counts
+    """
+    positions = np.asarray(positions, dtype="float64")
+    returns = np.asarray(returns, dtype="float64")
+    first = np.asarray(first)
+    count = positions.shape[1]
+
+    bars = np.arange(count)
+    before = bars < first[:, None]
+
+    strategy = np.zeros_like(positions)
+    strategy[:, 1:] = positions[:, :-1] * returns[1:]
+    strategy[before] = 0
+
+    # the first bar that counts has no previous position, so no trade
+    trades = np.zeros_like(positions)
+    trades[:, 1:] = np.abs(np.diff(positions, axis=1))
+    trades[before | (bars == first[:, None])] = 0
+
+    strategy = strategy - trades * trading_cost
+
+    # cumulative sums (and not sums) add the returns in the same order as test()
+    performance = np.exp(np.cumsum(strategy, axis=1)[:, -1])
+    creturns = np.exp(np.cumsum(np.where(before, 0, returns), axis=1)[:, -1])
+
+    trades = trades.sum(axis=1)
+
+    performance[first >= count] = np.nan
+    creturns[first >= count] = np.nan
+    trades[first >= count] = np.nan
+    return performance, performance - creturns, trades
@@ -39,28 +39,19 @@ class IterativeBase:
 
     def acquire_data(self):
         """A general function to acquire data of an instrument from a source."""
-        oanda = tpqoa.tpqoa(self._cfg)
+        oanda = tpqoa.shared(self._cfg)
+        self._precision = oanda.instrument_index().precision(self._instrument)
 
-        bid_df = oanda.get_history(
-            self._instrument, self._start, self._end, self._granularity, "B"
+        # bid and ask closing prices of the same candles in one pass
+        df = oanda.get_history(
+            self._instrument, self._start, self._end, self._granularity, "BA", columns=["c"]
         )
-        ask_df = oanda.get_history(
-            self._instrument, self._start, self._end, self._granularity, "A"
-        )
-
-        bid_price = bid_df.c.to_frame()
-        ask_price = ask_df.c.to_frame()
-
-        spread = ask_price - bid_price
-
-        # create the new dataframe with relevent info
-        df = bid_price
-        df.rename(columns={"c": "bid_price"}, inplace=True)
-        df["ask_price"] = ask_price
-        df["mid_price"] = ask_price - spread
-        df["spread"] = spread
 
-        df.dropna(inplace=True)
+        # create the new dataframe with relevent info (assigned rather than changed in place, the history is a slice)
+        df = df.rename(columns={"bid_c": "bid_price", "ask_c": "ask_price"})
+        df["spread"] = df["ask_price"] - df["bid_price"]
+        df["mid_price"] = df["ask_price"] - df["spread"]
+        df = df[["bid_price", "ask_price", "mid_price", "spread"]].dropna().copy()
 
         df["returns"] = np.log(df.bid_price.div(df.bid_price.shift(1)))
 
@@ -68,9 +59,9 @@ class IterativeBase:
 
     def bar_info(self, bar):
         date = str(self._data.index[bar].date())
-        # round price to 5 as OANDA only gives 5 decimal places
-        price = round(self._data.bid_price.iloc[bar], 5)
-        spread = round(self._data.spread.iloc[bar], 5)
+        # round price to the number of decimal places OANDA quotes the instrument with
+        price = round(self._data.bid_price.iloc[bar], self._precision)
+        spread = round(self._data.spread.iloc[bar], self._precision)
 
         return date, price, spread
 
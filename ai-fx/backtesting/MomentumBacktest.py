@@ -1,6 +1,8 @@
 import numpy as np
 
 from backtesting.Backtester import Backtester
+from backtesting.GridEngine import rolling_return_signs, window_results
+from backtesting.ParallelOptimizer import ParallelOptimizer
 
 
 class MomentumBacktest(Backtester):
@@ -25,6 +27,7 @@ class MomentumBacktest(Backtester):
             trading_cost (float) <DEFAULT = 0.00>: A static trading cost considered when calculating returns
         """
         self._window = window
+        self._surface = None
 
         # passes params to the parent class
         super().__init__(
@@ -58,7 +61,7 @@ class MomentumBacktest(Backtester):
 
         data = self._data.copy()
 
-        data["position"] = np.sign(data["returns"].rolling(window).mean())
+        data["position"] = rolling_return_signs(data["price"], [window])[0]
 
         data["strategy"] = data["position"].shift(1) * data["returns"]
 
@@ -83,12 +86,42 @@ class MomentumBacktest(Backtester):
 
         return performance, out_performance
 
-    def optimize(self, window_range=(1, 252)):
+    def performance_surface(self, window_range=(1, 252)):
+        """
+        Evaluates every window of the range at once, with the same results as test() for each window: the signs of
+        the rolling mean returns of all windows come from the log prices (the prefix sums of the returns), and
+        strategy returns, trades and cost-adjusted cumulative performance are computed for all windows together.
+
+        Args:
+            window_range (tuple(int, int)) <DEFAULT>=(1,252): Range of window values, (X,Y) -> X <= window < Y
+
+        Returns:
+            Returns a Pandas dataframe with one row per window and the columns performance, out_performance (as
+            returned by test()) and trades, e.g. for .plot(y="performance")
+        """
+        return window_results(self._data["price"], self._data["returns"], np.arange(*window_range), self._tc, direction=1)
+
+    def get_surface(self):
+        """
+        Getter function to retrieve the per-window results computed by the last optimize() without search.
+
+        Returns:
+            Returns a Pandas dataframe of the performance, out_performance and trades of every window
+        """
+        if self._surface is not None:
+            return self._surface
+        else:
+            print("Please run .optimize() (without search) first.")
+
+    def optimize(self, window_range=(1, 252), processes=None, search=None):
         """
         Optimizes the lags on the interval [start,end] which allows for the greatest return.
+        All windows are evaluated at once (see performance_surface), the results are kept for get_surface().
 
         Args:
             window_range (tuple(int, int)) <DEFAULT>=(1,252): Range of values for optimization of sliding lags
+            processes (int) <DEFAULT = None>: Evaluates the windows on this many processes (see ParallelOptimizer)
+            search (object) <DEFAULT = None>: A search strategy (see ParameterSearch) evaluating only part of the windows
 
         Returns:
             Returns a tuple, (float: max_return, int: best_window)
@@ -101,23 +134,27 @@ class MomentumBacktest(Backtester):
 
         print("Optimizing strategy...")
 
-        max_return = float("-inf")
-        best_window = 1
-
-        for window in range(window_range[0], window_range[1]):
-
-            if window == (window_range[1] / 4):
-                print("25%...")
-            if window == (window_range[1] / 2):
-                print("50%...")
-            if window == (window_range[1] / 1.5):
-                print("75%...")
-
-            current_return = self.test(window, mute=True)[0]
-
-            if current_return > max_return:
-                max_return = current_return
-                best_window = window
+        if search is not None:
+            # a search evaluates only part of the grid, there is no surface to keep
+            self._surface = None
+            max_return, params = self.search(search, window_range)
+            if params is None:
+                print("No window can be tested on the interval, please check the range.")
+                return
+            best_window, = params
+        else:
+            self._search_report = None
+            if processes:
+                self._surface = ParallelOptimizer(self, processes).surface(window_range)
+            else:
+                self._surface = self.performance_surface(window_range)
+            if self._surface.performance.isna().all():
+                print("No window can be tested on the interval, please check the range.")
+                return
+
+            # the first (smallest) window with the maximum return
+            best_window = int(self._surface.performance.idxmax())
+            max_return = self._surface.performance[best_window]
 
         # save the optimized lags
         self._window = best_window
@@ -1,8 +1,8 @@
 import numpy as np
-import tpqoa
 from sklearn.linear_model import LinearRegression
 
 from backtesting.Backtester import Backtester
+from backtesting.DatasetRegistry import shared_registry
 
 
 class MultipleRegressionModelPredictor(Backtester):
@@ -46,32 +46,13 @@ class MultipleRegressionModelPredictor(Backtester):
         """
         Sets up the backtest data as well as the forward test data
         """
-        oanda = tpqoa.tpqoa('oanda.cfg')
+        registry = shared_registry("oanda.cfg")
 
-        # get data of both periods
-        backtestdf = oanda.get_history(self._instrument, self._startb, self._endb, self._granularity, "M")
-        forwardtestdf = oanda.get_history(self._instrument, self._startf, self._endf, self._granularity, "M")
-
-        # only care for the closing price
-        backtestdf = backtestdf.c.to_frame()
-        backtestdf.rename(columns={"c": "price"}, inplace=True)
-
-        backtestdf.dropna(inplace=True)
-
-        backtestdf["returns"] = np.log(backtestdf.div(backtestdf.shift(1)))
-
-        self._backtest_df = backtestdf
-
-        # only care for the closing price
-        forwardtestdf = forwardtestdf.c.to_frame()
-        forwardtestdf.rename(columns={"c": "price"}, inplace=True)
-
-        forwardtestdf.dropna(inplace=True)
-
-        forwardtestdf["returns"] = np.log(forwardtestdf.div(forwardtestdf.shift(1)))
-
-        self._forwardtest_df = forwardtestdf
+        # one download covering both periods, each period is a slice of it
+        registry.get(self._instrument, self._startb, self._endf, self._granularity)
 
+        self._backtest_df = registry.get(self._instrument, self._startb, self._endb, self._granularity)
+        self._forwardtest_df = registry.get(self._instrument, self._startf, self._endf, self._granularity)
 
     def prepare_data(self):
         """
@@ -0,0 +1,135 @@
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+
+# tasks per process, so that faster processes take over the rest of the grid
+CHUNKS_PER_PROCESS = 4
+
+# the backtest of a pool process and the shared memory block its data lives in
+_backtest = None
+_memory = None
+
+
+def print_progress(done, total):
+    """
+    Default progress report of ParallelOptimizer, prints every 10% of the grid.
+
+    Args:
+        done (int): The number of evaluated chunks
+        total (int): The number of chunks of the grid
+    """
+    if done == total or done * 10 // total != (done - 1) * 10 // total:
+        print(f"{done * 100 // total}%...")
+
+
+def split_range(value_range, pieces):
+    """
+    Splits a range of parameter values into consecutive ranges.
+
+    Args:
+        value_range (tuple(int, int)): The range of values, (X,Y) -> X <= value < Y
+        pieces (int): The maximum number of ranges
+
+    Returns:
+        Returns a list of (X,Y) tuples covering value_range in order
+    """
+    start, stop = value_range
+    pieces = max(1, min(pieces, stop - start))
+    bounds = np.linspace(start, stop, pieces + 1).round().astype(int)
+    return [(int(lo), int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:]) if lo < hi]
+
+
+def _attach(name, shape, columns, cls, state):
+    """Pool initializer: builds the process' backtest around the shared price/returns array, without copying it."""
+    global _backtest, _memory
+
+    # pool processes share the resource tracker of the optimizer's process, which unlinks the block
+    _memory = shared_memory.SharedMemory(name=name)
+
+    values = np.ndarray(shape, dtype="float64", buffer=_memory.buf)
+    values.setflags(write=False)
+
+    _backtest = cls.__new__(cls)
+    _backtest.__dict__.update(state)
+    _backtest._data = pd.DataFrame(values, columns=columns, copy=False)
+
+
+def _evaluate(task):
+    """Evaluates one chunk of the grid in a pool process."""
+    position, ranges = task
+    return position, _backtest.performance_surface(*ranges)
+
+
+class ParallelOptimizer:
+    """
+    Evaluates the parameter grid of a backtest on a pool of processes.
+
+    Works with any Backtester subclass that has a performance_surface(*ranges) method (SMABacktest,
+    BollingerBandsBacktest, MomentumBacktest, ContrarianBacktest). The prepared price and returns arrays are placed
+    in shared memory once; every pool process builds its backtest around them when it starts, so a task only carries
+    parameter ranges. The range of the first parameter is split into chunks, and the chunk results are merged in the
+    order of the parameter values, giving the same surface as backtest.performance_surface(*ranges).
+    """
+    def __init__(self, backtest, processes=None, progress=print_progress):
+        """
+        Initializes the ParallelOptimizer object.
+
+        Args:
+            backtest (object): The backtest whose grid is evaluated, e.g. a SMABacktest object
+            processes (int) <DEFAULT = None>: Number of processes, by default one per CPU
+            progress (function) <DEFAULT = print_progress>: Called as progress(done, total) after every evaluated
+                chunk, None for no progress reports
+        """
+        self._backtest = backtest
+        self._processes = processes or os.cpu_count() or 1
+        self._progress = progress
+
+    def __repr__(self):
+        """Custom Representation."""
+        return f"ParallelOptimizer( backtest={self._backtest!r}, processes={self._processes} )"
+
+    def surface(self, *ranges):
+        """
+        Evaluates the grid spanned by the parameter ranges.
+
+        Args:
+            ranges (tuple(int, int)): The ranges of the parameters, as passed to performance_surface
+
+        Returns:
+            Returns the Pandas dataframe returned by performance_surface for the whole grid
+        """
+        backtest = self._backtest
+        chunks = split_range(ranges[0], self._processes * CHUNKS_PER_PROCESS)
+
+        data = backtest._data[["price", "returns"]]
+        state = {
+            key: value for key, value in backtest.__dict__.items()
+            if key not in ("_data", "_results", "_surface")
+        }
+
+        memory = shared_memory.SharedMemory(create=True, size=max(data.size, 1) * 8)
+        try:
+            values = np.ndarray(data.shape, dtype="float64", buffer=memory.buf)
+            values[:] = data.to_numpy(dtype="float64")
+
+            parts = [None] * len(chunks)
+            with multiprocessing.Pool(
+                min(self._processes, len(chunks)),
+                initializer=_attach,
+                initargs=(memory.name, data.shape, list(data.columns), type(backtest), state),
+            ) as pool:
+                tasks = [(position, (chunk,) + ranges[1:]) for position, chunk in enumerate(chunks)]
+                for done, (position, part) in enumerate(pool.imap_unordered(_evaluate, tasks), 1):
+                    parts[position] = part
+                    if self._progress is not None:
+                        self._progress(done, len(chunks))
+            del values
+        finally:
+            memory.close()
+            memory.unlink()
+
+        return pd.concat(parts)
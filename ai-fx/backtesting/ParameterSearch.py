@@ -0,0 +1,176 @@
+import math
+import warnings
+
+import numpy as np
+from scipy.stats import norm
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import Matern, WhiteKernel
+
+
+def ranked(values):
+    """Returns the positions of values from the best to the worst, NaN last and ties in their original order."""
+    values = np.where(np.isnan(values), -np.inf, values)
+    return np.argsort(-values, kind="stable")
+
+
+class RandomSearch:
+    """Evaluates a random sample of the parameter grid."""
+    def __init__(self, evaluations=60, seed=0):
+        """
+        Initializes the RandomSearch object.
+
+        Args:
+            evaluations (int) <DEFAULT = 60>: Number of parameter combinations to evaluate
+            seed (int) <DEFAULT = 0>: Seed of the random sample
+        """
+        self._evaluations = evaluations
+        self._seed = seed
+
+    def __repr__(self):
+        """Custom Representation."""
+        return f"RandomSearch( evaluations={self._evaluations}, seed={self._seed} )"
+
+    def search(self, grid, evaluate):
+        """
+        Searches the grid for the combination with the greatest return.
+
+        Args:
+            grid (2-D array): One parameter combination per row
+            evaluate (function): evaluate(rows, fraction) returns the performance of the combinations of the grid
+                rows on the first fraction of the data
+
+        Returns:
+            Returns a tuple, (array: rows, array: performance) of the combinations evaluated on all of the data
+        """
+        rng = np.random.default_rng(self._seed)
+        rows = np.sort(rng.choice(len(grid), size=min(self._evaluations, len(grid)), replace=False))
+        return rows, evaluate(rows, 1.0)
+
+
+class SuccessiveHalving:
+    """
+    Evaluates a random sample of the parameter grid on a short prefix of the data, keeps the best 1/eta of the
+    combinations, evaluates them on an eta times longer prefix and so on, until the survivors are evaluated on all of
+    the data. Most evaluations are thus short, and only promising combinations are evaluated on the full period.
+    Combinations that cannot be tested on a prefix are kept until a prefix is long enough.
+    """
+    def __init__(self, candidates=81, eta=3, min_fraction=1 / 9, seed=0):
+        """
+        Initializes the SuccessiveHalving object.
+
+        Args:
+            candidates (int) <DEFAULT = 81>: Number of combinations evaluated on the shortest prefix
+            eta (int) <DEFAULT = 3>: Factor by which the prefix grows and the number of combinations shrinks per round
+            min_fraction (float) <DEFAULT = 1/9>: Fraction of the data in the first round
+            seed (int) <DEFAULT = 0>: Seed of the random sample
+        """
+        self._candidates = candidates
+        self._eta = eta
+        self._min_fraction = min_fraction
+        self._seed = seed
+
+    def __repr__(self):
+        """Custom Representation."""
+        return f"SuccessiveHalving( candidates={self._candidates}, eta={self._eta}, min_fraction={self._min_fraction}, seed={self._seed} )"
+
+    def search(self, grid, evaluate):
+        """
+        Searches the grid for the combination with the greatest return.
+
+        Args:
+            grid (2-D array): One parameter combination per row
+            evaluate (function): evaluate(rows, fraction) returns the performance of the combinations of the grid
+                rows on the first fraction of the data
+
+        Returns:
+            Returns a tuple, (array: rows, array: performance) of the combinations evaluated on all of the data
+        """
+        rng = np.random.default_rng(self._seed)
+        rows = np.sort(rng.choice(len(grid), size=min(self._candidates, len(grid)), replace=False))
+
+        rounds = max(0, round(math.log(1 / self._min_fraction, self._eta)))
+        for step in range(rounds):
+            fraction = self._eta ** (step - rounds)
+            performance = evaluate(rows, fraction)
+
+            # combinations that cannot be tested on the prefix (e.g. windows longer than it) go on to the next round
+            untested = np.isnan(performance)
+            survivors = math.ceil((~untested).sum() / self._eta)
+            rows = np.sort(np.concatenate((rows[ranked(performance)[:survivors]], rows[untested])))
+
+        return rows, evaluate(rows, 1.0)
+
+
+class SurrogateSearch:
+    """
+    Evaluates a random sample of the parameter grid, then fits a Gaussian process to the returns evaluated so far
+    and evaluates the combination with the greatest expected improvement, one at a time.
+    """
+    def __init__(self, evaluations=60, initial=15, seed=0):
+        """
+        Initializes the SurrogateSearch object.
+
+        Args:
+            evaluations (int) <DEFAULT = 60>: Number of parameter combinations to evaluate
+            initial (int) <DEFAULT = 15>: Number of them sampled at random before the model is used
+            seed (int) <DEFAULT = 0>: Seed of the random sample and of the model fit
+        """
+        self._evaluations = evaluations
+        self._initial = initial
+        self._seed = seed
+
+    def __repr__(self):
+        """Custom Representation."""
+        return f"SurrogateSearch( evaluations={self._evaluations}, initial={self._initial}, seed={self._seed} )"
+
+    def search(self, grid, evaluate):
+        """
+        Searches the grid for the combination with the greatest return.
+
+        Args:
+            grid (2-D array): One parameter combination per row
+            evaluate (function): evaluate(rows, fraction) returns the performance of the combinations of the grid
+                rows on the first fraction of the data
+
+        Returns:
+            Returns a tuple, (array: rows, array: performance) of the combinations evaluated on all of the data
+        """
+        rng = np.random.default_rng(self._seed)
+        budget = min(self._evaluations, len(grid))
+
+        # parameters scaled to [0, 1], so one length scale fits every parameter
+        span = np.ptp(grid, axis=0)
+        points = (grid - grid.min(axis=0)) / np.where(span > 0, span, 1)
+
+        rows = list(rng.choice(len(grid), size=min(self._initial, budget), replace=False))
+        performance = list(evaluate(np.array(rows), 1.0))
+
+        model = GaussianProcessRegressor(
+            Matern(length_scale=0.2, nu=2.5) + WhiteKernel(), normalize_y=True, random_state=self._seed
+        )
+        while len(rows) < budget:
+            known = ~np.isnan(performance)
+            if known.sum() < 2:
+                candidates = np.setdiff1d(np.arange(len(grid)), rows)
+                row = rng.choice(candidates)
+            else:
+                # log returns, as the returns of a strategy are products of the returns of its bars
+                target = np.log(np.array(performance)[known])
+                # the noise level often settles at its lower bound on near-deterministic returns, which is fine here
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", ConvergenceWarning)
+                    model.fit(points[np.array(rows)[known]], target)
+
+                mean, std = model.predict(points, return_std=True)
+                std = np.maximum(std, 1e-12)
+                z = (mean - target.max()) / std
+                improvement = (mean - target.max()) * norm.cdf(z) + std * norm.pdf(z)
+                improvement[rows] = -np.inf
+                row = int(np.argmax(improvement))
+
+            rows.append(row)
+            performance.append(evaluate(np.array([row]), 1.0)[0])
+
+        order = np.argsort(rows)
+        return np.array(rows)[order], np.array(performance)[order]
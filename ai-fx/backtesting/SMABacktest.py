@@ -1,6 +1,9 @@
 import numpy as np
+import pandas as pd
 
 from backtesting.Backtester import Backtester
+from backtesting.GridEngine import rolling_means, strategy_performance
+from backtesting.ParallelOptimizer import ParallelOptimizer
 
 
 class SMABacktest(Backtester):
@@ -20,6 +23,7 @@ class SMABacktest(Backtester):
         """
         self._smas = smas
         self._smal = smal
+        self._surface = None
 
         # passes params to the parent class
         super().__init__(
@@ -106,11 +110,67 @@ class SMABacktest(Backtester):
 
         return performance, out_performance
 
-    def optimize(self):
+    def performance_surface(self, smas_range=(10, 50), smal_range=(100, 252)):
+        """
+        Computes the performance of every (smas, smal) pair at once, with the same results as test() for each pair.
+        Every moving average is computed once and all smas values of a smal are evaluated together as 2-D arrays.
+
+        Args:
+            smas_range (tuple: int) <DEFAULT = (10, 50)>: The range of smas values, (X,Y) -> X <= smas < Y
+            smal_range (tuple: int) <DEFAULT = (100, 252)>: The range of smal values, (X,Y) -> X <= smal < Y
+
+        Returns:
+            Returns a Pandas dataframe of the performance (as returned by test()) with one row per smas and one
+            column per smal; pairs with smas >= smal are NaN
+        """
+        prices = self._data["price"].to_numpy()
+        returns = self._data["returns"].to_numpy()
+
+        smas = np.arange(*smas_range)
+        smal = np.arange(*smal_range)
+
+        short = rolling_means(prices, smas)
+        surface = np.full((len(smas), len(smal)), np.nan)
+
+        for column, window in enumerate(smal):
+            long = rolling_means(prices, [window])[0]
+
+            # comparisons with NaN (before both averages exist) are False, as in test()
+            positions = np.where(short > long, 1, -1)
+
+            # test() keeps the bars from where both averages and the returns exist
+            first = np.maximum(np.maximum(smas, window) - 1, 1)
+
+            performance = strategy_performance(positions, returns, first, self._tc)[0]
+            surface[:, column] = np.where(smas < window, performance, np.nan)
+
+        return pd.DataFrame(
+            surface, index=pd.Index(smas, name="smas"), columns=pd.Index(smal, name="smal")
+        )
+
+    def get_surface(self):
+        """
+        Getter function to retrieve the performance surface computed by the last optimize() without search.
+
+        Returns:
+            Returns a Pandas dataframe of the performance of every (smas, smal) pair
+        """
+        if self._surface is not None:
+            return self._surface
+        else:
+            print("Please run .optimize() (without search) first.")
+
+    def optimize(self, smas_range=(10, 50), smal_range=(100, 252), processes=None, search=None):
         """
         Optimizes the smas and smal on the interval [start,end] which allows for the greatest return.
-        This function attempts all combinations of: smas Days [10,50] & smal Days [100,252], so depending on the
-        length of the interval, it can take some time to compute.
+        This function evaluates all combinations of: smas Days [10,50] & smal Days [100,252] by default
+        (see performance_surface), the full surface is kept for get_surface().
+
+        Args:
+            smas_range (tuple: int) <DEFAULT = (10, 50)>: The range of smas values, (X,Y) -> X <= smas < Y
+            smal_range (tuple: int) <DEFAULT = (100, 252)>: The range of smal values, (X,Y) -> X <= smal < Y
+            processes (int) <DEFAULT = None>: Evaluates the grid on this many processes (see ParallelOptimizer)
+            search (object) <DEFAULT = None>: A search strategy (see ParameterSearch) evaluating only part of the grid
 
         Returns:
             Returns a tuple, (float: max_return, int: GSMAS, int: GSMAL)
@@ -118,31 +178,35 @@ class SMABacktest(Backtester):
             -> "GSMAS" is the optimized global smas value that maximizes return
             -> "GSMAL" is the optimized global smal value that maximizes return
         """
+        if smas_range[0] >= smas_range[1] or smal_range[0] >= smal_range[1]:
+            print("The ranges must satisfy: (X,Y) -> X < Y")
+            return
 
         print("Optimizing strategy...")
 
-        max_return = float("-inf")
-        GSMAS = -1
-        GSMAL = -1
-
-        for SMAS in range(10, 50):
-
-            if SMAS == 13:
-                print("25%...")
-            if SMAS == 25:
-                print("50%...")
-            if SMAS == 38:
-                print("75%...")
-
-            for SMAL in range(100, 252):
-
-                self.set_params(SMAS, SMAL)
-                current_return = self.test(mute=True)[0]
+        if search is not None:
+            # a search evaluates only part of the grid, there is no surface to keep
+            self._surface = None
+            max_return, params = self.search(search, smas_range, smal_range)
+            if params is None:
+                print("No (smas, smal) pair can be tested on the interval, please check the ranges.")
+                return
+            GSMAS, GSMAL = params
+        else:
+            self._search_report = None
+            if processes:
+                self._surface = ParallelOptimizer(self, processes).surface(smas_range, smal_range)
+            else:
+                self._surface = self.performance_surface(smas_range, smal_range)
+            if self._surface.isna().all().all():
+                print("No (smas, smal) pair can be tested on the interval, please check the ranges.")
+                return
 
-                if current_return > max_return:
-                    max_return = current_return
-                    GSMAS = SMAS
-                    GSMAL = SMAL
+            # the first maximum in the order of the smas and smal values
+            row, column = np.unravel_index(np.nanargmax(self._surface.to_numpy()), self._surface.shape)
+            max_return = self._surface.iloc[row, column]
+            GSMAS = int(self._surface.index[row])
+            GSMAL = int(self._surface.columns[column])
 
         self.set_params(GSMAS, GSMAL)
         self.test(mute=True)
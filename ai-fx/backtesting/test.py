@@ -0,0 +1,170 @@
+#
+# Regression tests of the vectorized backtests: the grid evaluations
+# (performance_surface, optimize with processes) must give the same
+# results as test() for every parameter combination.
+#
+# With TPQOA_FAKE set, the data comes from a local FakeOanda server;
+# run from the ai-fx directory with tpqoa installed:
+#
+#   TPQOA_FAKE=1 python -m pytest -q backtesting/test.py
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from tpqoa.fakeserver import FakeOanda
+
+from backtesting.BollingerBandsBacktest import BollingerBandsBacktest
+from backtesting.ContrarianBacktest import ContrarianBacktest
+from backtesting.DatasetRegistry import shared_registry
+from backtesting.MomentumBacktest import MomentumBacktest
+from backtesting.ParameterSearch import RandomSearch, SuccessiveHalving, SurrogateSearch
+from backtesting.SMABacktest import SMABacktest
+
+# with TPQOA_FAKE set, the suite runs against a local FakeOanda server
+fake = None
+cwd = os.getcwd()
+
+INTERVAL = ("EUR_USD", "2020-01-01", "2020-04-01")
+GRANULARITY = "H1"
+TRADING_COST = 0.00007
+
+
+class Recorded:
+    """Search strategy passing on to another one, recording its evaluations and its result."""
+    def __init__(self, strategy):
+        self.strategy = strategy
+        self.calls = []
+        self.result = None
+
+    def search(self, grid, evaluate):
+        def recorded(rows, fraction):
+            self.calls.append((len(rows), fraction))
+            return evaluate(rows, fraction)
+
+        self.result = self.strategy.search(grid, recorded)
+        return self.result
+
+
+def setUpModule():
+    global fake
+    if os.environ.get("TPQOA_FAKE"):
+        fake = FakeOanda().start()
+        os.chdir(tempfile.mkdtemp())
+        fake.write_config("oanda.cfg")
+
+
+def tearDownModule():
+    if fake is not None:
+        fake.stop()
+        shutil.rmtree(os.getcwd(), ignore_errors=True)
+        os.chdir(cwd)
+
+
+class TestBacktesting(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        registry = shared_registry("oanda.cfg")
+        registry.clear()
+        cls.downloads = registry.downloads
+
+        cls.sma = SMABacktest(*INTERVAL, 10, 50, GRANULARITY, TRADING_COST)
+        cls.bollinger = BollingerBandsBacktest(*INTERVAL, 20, 2, GRANULARITY, TRADING_COST)
+        cls.momentum = MomentumBacktest(*INTERVAL, 1, GRANULARITY, TRADING_COST)
+        cls.contrarian = ContrarianBacktest(*INTERVAL, 1, GRANULARITY, TRADING_COST)
+
+        cls.downloads = registry.downloads - cls.downloads
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_shared_dataset(self):
+        self.assertEqual(self.downloads, 1)
+        # strategies without extra columns hold the shared dataset itself
+        self.assertIs(self.momentum.get_data(), self.contrarian.get_data())
+        self.assertFalse(self.momentum.get_data()["price"].to_numpy().flags.writeable)
+
+    def test_sma_surface(self):
+        surface = self.sma.performance_surface((5, 25), (30, 60))
+        for smas, smal in zip(self.rng.choice(surface.index, 8), self.rng.choice(surface.columns, 8)):
+            self.sma.set_params(int(smas), int(smal))
+            self.assertEqual(surface.at[smas, smal], self.sma.test(mute=True)[0])
+
+    def test_bollinger_surface(self):
+        surface = self.bollinger.performance_surface((2, 60), (1, 4))
+        for sma, deviation in zip(self.rng.choice(surface.index, 8), self.rng.choice(surface.columns, 8)):
+            self.bollinger.set_params(int(sma), int(deviation))
+            self.assertEqual(surface.at[sma, deviation], self.bollinger.test(mute=True)[0])
+
+    def test_window_surfaces(self):
+        for backtest in (self.momentum, self.contrarian):
+            surface = backtest.performance_surface((1, 120))
+            for window in self.rng.choice(surface.index, 8):
+                performance, out_performance = backtest.test(int(window), mute=True)
+                self.assertEqual(surface.at[window, "performance"], performance)
+                self.assertEqual(surface.at[window, "out_performance"], out_performance)
+
+    def test_parallel_optimize(self):
+        cases = [
+            (self.sma, ((5, 25), (30, 60))),
+            (self.bollinger, ((2, 60), (1, 4))),
+            (self.momentum, ((1, 120),)),
+            (self.contrarian, ((1, 120),)),
+        ]
+        for backtest, ranges in cases:
+            serial = backtest.optimize(*ranges)
+            surface = backtest.get_surface()
+            self.assertEqual(backtest.optimize(*ranges, processes=2), serial)
+            self.assertTrue(backtest.get_surface().equals(surface))
+
+    def test_search_strategies(self):
+        cases = [
+            (self.sma, ((5, 25), (30, 60)), 20 * 30),
+            (self.momentum, ((1, 400),), 399),
+        ]
+        for backtest, ranges, grid_size in cases:
+            for strategy in (RandomSearch, SuccessiveHalving, SurrogateSearch):
+                runs = []
+                for seed in (0, 0, 1):
+                    recorded = Recorded(strategy(seed=seed))
+                    runs.append((backtest.search(recorded, *ranges), recorded))
+
+                    report = backtest.get_search_report()
+                    self.assertEqual(report["grid_size"], grid_size)
+                    self.assertEqual(report["evaluations"], sum(rows for rows, _ in recorded.calls))
+                    self.assertAlmostEqual(report["full_evaluations"], sum(rows * fraction for rows, fraction in recorded.calls))
+
+                # deterministic per seed
+                (first, first_recorded), (second, second_recorded), (other, other_recorded) = runs
+                self.assertEqual(first, second)
+                self.assertEqual(first_recorded.calls, second_recorded.calls)
+                np.testing.assert_array_equal(first_recorded.result[0], second_recorded.result[0])
+                self.assertFalse(np.array_equal(first_recorded.result[0], other_recorded.result[0]))
+
+    def test_successive_halving_carry_over(self):
+        # windows longer than the shorter prefixes are carried over untested
+        recorded = Recorded(SuccessiveHalving())
+        self.momentum.search(recorded, (1, 1000))
+        rows, performance = recorded.result
+        self.assertEqual(recorded.calls[-1], (len(rows), 1.0))
+
+        windows = rows + 1
+        self.assertTrue((windows > len(self.momentum.get_data()) / 3).any())
+        surface = self.momentum.performance_surface((1, 1000))
+        np.testing.assert_array_equal(performance, surface.performance.loc[windows].to_numpy())
+
+    def test_search_resets_surface(self):
+        self.sma.optimize((5, 25), (30, 60))
+        self.assertIsNone(self.sma.get_search_report())
+        self.sma.optimize((5, 25), (30, 60), search=RandomSearch(evaluations=10))
+        self.assertIsNone(self.sma.get_surface())
+        self.assertEqual(self.sma.get_search_report()["evaluations"], 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
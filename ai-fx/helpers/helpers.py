@@ -1,4 +1,5 @@
 
+import pandas as pd
 import tpqoa
 
 import matplotlib.pyplot as plt
@@ -12,31 +13,47 @@ class helpers():
         # WARNING: the smaller the granularity, the less frequently the price change will
         # be able to cover the trading costs
 
-        oanda = tpqoa.tpqoa(cfg)
+        oanda = tpqoa.shared(cfg)
 
-        bid_price = oanda.get_history(instrument=instrument, start=start, end=end, granularity="M5", price="B", localize=False).c.dropna().to_frame()
-        ask_price = oanda.get_history(instrument=instrument, start=start, end=end, granularity="M5", price="A", localize=False).c.dropna().to_frame()
+        # bid and ask closing prices of the same candles in one pass, processed page by page
+        pages = (page.dropna() for page in oanda.iter_history(
+            instrument=instrument, start=start, end=end, granularity="M5", price="BA", localize=False, columns=["c"]
+        ))
 
         if granularity != "M5":
-            bid_price = bid_price.resample(granularity).last().dropna()
-            ask_price = ask_price.resample(granularity).last().dropna()
+            pages = (page.dropna() for page in tpqoa.resample_pages(pages, granularity, "last", label="left"))
 
-        spread = ask_price - bid_price
-        data = bid_price
+        covered = 0
+        counts = 0
+        last_mid_price = None
+        for data in pages:
+            data = data.rename(columns={"bid_c": "bid_price", "ask_c": "ask_price"})
 
-        data.rename(columns={"c": "bid_price"}, inplace=True)
+            spread = data["ask_price"] - data["bid_price"]
+            data["mid_price"] = data["ask_price"] - spread
+            data["spread"] = spread
 
-        data["ask_price"] = ask_price
-        data["mid_price"] = ask_price - spread
-        data["spread"] = spread
+            data["hour"] = data.index.hour
 
-        data["hour"] = data.index.hour
+            # carry the last price over the page boundary
+            data["price_change"] = data["mid_price"].diff()
+            if last_mid_price is not None:
+                data.iloc[0, data.columns.get_loc("price_change")] = data["mid_price"].iloc[0] - last_mid_price
+            data["price_change"] = data["price_change"].abs()
+            last_mid_price = data["mid_price"].iloc[-1]
 
-        data["price_change"] = data["mid_price"].diff().abs()
+            data["covered_costs"] = data["price_change"] > data["spread"]
 
-        data["covered_costs"] = data["price_change"] > data["spread"]
+            by_hour = data.groupby("hour")["covered_costs"]
+            covered = by_hour.sum().add(covered, fill_value=0)
+            counts = by_hour.count().add(counts, fill_value=0)
 
-        hourly_grouping = data.groupby("hour")["covered_costs"].mean()
+        # no candles at all, e.g. over a closed market
+        if not isinstance(counts, pd.Series) or not counts.sum():
+            print("No candles in the range, nothing to group.")
+            return pd.Series(dtype=float, index=pd.Index([], name="hour"), name="covered_costs")
+
+        hourly_grouping = covered / counts
 
         hourly_grouping.plot(kind="bar", figsize=(12,8), fontsize=13)
         plt.xlabel("UTC Hour")
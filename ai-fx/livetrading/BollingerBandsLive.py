@@ -15,6 +15,7 @@ class BollingerBandsLive(LiveTrader):
         stop_datetime=None,
         stop_loss=None,
         stop_profit=None,
+        start_stream=True,
     ):
         """
         Initializes the BollingerBandsLive object.
@@ -29,6 +30,7 @@ class BollingerBandsLive(LiveTrader):
             stop_datetime (object) <DEFAULT = None>: A datetime object that when passed stops trading
             stop_loss (float) <DEFAULT = None>: A stop loss that when profit goes below stops trading
             stop_profit (float) <DEFAULT = None>: A stop profit that when profit goes above stops trading
+            start_stream (bool) <DEFAULT = True>: Opens the trading stream right away
         """
         self._sma = sma
         self._deviation = deviation
@@ -42,6 +44,7 @@ class BollingerBandsLive(LiveTrader):
             stop_datetime=stop_datetime,
             stop_loss=stop_loss,
             stop_profit=stop_profit,
+            start_stream=start_stream,
         )
 
     def define_strategy(self):
@@ -20,6 +20,8 @@ class LiveTrader(tpqoa.tpqoa):
         stop_datetime=None,
         stop_loss=None,
         stop_profit=None,
+        start_stream=True,
+        account=None,
     ):
         """
         Initializes the LiveTrader object.
@@ -33,21 +35,18 @@ class LiveTrader(tpqoa.tpqoa):
             stop_datetime (object) <DEFAULT = None>: A datetime object that when passed stops trading
             stop_loss (float) <DEFAULT = None>: A stop loss that when profit goes below stops trading
             stop_profit (float) <DEFAULT = None>: A stop profit that when profit goes above stops trading
+            start_stream (bool) <DEFAULT = True>: Opens the trading stream right away, pass False to stream several traders together with stream_traders()
+            account (object) <DEFAULT = None>: The tpqoa AccountState shared by the traders of the account, by default one is started with the stream
+                (and stopped when it ends) or given by stream_traders()
         """
-        # TODO: More rigorous handling of markets being closed (this is EST dependent, must ensure that is what the datetime is giving)
-        if datetime.today().weekday() >= 6 and datetime.today().hour >= 17:
-            print("Markets are open.")
-        elif datetime.today().weekday() == 6 and datetime.today().hour < 17:
-            raise Exception("Sorry, markets are closed")
-        elif datetime.today().weekday() == 5:
-            raise Exception("Sorry, markets are closed")
-        elif datetime.today().weekday() >= 4 and datetime.today().hour >= 5:
-            raise Exception("Sorry, markets are closed")
-        else:
-            print("Markets are open, beginning trading session.")
-
         # passes the config file to tpqoa
         super().__init__(cfg)
+
+        # market hours from the trading calendar (UTC, daylight saving aware), None for instruments other than currency pairs
+        self._calendar = self.instrument_calendar(instrument)
+        if self._calendar is not None and not self._calendar.is_open(pd.Timestamp.utcnow()):
+            raise Exception("Sorry, markets are closed")
+        print("Markets are open, beginning trading session.")
         self._instrument = instrument
         self._bar_length = pd.to_timedelta(bar_length)
         self._tick_data = pd.DataFrame()
@@ -71,15 +70,95 @@ class LiveTrader(tpqoa.tpqoa):
         self._profits = []
         self._profit = 0
 
-        # set up history used by some trades
-        self.setup_history(history_days)
+        # P&L realized by the trader's own fills and the trades they left open
+        self._realized = 0
+        self._trades = set()
+
+        # balance, positions and P&L kept locally from the transactions stream, one per account
+        self._account = account
+        self._own_account = False
+        if self._account is None and start_stream:
+            self._account = self.account_state()
+            self._own_account = True
+
+        try:
+            # set up history used by some trades
+            self.setup_history(history_days)
+
+            if start_stream:
+                self.stream_data_supervised(self._instrument, on_gap=self.backfill)
+        finally:
+            # the trader's own transactions stream ends with its price stream
+            self.stop_account()
+
+    @staticmethod
+    def stream_traders(cfg, traders):
+        """
+        Streams the instruments of several traders on one connection, dispatching each tick to the
+        traders of its instrument. An instrument stops streaming once its traders hit a stop condition.
+        Traders created without an account share one AccountState, following one transactions stream.
 
-        self.stream_data(self._instrument)
+        Args:
+            cfg (object): An object representing the OANDA connection
+            traders (list): LiveTrader objects created with start_stream=False
+        """
+        client = tpqoa.tpqoa(cfg)
+
+        account = None
+        if any(trader._account is None for trader in traders):
+            account = client.account_state()
+            for trader in traders:
+                if trader._account is None:
+                    trader._account = account
+
+        by_instrument = {}
+        for trader in traders:
+            by_instrument.setdefault(trader._instrument, []).append(trader)
+
+        def dispatcher(group):
+            def on_tick(instrument, time, bid, ask):
+                for trader in group:
+                    if not trader.stop_stream:
+                        trader.on_success(time, bid, ask)
+                if all(trader.stop_stream for trader in group):
+                    client.stop_instrument(instrument)
+            return on_tick
+
+        def backfill(instrument, last, time):
+            for trader in by_instrument[instrument]:
+                if not trader.stop_stream:
+                    trader.backfill(instrument, last, time)
+
+        try:
+            client.stream_data_supervised(
+                list(by_instrument),
+                callback={instrument: dispatcher(group) for instrument, group in by_instrument.items()},
+                on_gap=backfill,
+            )
+        finally:
+            if account is not None:
+                account.stop()
 
     def __del__(self):
         """Destructor used to ensure closing of position when object expires."""
         # close out position
         self.close_position()
+        self.stop_account()
+
+    def get_account(self):
+        """
+        Returns the trader's AccountState. A trader neither streaming on its own nor through stream_traders() gets an
+        account snapshot on first use, kept up to date by the trader's own fills (without a transactions stream).
+        """
+        if self._account is None:
+            self._account = tpqoa.AccountState(self).bootstrap()
+        return self._account
+
+    def stop_account(self):
+        """Stops the transactions stream of the AccountState the trader started itself (shared ones are left running)."""
+        if self._own_account:
+            self._account.stop()
+            self._own_account = False
 
     # used to gather historical data used by some strategies
     def setup_history(self, days=1):
@@ -100,6 +179,7 @@ class LiveTrader(tpqoa.tpqoa):
                         granularity="S5",
                         price="M",
                         localize=False,
+                        columns=["c"],
                     )
                     .c.dropna()
                     .to_frame()
@@ -145,6 +225,13 @@ class LiveTrader(tpqoa.tpqoa):
 
         recent_tick = pd.to_datetime(time)
 
+        # realized plus unrealized P&L of the trader's own trades in the account currency, no API calls
+        account = self.get_account()
+        account.update_price(self._instrument, bid, ask)
+        self._profit = self._realized + account.unrealized_pl(
+            self._instrument, trades=self._trades
+        )
+
         stopped = False
 
         if self._stop_datetime:
@@ -183,13 +270,18 @@ class LiveTrader(tpqoa.tpqoa):
             # the last row (as it can be far off the resampled granularity)
             if (recent_tick - self._last_tick) >= self._bar_length:
 
-                # append the most recent resampled ticks to self._data
-                self._raw_data = self._raw_data.append(
+                bars = (
                     self._tick_data.resample(self._bar_length, label="right")
                     .last()
                     .ffill()
                     .iloc[:-1]
                 )
+                # bars padded over a closed market are not real bars
+                if self._calendar is not None:
+                    bars = bars[self._calendar.is_open(bars.index - self._bar_length)]
+
+                # append the most recent resampled ticks to self._data
+                self._raw_data = self._raw_data.append(bars)
 
                 # only keep the last tick bar (which is a pandas DataFrame)
                 self._tick_data = self._tick_data.iloc[-1:]
@@ -198,6 +290,55 @@ class LiveTrader(tpqoa.tpqoa):
                 self.define_strategy()
                 self.trade()
 
+    def backfill(self, instrument, last, time):
+        """
+        Fills the ticks missed while the stream was interrupted with the bid and ask closes of the
+        S5 candles in between, so the next bars are built as if the stream had not been interrupted.
+        Called by the supervised stream after a reconnect, before the first new tick.
+
+        Args:
+            instrument (string): The instrument of the interrupted stream
+            last (string): Time of the last tick before the interruption
+            time (string): Time of the first tick after the interruption
+        """
+        start = pd.to_datetime(last).tz_localize(None)
+        end = pd.to_datetime(time).tz_localize(None)
+        # nothing was missed while the market was closed
+        if end - start < pd.Timedelta(seconds=5):
+            return
+        if self._calendar is not None and self._calendar.open_seconds(start, end) == 0:
+            return
+
+        candles = self.get_history(
+            instrument=instrument,
+            start=start,
+            end=end,
+            granularity="S5",
+            price="BA",
+            localize=False,
+            columns=["c"],
+        )
+        # a candle's close is its last price 5 seconds after its start
+        candles.index = candles.index + pd.Timedelta(seconds=5)
+        candles = candles[
+            (candles.index > start.tz_localize("UTC"))
+            & (candles.index < end.tz_localize("UTC"))
+        ]
+        if candles.empty:
+            return
+
+        df = pd.DataFrame(
+            {
+                "bid_price": candles.bid_c,
+                "ask_price": candles.ask_c,
+                "mid_price": (candles.ask_c + candles.bid_c) / 2,
+                "spread": candles.ask_c - candles.bid_c,
+            },
+            index=candles.index,
+        )
+        self._tick_data = self._tick_data.append(df)
+        print(f"Backfilled {len(df)} S5 candles between {last} and {time}.")
+
     def define_strategy(self):
         pass
 
@@ -271,10 +412,18 @@ class LiveTrader(tpqoa.tpqoa):
         price = order["price"]
         profit = float(order["pl"])
 
+        # the fill is applied right away, the stream delivers it again later
+        self.get_account().apply(order)
         self._profits.append(profit)
 
-        cum_profits = sum(self._profits)
-        self._profit = cum_profits
+        # only the trader's own fills count towards its P&L
+        for closed in order.get("tradesClosed") or []:
+            self._trades.discard(str(closed["tradeID"]))
+        if order.get("tradeOpened"):
+            self._trades.add(str(order["tradeOpened"]["tradeID"]))
+        self._realized += profit
+
+        cum_profits = self._realized
 
         print(
             f"{time} : {position} --- {units} units, price of ${price}, profit of ${profit}, cum profit of ${cum_profits}"
@@ -19,6 +19,7 @@ class MLClassificationLive(LiveTrader):
         stop_datetime=None,
         stop_loss=None,
         stop_profit=None,
+        start_stream=True,
     ):
         """
         Initializes the MLClassificationLive object.
@@ -33,8 +34,10 @@ class MLClassificationLive(LiveTrader):
             stop_datetime (object) <DEFAULT = None>: A datetime object that when passed stops trading
             stop_loss (float) <DEFAULT = None>: A stop loss that when profit goes below stops trading
             stop_profit (float) <DEFAULT = None>: A stop profit that when profit goes above stops trading
+            start_stream (bool) <DEFAULT = True>: Opens the trading stream right away
         """
         # some of this info is needed by fit_model(), so we must set it in the child class
+        self._cfg = cfg
         self._instrument = instrument
         self._bar_length = pd.to_timedelta(bar_length)
         self._lags = lags
@@ -51,6 +54,7 @@ class MLClassificationLive(LiveTrader):
             stop_datetime=stop_datetime,
             stop_loss=stop_loss,
             stop_profit=stop_profit,
+            start_stream=start_stream,
         )
 
     def fit_model(self):
@@ -59,21 +63,24 @@ class MLClassificationLive(LiveTrader):
         now = now.replace(microsecond=0)
         past = now - timedelta(days=7)
 
-        oanda = tpqoa.tpqoa("oanda.cfg")
+        # the trader is not connected yet (fit_model() runs before LiveTrader.__init__), so the shared client of
+        # the config is used; the S5 candles are resampled page by page so that only the bars are kept in memory
+        oanda = tpqoa.shared(self._cfg)
+        pages = (page.dropna() for page in oanda.iter_history(
+            instrument=self._instrument, start=past, end=now, granularity="S5", price="M", localize=False, columns=["c"]
+        ))
+        data = pd.concat(tpqoa.resample_pages(pages, self._bar_length, "last", label="right"))
 
-        mid_price = oanda.get_history(instrument=self._instrument, start=past, end=now, granularity="S5", price="M", localize=False).c.dropna().to_frame()
-
-        data = mid_price
         data.rename(columns={"c": "mid_price"}, inplace=True)
 
-        data = data.resample(self._bar_length, label="right").last().dropna().iloc[:-1]
+        data = data.dropna().iloc[:-1]
 
         data["returns"] = np.log(data.div(data.shift(1)))
         data.dropna(inplace=True)
 
         data["direction"] = np.sign(data["returns"])
 
-        pd.set_option("max_columns", None)
+        pd.set_option("display.max_columns", None)
 
         feature_columns = []
 
@@ -14,6 +14,7 @@ class MomentumLive(LiveTrader):
         stop_datetime=None,
         stop_loss=None,
         stop_profit=None,
+        start_stream=True,
     ):
         """
         Initializes the MomentumLive object.
@@ -27,6 +28,7 @@ class MomentumLive(LiveTrader):
             stop_datetime (object) <DEFAULT = None>: A datetime object that when passed stops trading
             stop_loss (float) <DEFAULT = None>: A stop loss that when profit goes below stops trading
             stop_profit (float) <DEFAULT = None>: A stop profit that when profit goes above stops trading
+            start_stream (bool) <DEFAULT = True>: Opens the trading stream right away
         """
         self._window = window
 
@@ -39,6 +41,7 @@ class MomentumLive(LiveTrader):
             stop_datetime=stop_datetime,
             stop_loss=stop_loss,
             stop_profit=stop_profit,
+            start_stream=start_stream,
         )
 
     def define_strategy(self):
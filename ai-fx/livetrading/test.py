@@ -0,0 +1,95 @@
+#
+# Tests of the live traders against a local FakeOanda server
+# (with TPQOA_FAKE set); run from the ai-fx directory with tpqoa installed:
+#
+#   TPQOA_FAKE=1 python -m pytest -q livetrading/test.py
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from tpqoa.fakeserver import FakeOanda
+
+from livetrading.LiveTrader import LiveTrader
+from livetrading.MLClassificationLive import MLClassificationLive
+
+# with TPQOA_FAKE set, the suite runs against a local FakeOanda server
+fake = None
+cwd = os.getcwd()
+
+# a metal trades without the FX session calendar, so the tests run on weekends as well
+INSTRUMENT = "XAU_USD"
+
+
+def setUpModule():
+    global fake
+    if os.environ.get("TPQOA_FAKE"):
+        fake = FakeOanda(market_hours=False).start()
+        os.chdir(tempfile.mkdtemp())
+        fake.write_config("oanda.cfg")
+
+
+def tearDownModule():
+    if fake is not None:
+        fake.stop()
+        shutil.rmtree(os.getcwd(), ignore_errors=True)
+        os.chdir(cwd)
+
+
+class TestLiveTrader(unittest.TestCase):
+
+    def test_backfill(self):
+        trader = LiveTrader("oanda.cfg", INSTRUMENT, "1min", 1, history_days=0, start_stream=False)
+        # stream tick times have nanoseconds
+        trader.backfill(INSTRUMENT, "2020-06-03T12:00:01.123456789Z", "2020-06-03T12:01:00.987654321Z")
+        self.assertEqual(len(trader._tick_data), 11)
+        self.assertTrue((trader._tick_data.index > pd.Timestamp("2020-06-03T12:00:01Z")).all())
+        self.assertTrue((trader._tick_data.spread > 0).all())
+
+    @unittest.skipIf(not os.environ.get("TPQOA_FAKE"), "needs a FakeOanda server")
+    def test_backfill_stream_gap(self):
+        trader = LiveTrader("oanda.cfg", INSTRUMENT, "1min", 1, history_days=0, start_stream=False)
+        ticks = []
+
+        def on_tick(instrument, time, bid, ask):
+            ticks.append(time)
+            if len(ticks) == 2:
+                # a stalled connection, reconnected after stale_after seconds (long enough to miss whole S5 candles)
+                fake.pause_streams(15)
+
+        trader.stream_data_supervised(INSTRUMENT, stop=4, callback=on_tick, on_gap=trader.backfill, stale_after=11)
+        self.assertGreaterEqual(trader.reconnects, 1)
+        self.assertFalse(trader._tick_data.empty)
+        gap = trader._tick_data.index
+        self.assertTrue(((gap > pd.Timestamp(ticks[1])) & (gap < pd.Timestamp(ticks[2]))).all())
+
+    def test_own_account_stopped(self):
+        # stops at the first tick
+        stop = datetime.now(timezone.utc) - timedelta(seconds=1)
+        trader = LiveTrader("oanda.cfg", INSTRUMENT, "1h", 1, history_days=1, stop_datetime=stop)
+        self.assertTrue(trader.stop_stream)
+        self.assertFalse(trader._account.running)
+
+    def test_account_without_stream(self):
+        trader = LiveTrader("oanda.cfg", INSTRUMENT, "1min", 1, history_days=0, start_stream=False)
+        self.assertIsNone(trader._account)
+        trader._last_tick = pd.Timestamp.now(tz="UTC")
+        trader.on_success(trader._last_tick.isoformat(), 1800.0, 1800.5)
+        self.assertEqual(trader._profit, 0)
+        # a snapshot kept by the trader's own fills, without a transactions stream
+        self.assertIsNone(trader._account.thread)
+
+    def test_ml_classification_construction(self):
+        trader = MLClassificationLive("oanda.cfg", INSTRUMENT, "5min", 3, 1, history_days=1, start_stream=False)
+        self.assertIsNotNone(trader._model)
+        self.assertEqual(len(trader._model.coef_[0]), 3)
+        self.assertFalse(trader._raw_data.empty)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 import os
+import asyncio
 import boto3
-import tpqoa
+from tpqoa.aio import aiotpqoa
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta, timezone
@@ -51,38 +52,48 @@ def convert_floats_to_decimal(data):
     else:
         return data
 
-def fetch_market_data(oanda, instrument, granularity="M1", price="M"):
-    """ Fetch historical market data from OANDA for the given instrument. """
-    print(f"[INFO] Fetching market data for {instrument}...")
-
+def market_data_range(hours=12):
+    """ Returns the (start, end) timestamps of the market data window. """
     # ✅ Properly format timestamps (OANDA requires ISO 8601 WITHOUT microseconds)
-    start_time = (datetime.utcnow() - timedelta(hours=12)).replace(microsecond=0).isoformat() + "Z"
+    start_time = (datetime.utcnow() - timedelta(hours=hours)).replace(microsecond=0).isoformat() + "Z"
     end_time = datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+    return start_time, end_time
+
+def to_indicator_frame(data):
+    """ Renames mid candle columns to the names used by calculate_technical_indicators. """
+    return data.rename(columns={"o": "openMid", "h": "highMid", "l": "lowMid", "c": "closeMid"})
 
+async def fetch_all_market_data(cfg, granularity="M1", price="M"):
+    """ Fetch the instruments, a price snapshot and the market data of all of them concurrently over one connection pool. """
+    start_time, end_time = market_data_range()
     print(f"[INFO] Fetching data from {start_time} to {end_time}")
 
-    try:
-        # ✅ Correct API request with properly formatted timestamps
-        data = oanda.get_history(
-            instrument=instrument,
-            granularity=granularity,
-            start=start_time,
-            end=end_time,
-            price=price  # ✅ Ensures Mid Prices (M)
+    async with aiotpqoa(cfg) as oanda:
+        # instrument metadata is cached across warm invocations, halted or closed pairs are skipped
+        index = await oanda.instrument_index(tradeable=True)
+        available_instruments = index.select(tradeable=True)
+        # current bid/ask of all pairs with one request per URL-sized chunk
+        prices, histories = await asyncio.gather(
+            oanda.get_prices_batch(available_instruments),
+            oanda.get_histories(available_instruments, start_time, end_time, granularity, price),
+            return_exceptions=True,
         )
 
-        # ✅ Ensure 'candles' exist in response before processing
-        if "candles" not in data:
-            raise ValueError(f"[ERROR] OANDA response missing 'candles' field for {instrument}.")
-
-        # Convert to DataFrame
-        df = pd.DataFrame(data["candles"])  # ✅ Fix: Ensure we reference "candles"
-        df.set_index("time", inplace=True)
-        return df
-
-    except Exception as e:
-        print(f"[ERROR] Failed to fetch market data for {instrument}: {str(e)}")
-        return None
+    if isinstance(histories, Exception):
+        raise histories
+    # ✅ Continue without prices, as with a failed history, the indicators only need the market data
+    if isinstance(prices, Exception):
+        print(f"[ERROR] Failed to fetch prices: {str(prices)}")
+        prices = pd.DataFrame(columns=["instrument", "bid", "ask", "spread"])
+
+    market_data = {}
+    for instrument, data in histories.items():
+        if isinstance(data, Exception):
+            print(f"[ERROR] Failed to fetch market data for {instrument}: {str(data)}")
+            market_data[instrument] = None
+        else:
+            market_data[instrument] = to_indicator_frame(data)
+    return available_instruments, prices.set_index("instrument"), market_data
 
 def calculate_technical_indicators(df):
     """ Calculate key technical indicators using pandas_ta and return as a dictionary. """
@@ -141,20 +152,16 @@ def lambda_handler(event, context):
         cfg = "oanda.cfg"
         print(f"[INFO] Using OANDA config file: {cfg}")
 
-        # Step 2: Open OANDA Connection
-        oanda = tpqoa.tpqoa(cfg)
-        print("[INFO] OANDA connection established.")
-
-        # Step 3: Fetch All Available Instruments (Currency Pairs)
-        available_instruments = [inst[1] for inst in oanda.get_instruments()]
+        # Step 2 & 3: Fetch All Available Instruments (Currency Pairs) and their market data concurrently
+        available_instruments, prices, market_data = asyncio.run(fetch_all_market_data(cfg))
         print(f"[INFO] Available Instruments: {available_instruments}")
 
         # Step 4: Iterate Through All Available Currency Pairs and Store Data
         for instrument in available_instruments:
             print(f"[INFO] Processing trade log for {instrument}...")
 
-            # Fetch market data and calculate indicators
-            df = fetch_market_data(oanda, instrument)
+            # Calculate indicators on the fetched market data
+            df = market_data[instrument]
 
             # ✅ Skip instrument if market data is missing
             if df is None or df.empty:
@@ -163,6 +170,13 @@ def lambda_handler(event, context):
 
             indicators = calculate_technical_indicators(df)
 
+            # ✅ Store the trade log without quotes if the price snapshot is missing
+            if instrument in prices.index:
+                quote = prices.loc[instrument]
+            else:
+                print(f"[WARNING] No price available for {instrument}.")
+                quote = pd.Series(dtype=float)
+
             trade_data = {
                 "Instrument": instrument,
                 "Granularity": "M1",
@@ -173,7 +187,10 @@ def lambda_handler(event, context):
                 "MACD": indicators["MACD"],
                 "MACD_Signal": indicators["MACD_Signal"],
                 "BB_Upper": indicators["BB_Upper"],
-                "BB_Lower": indicators["BB_Lower"]
+                "BB_Lower": indicators["BB_Lower"],
+                "Bid": quote.get("bid"),
+                "Ask": quote.get("ask"),
+                "Spread": quote.get("spread")
             }
 
             write_trade_log(f"T{int(datetime.utcnow().timestamp())}", instrument, trade_data)
@@ -0,0 +1,78 @@
+#
+# tpqoa is a wrapper class for the
+# Oanda v20 API (RESTful & streaming)
+# making use of the v20 Python package
+#
+# End-to-end benchmark against a local FakeOanda server
+#
+# Measures the history download throughput (sequential and with
+# parallel workers, with an optional per-request latency injected
+# by the server), the effect of gzip-compressed responses on a link
+# of limited bandwidth and the latency from a streamed tick to the
+# fill of the market order it triggers.
+#
+#   python bench_fake.py [latency] [orders] [bandwidth in MB/s]
+#
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from tpqoa import tpqoa
+from tpqoa.fakeserver import FakeOanda
+
+
+def download(client, workers):
+    start = time.perf_counter()
+    data = client.get_history('EUR_USD', '2020-01-01', '2020-07-01', 'M1',
+                              'MBA', workers=workers)
+    return len(data) / (time.perf_counter() - start)
+
+
+def transfer(compress, bandwidth):
+    ''' Returns the download throughput and the transfer counters. '''
+    with FakeOanda(market_hours=False, compress=compress,
+                   bandwidth=bandwidth) as fake:
+        cfg = os.path.join(tempfile.mkdtemp(), 'oanda.cfg')
+        client = tpqoa(fake.write_config(cfg))
+        rate = download(client, 1)
+        return rate, client.request_stats()['transfer']
+
+
+def tick_to_order(client, orders):
+    ''' Returns the seconds from receiving a tick to the order fill. '''
+    latencies = []
+
+    def on_tick(instrument, stamp, bid, ask):
+        start = time.perf_counter()
+        client.create_order(instrument, 1 if len(latencies) % 2 else -1,
+                            suppress=True)
+        latencies.append(time.perf_counter() - start)
+
+    client.stream_data('EUR_USD', stop=orders, callback=on_tick, raw=True)
+    return np.array(latencies)
+
+
+if __name__ == '__main__':
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.02
+    orders = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    bandwidth = float(sys.argv[3]) * 1e6 if len(sys.argv) > 3 else 5e6
+    for compress in [False, True]:
+        rate, counters = transfer(compress, bandwidth)
+        print('download, %-12s %12.0f candles/s  %6.1f MB received, '
+              '%6.1f MB decoded'
+              % ('gzip' if compress else 'uncompressed', rate,
+                 counters['wire_bytes'] / 1e6, counters['body_bytes'] / 1e6))
+    with FakeOanda(tick_rate=50, latency=latency,
+                   market_hours=False) as fake:
+        cfg = os.path.join(tempfile.mkdtemp(), 'oanda.cfg')
+        client = tpqoa(fake.write_config(cfg))
+        for workers in [1, 4, 8]:
+            print('download, %d worker(s) %12.0f candles/s'
+                  % (workers, download(client, workers)))
+        latencies = tick_to_order(client, orders)
+        print('tick to order fill       p50 %6.1f ms  p99 %6.1f ms'
+              % tuple(np.percentile(latencies, [50, 99]) * 1000))
+        print(client.request_stats()['requests'])
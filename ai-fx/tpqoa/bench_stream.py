@@ -0,0 +1,91 @@
+#
+# tpqoa is a wrapper class for the
+# Oanda v20 API (RESTful & streaming)
+# making use of the v20 Python package
+#
+# Benchmark of the stream_data tick decode paths
+#
+# Replays synthetic pricing stream lines (prices and heartbeats)
+# through stream_data without any network access and reports
+# ticks per second and peak memory for the v20 object path and
+# the raw line path.
+#
+#   python bench_stream.py [ticks]
+#
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from v20.response import Response
+
+from tpqoa import tpqoa
+
+
+def stream_lines(ticks, heartbeat_every=10):
+    ''' Returns synthetic pricing stream lines as sent by Oanda. '''
+    lines = []
+    for i in range(ticks):
+        stamp = '2021-03-01T00:%02d:%02d.%09dZ' % (
+            (i // 600) % 60, (i // 10) % 60, (i % 10) * 100000000)
+        lines.append(json.dumps({
+            'type': 'PRICE', 'instrument': 'EUR_USD', 'time': stamp,
+            'tradeable': True, 'status': 'tradeable',
+            'bids': [{'price': '%.5f' % (1.1 + (i % 17) * 1e-5),
+                      'liquidity': 10000000}],
+            'asks': [{'price': '%.5f' % (1.1002 + (i % 17) * 1e-5),
+                      'liquidity': 10000000}],
+            'closeoutBid': '1.10000', 'closeoutAsk': '1.10020'
+        }).encode('utf-8'))
+        if i % heartbeat_every == 0:
+            lines.append(json.dumps({
+                'type': 'HEARTBEAT', 'time': stamp}).encode('utf-8'))
+    return lines
+
+
+def replay(lines):
+    ''' Returns a stand-in for Context.request that answers stream
+    requests with the given lines instead of an HTTP connection. '''
+    def request(request):
+        response = Response(request, request.method, request.path, 200,
+                            'OK', {})
+        response.set_line_parser(request.line_parser)
+        response.set_lines(iter(lines))
+        return response
+    return request
+
+
+def run(client, lines, ticks, **kwargs):
+    client.stop_stream = False
+    tracemalloc.start()
+    start = time.perf_counter()
+    client.stream_data('EUR_USD', stop=ticks,
+                       callback=lambda *tick: None, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return ticks / elapsed, peak
+
+
+if __name__ == '__main__':
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.NamedTemporaryFile('w', suffix='.cfg',
+                                     delete=False) as cfg:
+        cfg.write('[oanda]\naccount_id = 000\naccess_token = 000\n'
+                  'account_type = practice\n')
+    client = tpqoa(cfg.name)
+    os.remove(cfg.name)
+    lines = stream_lines(ticks)
+    client.ctx_stream.request = replay(lines)
+
+    for label, kwargs in [('v20 objects, all kept', {'history': None,
+                                                     'ret': True}),
+                          ('v20 objects', {}),
+                          ('raw lines', {'raw': True}),
+                          ('raw lines, last 1000 kept', {'raw': True,
+                                                         'history': 1000})]:
+        rate, peak = run(client, lines, ticks, **kwargs)
+        print('%-28s %10.0f ticks/s  peak memory %8.1f MB'
+              % (label, rate, peak / 1e6))
@@ -22,5 +22,8 @@ setup(name='tpqoa',
       install_requires=[
           'v20==3.0.25.0',
           'pyyaml'
-      ]
+      ],
+      extras_require={
+          'aio': ['aiohttp']
+      }
       )
@@ -30,11 +30,42 @@
 # to the extent permitted by applicable law.
 #
 
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
 import unittest
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
 from decimal import Decimal
 
-from tpqoa import tpqoa
+import pandas as pd
+from v20.errors import V20Timeout
+
+from tpqoa import tpqoa, shared, resample_pages, TradingCalendar
+from tpqoa.aio import aiotpqoa
+from tpqoa.fakeserver import FakeOanda
+from tpqoa.scheduler import HISTORY
+
+# with TPQOA_FAKE set, the suite runs against a local FakeOanda server
+fake = None
+cwd = os.getcwd()
+
+
+def setUpModule():
+    global fake
+    if os.environ.get('TPQOA_FAKE'):
+        fake = FakeOanda(market_hours=False).start()
+        os.chdir(tempfile.mkdtemp())
+        fake.write_config('oanda.cfg')
+
+
+def tearDownModule():
+    if fake is not None:
+        fake.stop()
+        shutil.rmtree(os.getcwd(), ignore_errors=True)
+        os.chdir(cwd)
 
 
 class TestTPQOA(unittest.TestCase):
@@ -46,6 +77,11 @@ class TestTPQOA(unittest.TestCase):
         self.assertIsNotNone(self.tpqoa.account_id)
         self.assertIsNotNone(self.tpqoa.access_token)
 
+    def test_shared(self):
+        client = shared('oanda.cfg')
+        self.assertIs(client, shared('oanda.cfg'))
+        self.assertEqual(client.account_id, self.tpqoa.account_id)
+
     def test_place_order(self):
         oanda_response = self.tpqoa.create_order('EUR_USD', units=10, ret=True)
         oanda_response = oanda_response.get('orderFillTransaction').dict()
@@ -115,6 +151,304 @@ class TestTPQOA(unittest.TestCase):
         eur_usd = [x for x in instruments if x[0] == 'EUR/USD']
         self.assertEqual(eur_usd, [('EUR/USD', 'EUR_USD')])
 
+    def test_instrument_index(self):
+        index = self.tpqoa.instrument_index(tradeable=True)
+        self.assertIs(index, self.tpqoa.instrument_index())
+        self.assertEqual(index.precision('EUR_USD'), 5)
+        self.assertEqual(index.precision('USD_JPY'), 3)
+        self.assertEqual(index.pip('EUR_USD'), 0.0001)
+        currencies = index.select(type='CURRENCY')
+        self.assertIn('EUR_USD', currencies)
+        self.assertNotIn('XAU_USD', currencies)
+        tradeable = index.select(tradeable=True)
+        self.assertTrue(set(tradeable) <= set(index.names))
+
+    def test_get_prices_batch(self):
+        instruments = ['EUR_USD', 'GBP_USD', 'USD_JPY']
+        prices = self.tpqoa.get_prices_batch(instruments)
+        self.assertEqual(sorted(prices.instrument), instruments)
+        self.assertEqual(list(prices.columns), ['instrument', 'time', 'bid',
+                                                'ask', 'spread', 'tradeable'])
+        self.assertTrue((prices.spread == prices.ask - prices.bid).all())
+        everything = self.tpqoa.get_prices_batch()
+        self.assertEqual(len(everything),
+                         len(self.tpqoa.instrument_index()))
+
+    def test_get_history_workers(self):
+        args = ('EUR_USD', '2020-06-01', '2020-06-05', 'S30', 'M')
+        sequential = self.tpqoa.get_history(*args)
+        concurrent = self.tpqoa.get_history(*args, workers=4)
+        self.assertTrue(sequential.equals(concurrent))
+        self.assertFalse(concurrent.index.duplicated().any())
+
+    def test_get_history_long_range(self):
+        data = self.tpqoa.get_history('EUR_USD', '2015-01-01', '2020-01-01',
+                                      'H1', 'M')
+        self.assertGreater(len(data), 5000)
+        self.assertTrue(data.index.is_monotonic_increasing)
+        self.assertFalse(data.index.duplicated().any())
+        self.assertLessEqual(data.index[-1], pd.Timestamp('2020-01-01'))
+
+    def test_iter_history(self):
+        args = ('EUR_USD', '2020-06-01', '2020-06-03', 'S5', 'M')
+        pages = list(self.tpqoa.iter_history(*args, columns=['c']))
+        self.assertGreater(len(pages), 1)
+        self.assertTrue(all(len(page) <= 5000 for page in pages))
+        data = self.tpqoa.get_history(*args, columns=['c'])
+        self.assertTrue(pd.concat(pages).equals(data))
+        bars = pd.concat(resample_pages(iter(pages), '7min'))
+        self.assertTrue(bars.equals(data.resample('7min', label='right').last()))
+
+    def test_get_history_columns(self):
+        args = ('EUR_USD', '2020-06-01', '2020-06-02', 'M1', 'A')
+        full = self.tpqoa.get_history(*args)
+        close = self.tpqoa.get_history(*args, columns=['c'])
+        self.assertEqual(list(close.columns), ['c'])
+        self.assertTrue(close.c.equals(full.c))
+        self.assertEqual(str(full.index.dtype), 'datetime64[ns]')
+        self.assertEqual(full.volume.dtype, 'int64')
+        self.assertEqual(full.complete.dtype, 'bool')
+
+    def test_get_history_combined_price(self):
+        args = ('EUR_USD', '2020-06-01', '2020-06-02', 'M1')
+        combined = self.tpqoa.get_history(*args, 'BA', columns=['c'])
+        self.assertEqual(list(combined.columns), ['bid_c', 'ask_c'])
+        bid = self.tpqoa.get_history(*args, 'B', columns=['c'])
+        ask = self.tpqoa.get_history(*args, 'A', columns=['c'])
+        self.assertTrue(combined.bid_c.rename('c').equals(bid.c))
+        self.assertTrue(combined.ask_c.rename('c').equals(ask.c))
+
+    def test_get_history_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cached = tpqoa('oanda.cfg', cache_dir=cache_dir)
+            args = ('EUR_USD', '2020-06-01', '2020-06-05', 'M1', 'B')
+            cold = cached.get_history(*args)
+            self.assertEqual(cached.cache.missing(
+                'EUR_USD', 'M1', 'B', '2020-06-01', '2020-06-05'), [])
+            warm = cached.get_history(*args)
+            self.assertTrue(cold.equals(warm))
+            self.assertTrue(warm.equals(self.tpqoa.get_history(*args)))
+            # ranges without candles (a weekend) come back empty, typed
+            # and with the columns of the uncached result
+            for price in ['M', 'BA']:
+                weekend = ('EUR_USD', '2020-06-06', '2020-06-07 12:00', 'M1',
+                           price)
+                empty = cached.get_history(*weekend)
+                self.assertTrue(empty.empty)
+                self.assertEqual(str(empty.index.dtype), 'datetime64[ns]')
+                self.assertEqual(list(empty.columns), list(
+                    self.tpqoa.get_history(*weekend).columns))
+            # the current candle is returned, but not cached
+            end = pd.Timestamp.utcnow().tz_localize(None)
+            recent = ('XAU_USD', end - pd.Timedelta(hours=5), end, 'H1', 'BA')
+
+            async def retrieve():
+                async with aiotpqoa('oanda.cfg', cache_dir=cache_dir) as oanda:
+                    return await oanda.get_history(*recent)
+
+            for data in [cached.get_history(*recent),
+                         cached.get_history(*recent), asyncio.run(retrieve())]:
+                self.assertFalse(data.complete.iloc[-1])
+                self.assertTrue(data.equals(self.tpqoa.get_history(*recent)))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_request_stats(self):
+        self.tpqoa.get_history('EUR_USD', '2020-06-01', '2020-06-05', 'M1',
+                               'M', workers=4)
+        # get_history reads the instrument index once (for the calendar)
+        before = self.tpqoa.request_stats()['requests']['pricing']
+        self.tpqoa.get_prices('EUR_USD')
+        stats = self.tpqoa.request_stats()
+        self.assertGreater(stats['requests']['history'], 1)
+        self.assertEqual(stats['requests']['pricing'], before + 1)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertIsNotNone(stats['latency']['history']['p99'])
+        transfer = stats['transfer']
+        self.assertGreater(transfer['compressed'], 0)
+        self.assertLess(transfer['wire_bytes'], transfer['body_bytes'])
+
+    def test_request_deadline(self):
+        if fake is None:
+            return
+        oanda = tpqoa('oanda.cfg')
+        oanda.ctx.deadlines[HISTORY] = 0.5
+        params = {'from': '2020-06-01T00:00:00Z', 'count': 2000}
+        oanda.request_candles('EUR_USD', 'M1', 'M', **params)
+        # a response trickling in counts against the deadline as a whole
+        fake.bandwidth = 10000
+        start = monotonic()
+        try:
+            with self.assertRaises(V20Timeout):
+                oanda.request_candles('EUR_USD', 'M1', 'M', **params)
+        finally:
+            fake.bandwidth = None
+        self.assertLess(monotonic() - start, 3.0)
+
+    def test_aiotpqoa(self):
+        instruments = ['EUR_USD', 'GBP_USD', 'USD_JPY']
+        args = ('2020-06-01', '2020-06-03', 'M1')
+
+        async def retrieve():
+            async with aiotpqoa('oanda.cfg') as oanda:
+                return await asyncio.gather(
+                    oanda.get_history('EUR_USD', *args, 'M'),
+                    oanda.get_history('EUR_USD', *args, 'BA', columns=['c']),
+                    oanda.get_histories(instruments, *args, 'B'),
+                    oanda.get_prices_batch(instruments))
+
+        mid, combined, histories, prices = asyncio.run(retrieve())
+        self.assertTrue(mid.equals(
+            self.tpqoa.get_history('EUR_USD', *args, 'M')))
+        self.assertTrue(combined.equals(
+            self.tpqoa.get_history('EUR_USD', *args, 'BA', columns=['c'])))
+        self.assertEqual(list(histories), instruments)
+        for instrument, data in histories.items():
+            self.assertTrue(data.equals(
+                self.tpqoa.get_history(instrument, *args, 'B')))
+        # prices move between the two snapshots, their layout does not
+        batch = self.tpqoa.get_prices_batch(instruments)
+        self.assertEqual(list(prices.instrument), list(batch.instrument))
+        self.assertTrue(prices.dtypes.equals(batch.dtypes))
+        self.assertTrue(prices.tradeable.equals(batch.tradeable))
+
+    def test_aiotpqoa_admission(self):
+        scheduler = shared('oanda.cfg').scheduler
+        concurrency = scheduler.concurrency
+        executor = ThreadPoolExecutor(max_workers=1)
+        executor.shutdown()
+
+        async def retrieve():
+            # waiting for admission must not occupy executor threads
+            asyncio.get_running_loop().set_default_executor(executor)
+            async with aiotpqoa('oanda.cfg') as oanda:
+                scheduler.concurrency = 1
+                return await asyncio.gather(*[
+                    oanda.get_prices_batch(['EUR_USD']) for _ in range(10)])
+
+        try:
+            prices = asyncio.run(retrieve())
+        finally:
+            scheduler.concurrency = concurrency
+        self.assertEqual(len(prices), 10)
+        self.assertEqual(scheduler.in_flight, 0)
+        self.assertEqual(sum(scheduler.waiting.values()), 0)
+
+    def test_stream_data_supervised(self):
+        ticks = []
+        self.tpqoa.stream_data_supervised(
+            ['EUR_USD', 'GBP_USD'], stop=3,
+            callback=lambda *tick: ticks.append(tick))
+        self.assertEqual(len(ticks), 6)
+        self.assertEqual(self.tpqoa.reconnects, 0)
+        if fake is not None:
+            gaps = []
+            timer = threading.Timer(0.3, fake.drop_streams)
+            timer.start()
+            self.tpqoa.stream_data_supervised(
+                'EUR_USD', stop=10, callback=lambda *tick: None,
+                on_gap=lambda *gap: gaps.append(gap))
+            self.assertEqual(self.tpqoa.reconnects, 1)
+            self.assertEqual(len(gaps), 1)
+            self.assertLess(gaps[0][1], gaps[0][2])
+            # a stream ending normally is resumed as well
+            ticks, gaps = [], []
+            timer = threading.Timer(0.3, fake.end_streams)
+            timer.start()
+            self.tpqoa.stream_data_supervised(
+                'EUR_USD', stop=10, callback=lambda *tick: ticks.append(tick),
+                on_gap=lambda *gap: gaps.append(gap))
+            self.assertEqual(len(ticks), 10)
+            self.assertEqual(self.tpqoa.reconnects, 1)
+            self.assertEqual(len(gaps), 1)
+            # a failing on_gap (e.g. a backfill request) is printed only
+            ticks = []
+            timer = threading.Timer(0.3, fake.drop_streams)
+            timer.start()
+
+            def on_gap(instrument, last, time):
+                raise ValueError('backfill failed')
+            self.tpqoa.stream_data_supervised(
+                'EUR_USD', stop=10, callback=lambda *tick: ticks.append(tick),
+                on_gap=on_gap)
+            self.assertEqual(len(ticks), 10)
+            self.assertEqual(self.tpqoa.reconnects, 1)
+
+    def test_transform_datetime(self):
+        self.assertEqual(self.tpqoa.transform_datetime('2020-06-03 12:00:01'),
+                         '2020-06-03T12:00:01.000000000Z')
+        # tick times of the stream have nanoseconds
+        tick = pd.Timestamp('2020-06-03T12:00:01.123456789Z')
+        self.assertEqual(self.tpqoa.transform_datetime(tick),
+                         '2020-06-03T12:00:01.123456789Z')
+        self.assertEqual(self.tpqoa.transform_datetime(tick.tz_localize(None)),
+                         '2020-06-03T12:00:01.123456789Z')
+        data = self.tpqoa.get_history('EUR_USD', tick.tz_localize(None),
+                                      tick.tz_localize(None) +
+                                      pd.Timedelta(minutes=5), 'S5', 'M')
+        self.assertEqual(len(data), 60)
+
+    def test_trading_calendar(self):
+        calendar = TradingCalendar()
+        # the week of 2020-06-01 (New York summer time, UTC-4)
+        sessions = calendar.sessions('2020-06-02', '2020-06-03')
+        self.assertEqual(len(sessions), 1)
+        self.assertEqual(sessions[0].left, pd.Timestamp('2020-05-31 21:00'))
+        self.assertEqual(sessions[0].right, pd.Timestamp('2020-06-05 21:00'))
+        self.assertTrue(calendar.is_open(pd.Timestamp('2020-06-05 20:59')))
+        self.assertFalse(calendar.is_open(pd.Timestamp('2020-06-06 12:00')))
+        index = pd.date_range('2020-06-05 20:00', '2020-06-07 22:00',
+                              freq='1min')
+        open_index = index[calendar.is_open(index)]
+        self.assertEqual(len(calendar.missing_bars(open_index, '1min')), 0)
+        self.assertEqual(len(calendar.missing_bars(open_index[::2], '1min')),
+                         len(open_index) // 2)
+        bars = calendar.resample(pd.Series(1.0, index=index), '4h')
+        self.assertEqual(list(bars.index), [pd.Timestamp('2020-06-05 17:00'),
+                                            pd.Timestamp('2020-06-07 21:00')])
+        # nothing is requested for a closed market
+        before = self.tpqoa.request_stats()['requests'].get('history', 0)
+        data = self.tpqoa.get_history('EUR_USD', '2020-06-06',
+                                      '2020-06-07 12:00', 'M1', 'M')
+        self.assertTrue(data.empty)
+        self.assertEqual(
+            self.tpqoa.request_stats()['requests'].get('history', 0), before)
+        # instruments other than currency pairs are requested in full
+        self.tpqoa.get_history('XAU_USD', '2020-06-06', '2020-06-07 12:00',
+                               'M1', 'M')
+        self.assertGreater(
+            self.tpqoa.request_stats()['requests'].get('history', 0), before)
+
+    def test_account_state(self):
+        state = self.tpqoa.account_state()
+        units = state.position('EUR_USD')
+        order = self.tpqoa.create_order('EUR_USD', units=10, suppress=True,
+                                        ret=True)
+        state.apply(order)
+        self.assertEqual(state.position('EUR_USD'), units + 10)
+        self.assertFalse(state.apply(order))
+        self.tpqoa.create_order('EUR_USD', units=-10, suppress=True)
+        sleep(1)
+        self.assertEqual(state.position('EUR_USD'), units)
+        summary = self.tpqoa.get_account_summary()
+        self.assertEqual(state.last_id, int(summary['lastTransactionID']))
+        self.assertAlmostEqual(state.balance, float(summary['balance']), 4)
+        # P&L of instruments quoted in another currency is converted to the
+        # account currency (USD) with the factors of the fill
+        order = self.tpqoa.create_order('USD_JPY', units=1000, suppress=True,
+                                        ret=True)
+        state.apply(order)
+        trade = order['tradeOpened']['tradeID']
+        price = float(order['tradeOpened']['price'])
+        state.update_price('USD_JPY', price + 1, price + 1.01)
+        pl = state.unrealized_pl('USD_JPY', trades=[trade])
+        self.assertAlmostEqual(pl, 1000 / price, delta=0.05 * pl)
+        self.assertAlmostEqual(state.nav() - state.balance,
+                               state.unrealized_pl())
+        self.tpqoa.create_order('USD_JPY', units=-1000, suppress=True)
+        state.stop()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,10 @@
 #
 # tpqoa __init__.py
 #
-__all__ = ['tpqoa']
-from .tpqoa import tpqoa
+__all__ = ['tpqoa', 'shared', 'resample_pages', 'CandleCache',
+           'InstrumentIndex', 'AccountState', 'TradingCalendar']
+from .tpqoa import tpqoa, shared, resample_pages
+from .account import AccountState
+from .cache import CandleCache
+from .instruments import InstrumentIndex
+from .sessions import TradingCalendar
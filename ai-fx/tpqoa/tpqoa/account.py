@@ -0,0 +1,288 @@
+#
+# tpqoa account.py
+#
+# In-memory state of an account (balance, trades, positions and
+# transactions), kept up to date by the transactions stream
+#
+import collections
+import json
+import threading
+import time
+
+import requests
+import v20
+from v20.errors import V20ConnectionError, V20Timeout
+
+from .scheduler import retry_delay
+
+# seconds without a heartbeat after which the stream is reconnected
+# (Oanda sends one every 5 seconds)
+STALE_AFTER = 20.0
+MAX_RECONNECT_DELAY = 30.0
+
+
+def transaction_messages(response):
+    ''' Yields the decoded messages (transactions and heartbeats) of a
+    transactions stream response. '''
+    try:
+        for line in response.lines:
+            if line:
+                yield json.loads(line)
+    except requests.exceptions.ConnectionError:
+        raise V20Timeout(response.path, 'stream')
+    except requests.exceptions.ChunkedEncodingError:
+        raise V20ConnectionError(response.path)
+
+
+class AccountState(object):
+    ''' AccountState holds balance, open trades, positions, realized P&L
+    and the transaction history of an account in memory.
+
+    It is bootstrapped from one account snapshot; afterwards the
+    transactions of the account are applied as they arrive on the
+    transactions stream (with start) or as they are passed to apply,
+    e.g. the fill transactions returned by create_order. Transactions
+    are applied once, in any order, so both sources may be combined.
+    After every (re)connect of the stream the transactions missed in
+    between are fetched once with a since-id request.
+
+    Position, P&L and NAV queries are thus local lookups, in the
+    account currency. Unrealized P&L is computed from the prices passed
+    to update_price and converted from the quote currency with the
+    conversion factors of the last fill of the instrument (1 for
+    instruments quoted in the account currency); until an instrument
+    has both, the unrealized P&L of the snapshot is used.
+    '''
+
+    def __init__(self, client, history=None):
+        ''' Parameters
+        ==========
+        client: tpqoa
+            client of the account (for the snapshot and the stream)
+        history: int
+            number of most recent transactions kept (default all)
+        '''
+        self.client = client
+        self.lock = threading.RLock()
+        self.transactions = collections.deque(maxlen=history)
+        self.applied = set()
+        self.last_id = 0
+        self.initial_id = 0
+        self.currency = None
+        self.balance = 0.0
+        self.pl = 0.0
+        self.trades = {}
+        self.realized = collections.defaultdict(float)
+        self.marks = {}
+        self.conversions = {}
+        self.heartbeat = None
+        self.reconnects = 0
+        self.running = False
+        self.thread = None
+        self.ctx_stream = None
+
+    def bootstrap(self):
+        ''' Replaces the state by a snapshot of the account. '''
+        account = self.client.get_account_summary(detailed=True)
+        with self.lock:
+            self.currency = account.get('currency')
+            self.balance = float(account['balance'])
+            self.pl = float(account.get('pl', 0))
+            self.last_id = int(account['lastTransactionID'])
+            self.initial_id = self.last_id
+            self.trades = {
+                str(trade['id']): {
+                    'instrument': trade['instrument'],
+                    'units': float(trade['currentUnits']),
+                    'price': float(trade['price']),
+                    'unrealized': float(trade.get('unrealizedPL', 0))}
+                for trade in account.get('trades', [])}
+            self.realized.clear()
+            self.applied.clear()
+        return self
+
+    def apply(self, transaction):
+        ''' Applies a transaction (dict as sent by Oanda); returns False
+        if it was applied before. '''
+        tid = int(transaction['id'])
+        with self.lock:
+            if tid in self.applied or tid <= self.initial_id:
+                return False
+            self.applied.add(tid)
+            self.last_id = max(self.last_id, tid)
+            self.transactions.append(transaction)
+            if transaction.get('type') == 'ORDER_FILL':
+                self._fill(transaction)
+            if 'accountBalance' in transaction:
+                self.balance = float(transaction['accountBalance'])
+        return True
+
+    def _fill(self, fill):
+        instrument = fill['instrument']
+        pl = float(fill.get('pl', 0))
+        self.pl += pl
+        self.realized[instrument] += pl
+        gain = fill.get('gainQuoteHomeConversionFactor')
+        loss = fill.get('lossQuoteHomeConversionFactor')
+        if gain is not None and loss is not None:
+            self.conversions[instrument] = (float(gain), float(loss))
+        for closed in fill.get('tradesClosed') or []:
+            self.trades.pop(str(closed['tradeID']), None)
+        reduced = fill.get('tradeReduced')
+        if reduced and str(reduced['tradeID']) in self.trades:
+            trade = self.trades[str(reduced['tradeID'])]
+            units = trade['units'] + float(reduced['units'])
+            trade['unrealized'] *= units / trade['units']
+            trade['units'] = units
+        opened = fill.get('tradeOpened')
+        if opened:
+            self.trades[str(opened['tradeID'])] = {
+                'instrument': instrument, 'units': float(opened['units']),
+                'price': float(opened['price']), 'unrealized': 0.0}
+
+    def update_price(self, instrument, bid, ask):
+        ''' Sets the current prices used for the unrealized P&L. '''
+        self.marks[instrument] = (bid, ask)
+
+    def conversion(self, instrument):
+        ''' Returns the (gain, loss) factors converting P&L in the quote
+        currency of instrument to the account currency (None if not
+        known yet). '''
+        if instrument.split('_')[-1] == self.currency:
+            return 1.0, 1.0
+        return self.conversions.get(instrument)
+
+    def position(self, instrument):
+        ''' Returns the net units held of instrument. '''
+        with self.lock:
+            return sum(trade['units'] for trade in self.trades.values()
+                       if trade['instrument'] == instrument)
+
+    def positions(self):
+        ''' Returns a dict of the net units of all open positions. '''
+        positions = collections.defaultdict(float)
+        with self.lock:
+            for trade in self.trades.values():
+                positions[trade['instrument']] += trade['units']
+        return {name: units for name, units in positions.items() if units}
+
+    def average_price(self, instrument):
+        ''' Returns the average open price of the position in instrument
+        (None without position). '''
+        with self.lock:
+            trades = [trade for trade in self.trades.values()
+                      if trade['instrument'] == instrument]
+        units = sum(trade['units'] for trade in trades)
+        if not units:
+            return None
+        return sum(t['units'] * t['price'] for t in trades) / units
+
+    def unrealized_pl(self, instrument=None, trades=None):
+        ''' Returns the unrealized P&L of instrument (or of all positions)
+        in the account currency, valuing longs at the bid and shorts at
+        the ask price.
+
+        Parameters
+        ==========
+        instrument: string
+            instrument name (default: all instruments)
+        trades: iterable
+            ids of the trades to value (default: all open trades)
+        '''
+        with self.lock:
+            if trades is None:
+                selected = list(self.trades.values())
+            else:
+                selected = [self.trades[str(tid)] for tid in trades
+                            if str(tid) in self.trades]
+        total = 0.0
+        for trade in selected:
+            name = trade['instrument']
+            if instrument is not None and name != instrument:
+                continue
+            conversion = self.conversion(name)
+            if name not in self.marks or conversion is None:
+                total += trade['unrealized']
+                continue
+            bid, ask = self.marks[name]
+            close = bid if trade['units'] > 0 else ask
+            pl = trade['units'] * (close - trade['price'])
+            total += pl * (conversion[0] if pl > 0 else conversion[1])
+        return total
+
+    def realized_pl(self, instrument=None):
+        ''' Returns the P&L realized since the snapshot, of instrument or
+        of the whole account. '''
+        with self.lock:
+            if instrument is None:
+                return sum(self.realized.values())
+            return self.realized.get(instrument, 0.0)
+
+    def nav(self):
+        ''' Returns the net asset value (balance plus unrealized P&L),
+        in the account currency. '''
+        return self.balance + self.unrealized_pl()
+
+    def summary(self):
+        ''' Returns balance, NAV, P&L and the last transaction id. '''
+        with self.lock:
+            return {'balance': self.balance, 'NAV': self.nav(),
+                    'pl': self.pl, 'unrealizedPL': self.unrealized_pl(),
+                    'openTradeCount': len(self.trades),
+                    'lastTransactionID': self.last_id}
+
+    def staleness(self):
+        ''' Returns the seconds since the last stream message (infinite
+        before the first one). '''
+        if self.heartbeat is None:
+            return float('inf')
+        return time.monotonic() - self.heartbeat
+
+    def start(self):
+        ''' Takes a snapshot and follows the transactions stream on a
+        daemon thread. '''
+        self.bootstrap()
+        self.ctx_stream = v20.Context(
+            hostname=self.client.stream_hostname,
+            port=self.client.port,
+            ssl=self.client.ssl,
+            token=self.client.access_token,
+        )
+        self.ctx_stream.set_stream_timeout(STALE_AFTER)
+        self.running = True
+        self.thread = threading.Thread(target=self._follow, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        ''' Stops following the stream (after the next message). '''
+        self.running = False
+
+    def catch_up(self):
+        ''' Applies the transactions after the last applied one. '''
+        for transaction in self.client.get_transactions(self.last_id):
+            self.apply(transaction)
+
+    def _follow(self):
+        attempt = 0
+        while self.running:
+            try:
+                response = self.ctx_stream.transaction.stream(
+                    self.client.account_id)
+                if response.status != 200:
+                    raise V20ConnectionError(response.path)
+                # the stream starts now, fetch what was missed before
+                self.catch_up()
+                attempt = 0
+                for msg in transaction_messages(response):
+                    self.heartbeat = time.monotonic()
+                    if msg.get('type') != 'HEARTBEAT':
+                        self.apply(msg)
+                    if not self.running:
+                        return
+            except Exception:
+                if not self.running:
+                    return
+            self.reconnects += 1
+            time.sleep(min(MAX_RECONNECT_DELAY, retry_delay(attempt)))
+            attempt += 1
@@ -0,0 +1,390 @@
+#
+# tpqoa aio.py
+#
+# asyncio counterpart of the tpqoa class for concurrent
+# REST requests over one shared connection pool
+#
+# requires the aiohttp package (pip install tpqoa[aio])
+#
+import asyncio
+import json
+import time
+import zlib
+
+import aiohttp
+from v20.transaction import Transaction
+
+from .cache import COLUMNS
+from .instruments import InstrumentIndex, INSTRUMENTS_TTL, TRADEABLE_TTL
+from .scheduler import request_priority, retry_after, retry_delay
+from .scheduler import READ_RETRIES, THROTTLE_RETRIES, HEDGE_QUANTILE
+from .scheduler import ACCEPT_ENCODING, CHUNK_SIZE
+from .tpqoa import shared, decode_candles, history_columns, join_batches
+from .tpqoa import decode_prices, instrument_chunks
+
+
+class ResponseError(Exception):
+    ''' Raised for an unexpected HTTP status of a REST response. '''
+
+    def __init__(self, method, path, status, body):
+        self.method = method
+        self.path = path
+        self.status = status
+        self.body = body
+
+    def __str__(self):
+        return '{} {} returned status {}: {}'.format(
+            self.method, self.path, self.status,
+            self.body.get('errorMessage', self.body))
+
+
+# seconds after which a waiting request checks the scheduler again,
+# for the releases of other (thread-based) clients sharing it
+ADMISSION_POLL = 0.05
+
+
+async def read_body(response):
+    ''' Reads the body of an aiohttp response, decompressing gzip and
+    deflate encoded bodies chunk by chunk; returns the decoded body and
+    the number of bytes received. '''
+    encoding = response.headers.get('Content-Encoding', '').lower()
+    # wbits 32 + 15 accepts gzip and zlib headers
+    decoder = (zlib.decompressobj(32 + zlib.MAX_WBITS)
+               if encoding in ('gzip', 'deflate') else None)
+    chunks = []
+    received = 0
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        received += len(chunk)
+        chunks.append(decoder.decompress(chunk) if decoder else chunk)
+    if decoder is not None:
+        chunks.append(decoder.flush())
+    return b''.join(chunks), received
+
+
+class aiotpqoa(object):
+    ''' aiotpqoa is the asyncio counterpart of tpqoa for instruments,
+    candles, pricing and orders.
+
+    All requests share one aiohttp connection pool and are limited by
+    one concurrency limit and the rate limits of the request scheduler,
+    so hundreds of candle requests can be fanned out with asyncio.gather.
+    Results are the same as those of the corresponding tpqoa methods,
+    which also provide the configuration, the candle cache and the
+    history chunking.
+
+    Usage:
+
+        async with aiotpqoa('oanda.cfg') as oanda:
+            data = await oanda.get_histories(instruments, start, end,
+                                             'M1', 'M')
+    '''
+
+    def __init__(self, conf_file, concurrency=20, cache_dir=None):
+        ''' Parameters
+        ==========
+        conf_file: string
+            path to and filename of the configuration file
+        concurrency: int
+            maximum number of requests in flight at any time
+        cache_dir: string
+            directory of the on-disk candle cache, see tpqoa
+        '''
+        self.oanda = shared(conf_file, cache_dir=cache_dir)
+        self.account_id = self.oanda.account_id
+        self.base_url = '{}://{}:{}'.format(
+            'https' if self.oanda.ssl else 'http', self.oanda.hostname,
+            self.oanda.port)
+        self.headers = {
+            'Authorization': 'Bearer {}'.format(self.oanda.access_token),
+            'Content-Type': 'application/json',
+            'Accept-Datetime-Format': 'RFC3339',
+            'Accept-Encoding': ACCEPT_ENCODING,
+        }
+        self.concurrency = concurrency
+        self.semaphore = None
+        self.released = None
+        self.session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        ''' Opens the shared connection pool (inside the running loop). '''
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            # bodies are decompressed by read_body to count the bytes
+            self.session = aiohttp.ClientSession(headers=self.headers,
+                                                 connector=connector,
+                                                 auto_decompress=False)
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+            self.released = asyncio.Condition()
+
+    async def close(self):
+        ''' Closes the shared connection pool. '''
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method, path, params=None, body=None,
+                      expected=(200,)):
+        ''' Sends a REST request through the request scheduler of the
+        underlying tpqoa client and returns the JSON-decoded body.
+
+        Deadlines, read retries and hedged reads are those of the
+        tpqoa client, see ScheduledContext.
+        '''
+        await self.open()
+        priority = request_priority(method, path)
+        retries = READ_RETRIES if method == 'GET' else 0
+        for attempt in range(retries + 1):
+            try:
+                if self.oanda.ctx.hedge and retries:
+                    status, data = await self._hedged(method, path, params,
+                                                      body, priority)
+                else:
+                    status, data = await self._scheduled(method, path, params,
+                                                         body, priority)
+                if status < 500 or attempt == retries:
+                    break
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                if attempt == retries:
+                    raise
+            self.oanda.scheduler.record('retried')
+            await asyncio.sleep(retry_delay(attempt))
+        if status not in expected:
+            raise ResponseError(method, path, status, data)
+        return data
+
+    async def _hedged(self, method, path, params, body, priority):
+        ''' Sends the request and, if it is slower than the recent p95
+        latency, a duplicate; returns the first response. '''
+        scheduler = self.oanda.scheduler
+        delay = scheduler.latency_quantile(priority, HEDGE_QUANTILE)
+        if delay is None:
+            return await self._scheduled(method, path, params, body, priority)
+        sent = asyncio.Event()
+        primary = asyncio.ensure_future(
+            self._scheduled(method, path, params, body, priority, sent))
+        # the delay counts from sending, not from waiting for admission
+        await sent.wait()
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        scheduler.record('hedged')
+        hedge = asyncio.ensure_future(
+            self._scheduled(method, path, params, body, priority))
+        pending = {primary, hedge}
+        while True:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            # prefer a successful response over a failed attempt
+            for task in sorted(done, key=lambda t: t.exception() is not None):
+                if task.exception() is None or not pending:
+                    if task is hedge:
+                        scheduler.record('hedge_won')
+                    for other in pending:
+                        # the slower request still completes and is counted
+                        other.add_done_callback(
+                            lambda t: t.cancelled() or t.exception())
+                    return task.result()
+
+    async def _scheduled(self, method, path, params, body, priority,
+                         sent=None):
+        ''' Sends the request once admitted by the scheduler, again after
+        a 429 response, and returns the status and the decoded body;
+        sets the event sent when first admitted. '''
+        scheduler = self.oanda.scheduler
+        timeout = aiohttp.ClientTimeout(
+            total=self.oanda.ctx.deadlines[priority])
+        for attempt in range(THROTTLE_RETRIES + 1):
+            async with self.semaphore:
+                await self._admit(priority)
+                if sent is not None:
+                    sent.set()
+                start = time.monotonic()
+                status = headers = None
+                try:
+                    async with self.session.request(
+                            method, self.base_url + path, params=params,
+                            data=json.dumps(body) if body is not None
+                            else None, timeout=timeout) as response:
+                        status, headers = response.status, response.headers
+                        raw, received = await read_body(response)
+                    scheduler.record_transfer(received, len(raw),
+                                              time.monotonic() - start)
+                finally:
+                    scheduler.release(priority, status,
+                                      time.monotonic() - start,
+                                      retry_after(headers or {}))
+                    async with self.released:
+                        self.released.notify_all()
+            if status != 429:
+                break
+        return status, json.loads(raw) if raw else {}
+
+    async def _admit(self, priority):
+        ''' Waits until the scheduler admits a request of the priority
+        without blocking a thread (the default executor also resolves
+        the host names of aiohttp); woken by the releases of this client
+        and every ADMISSION_POLL seconds for those of other clients. '''
+        scheduler = self.oanda.scheduler
+        start = time.monotonic()
+        scheduler.enqueue(priority)
+        admitted = False
+        try:
+            async with self.released:
+                while True:
+                    delay = scheduler.try_acquire(priority, start)
+                    if delay == 0:
+                        admitted = True
+                        # lower priorities may be next now
+                        self.released.notify_all()
+                        return
+                    try:
+                        await asyncio.wait_for(
+                            self.released.wait(),
+                            min(delay or ADMISSION_POLL, ADMISSION_POLL))
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            if not admitted:
+                scheduler.dequeue(priority)
+
+    async def get_instruments(self):
+        ''' Retrieves and returns all instruments for the given account. '''
+        index = await self.instrument_index()
+        instruments = [(index[name]['displayName'], name)
+                       for name in index.names]
+        return sorted(instruments)
+
+    async def instrument_index(self, ttl=INSTRUMENTS_TTL, tradeable=False):
+        ''' Returns the InstrumentIndex of the account, shared with the
+        underlying tpqoa client, see tpqoa.instrument_index. '''
+        oanda = self.oanda
+        if oanda.instruments is None or oanda.instruments.age() > ttl:
+            body = await self.request(
+                'GET', '/v3/accounts/{}/instruments'.format(self.account_id))
+            oanda.instruments = InstrumentIndex(body['instruments'])
+        if tradeable and oanda.instruments.tradeable_age() > TRADEABLE_TTL:
+            prices = await self.get_prices_batch(oanda.instruments.names)
+            oanda.instruments.set_tradeable(
+                dict(zip(prices.instrument, prices.tradeable)))
+        return oanda.instruments
+
+    async def get_prices(self, instrument):
+        ''' Returns the current BID/ASK prices for instrument. '''
+        r = await self.request(
+            'GET', '/v3/accounts/{}/pricing'.format(self.account_id),
+            params={'instruments': instrument})
+        bid = float(r['prices'][0]['closeoutBid'])
+        ask = float(r['prices'][0]['closeoutAsk'])
+        return r['time'], bid, ask
+
+    async def get_prices_batch(self, instruments=None):
+        ''' Returns the current BID/ASK prices of many instruments, with
+        the chunks requested concurrently, see tpqoa.get_prices_batch. '''
+        if instruments is None:
+            instruments = (await self.instrument_index()).names
+        bodies = await asyncio.gather(*[
+            self.request(
+                'GET', '/v3/accounts/{}/pricing'.format(self.account_id),
+                params={'instruments': chunk})
+            for chunk in instrument_chunks(instruments)])
+        return decode_prices([p for body in bodies for p in body['prices']])
+
+    async def retrieve_data(self, instrument, start, end, granularity, price,
+                            columns=None):
+        ''' Retrieves the candles between start and end with a single
+        request, see tpqoa.retrieve_data. '''
+        history_columns(price)
+        body = await self.request(
+            'GET', '/v3/instruments/{}/candles'.format(instrument),
+            params={'granularity': granularity, 'price': price,
+                    'from': start, 'to': end})
+        return decode_candles(body['candles'], price, columns)
+
+    async def download_history(self, instrument, start, end, granularity,
+                               price, columns=None):
+        ''' Downloads historical data with all chunks in flight at once,
+        see tpqoa.download_history. '''
+        # the calendar of instrument depends on its type
+        await self.instrument_index()
+        batches = self.oanda.history_batches(start, end, granularity,
+                                             instrument)
+        frames = await asyncio.gather(*[
+            self.retrieve_data(instrument, batch_start, batch_end,
+                               granularity, price, columns)
+            for batch_start, batch_end in batches])
+        return join_batches(frames, price, columns)
+
+    async def get_history(self, instrument, start, end, granularity, price,
+                          localize=True, columns=None):
+        ''' Retrieves historical data for instrument, see tpqoa.get_history
+        for the parameters. '''
+        if columns is None:
+            columns = COLUMNS
+        oanda = self.oanda
+        if oanda.cache is None:
+            data = await self.download_history(instrument, start, end,
+                                               granularity, price, columns)
+        else:
+            # incomplete candles are returned, but not cached
+            current = []
+            for gap_start, gap_end in oanda.missing_history(
+                    instrument, start, end, granularity, price):
+                batch = await self.download_history(
+                    instrument, gap_start, gap_end, granularity, price)
+                oanda.store_history(instrument, gap_start, gap_end,
+                                    granularity, price, batch)
+                if not batch.empty:
+                    current.append(batch[~batch['complete'].astype(bool)])
+            data = join_batches([oanda.load_history(
+                instrument, start, end, granularity, price)] + current, price)
+        if localize:
+            data.index = data.index.tz_localize(None)
+
+        return data[history_columns(price, columns)]
+
+    async def get_histories(self, instruments, start, end, granularity,
+                            price, localize=True, columns=None):
+        ''' Retrieves historical data for many instruments concurrently.
+
+        Returns a dict mapping each instrument to its DataFrame, or to the
+        exception raised while retrieving it, so that one failing
+        instrument does not cancel the others.
+        '''
+        results = await asyncio.gather(*[
+            self.get_history(instrument, start, end, granularity, price,
+                             localize=localize, columns=columns)
+            for instrument in instruments], return_exceptions=True)
+        return dict(zip(instruments, results))
+
+    async def create_order(self, instrument, units, price=None,
+                           sl_distance=None, tsl_distance=None, tp_price=None,
+                           comment=None, touch=False, suppress=False,
+                           ret=False):
+        ''' Places order with Oanda, see tpqoa.create_order. '''
+        order = self.oanda.order_request(instrument, units, price,
+                                         sl_distance, tsl_distance, tp_price,
+                                         comment, touch)
+        body = await self.request(
+            'POST', '/v3/accounts/{}/orders'.format(self.account_id),
+            body={'order': order.dict()}, expected=(201, 400, 404))
+
+        # First checking if the order is rejected
+        for field in ['orderRejectTransaction', 'orderFillTransaction',
+                      'orderCreateTransaction']:
+            if field in body:
+                order = Transaction.from_dict(body[field], self.oanda.ctx)
+                break
+        else:
+            order = None
+
+        if not suppress and order is not None:
+            print('\n\n', order.dict(), '\n')
+        if ret is True:
+            return order.dict() if order is not None else None
@@ -0,0 +1,158 @@
+#
+# tpqoa cache.py
+#
+# On-disk columnar store for historical candles, keyed by
+# instrument, granularity and price component
+#
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['o', 'h', 'l', 'c', 'volume', 'complete']
+DTYPES = {'time': 'int64', 'o': 'float64', 'h': 'float64', 'l': 'float64',
+          'c': 'float64', 'volume': 'int64', 'complete': 'bool'}
+
+
+def to_utc(dati):
+    ''' Transforms a datetime object or string to a naive UTC pd.Timestamp. '''
+    dati = pd.Timestamp(dati)
+    if dati.tzinfo is not None:
+        dati = dati.tz_convert('UTC').tz_localize(None)
+    return dati
+
+
+class CandleCache(object):
+    ''' CandleCache keeps downloaded candles on disk together with the
+    time ranges that have already been requested from Oanda.
+
+    Every (instrument, granularity, price) key is stored as one .npz file
+    holding one array per column (int64 ns UTC time, float64 o/h/l/c,
+    int64 volume, bool complete) plus the covered ranges. Covered ranges
+    are closed intervals [start, end] that are never re-downloaded; only
+    complete candles are stored, so a range is covered up to the first
+    incomplete candle at most.
+    '''
+
+    def __init__(self, directory):
+        ''' Parameters
+        ==========
+        directory: string
+            path to the cache directory, created if missing
+        '''
+        self.directory = directory
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, instrument, granularity, price):
+        ''' Returns the file path for the given key. '''
+        name = f'{instrument}_{granularity}_{price}.npz'
+        return os.path.join(self.directory, name)
+
+    def read(self, instrument, granularity, price):
+        ''' Returns the stored columns and covered ranges of a key. '''
+        path = self.path(instrument, granularity, price)
+        if not os.path.exists(path):
+            columns = {key: np.empty(0, dtype=dtype)
+                       for key, dtype in DTYPES.items()}
+            return columns, np.empty((0, 2), dtype='int64')
+        with np.load(path) as stored:
+            columns = {key: stored[key] for key in ['time'] + COLUMNS}
+            coverage = stored['coverage']
+        return columns, coverage
+
+    def missing(self, instrument, granularity, price, start, end):
+        ''' Returns the (start, end) ranges not yet covered by the cache. '''
+        start, end = to_utc(start), to_utc(end)
+        _, coverage = self.read(instrument, granularity, price)
+        gaps = []
+        cursor = start.value
+        for cov_start, cov_end in coverage:
+            if cov_end < cursor:
+                continue
+            if cov_start > end.value:
+                break
+            if cov_start > cursor:
+                gaps.append((pd.Timestamp(cursor), pd.Timestamp(cov_start)))
+            cursor = max(cursor, cov_end)
+            if cursor >= end.value:
+                break
+        if cursor < end.value:
+            gaps.append((pd.Timestamp(cursor), end))
+        return gaps
+
+    def load(self, instrument, granularity, price, start, end):
+        ''' Returns the stored candles between start and end (inclusive)
+        as a DataFrame with a UTC index, like tpqoa.retrieve_data. '''
+        start, end = to_utc(start), to_utc(end)
+        columns, _ = self.read(instrument, granularity, price)
+        times = columns['time']
+        lo = np.searchsorted(times, start.value, side='left')
+        hi = np.searchsorted(times, end.value, side='right')
+        if lo == hi:
+            # empty DataFrame with the columns, as decode_candles returns
+            return pd.DataFrame(columns=COLUMNS, index=pd.DatetimeIndex(
+                [], name='time', tz='UTC'))
+        index = pd.to_datetime(times[lo:hi], utc=True)
+        index.name = 'time'
+        return pd.DataFrame({col: columns[col][lo:hi] for col in COLUMNS},
+                            index=index)
+
+    def store(self, instrument, granularity, price, data, start, end):
+        ''' Merges downloaded candles into the cache and marks the range
+        [start, end] as covered (up to the first incomplete candle and
+        never beyond the current time). '''
+        start, end = to_utc(start), to_utc(end)
+        end = min(end, to_utc(pd.Timestamp.utcnow()))
+        if not data.empty:
+            times = data.index.tz_convert('UTC').asi8 \
+                if data.index.tz is not None else data.index.asi8
+            incomplete = ~data['complete'].values.astype(bool)
+            if incomplete.any():
+                end = min(end, pd.Timestamp(times[incomplete.argmax()]))
+            keep = ~incomplete
+            new = {'time': times[keep]}
+            new.update({col: data[col].values[keep] for col in COLUMNS})
+        if end < start:
+            return
+
+        with self.lock:
+            columns, coverage = self.read(instrument, granularity, price)
+            if not data.empty:
+                columns = self._merge_columns(columns, new)
+            coverage = self._merge_coverage(coverage, start.value, end.value)
+
+            path = self.path(instrument, granularity, price)
+            tmp_path = path + '.tmp.npz'
+            np.savez(tmp_path, coverage=coverage, **columns)
+            os.replace(tmp_path, path)
+
+    def clear(self, instrument=None):
+        ''' Removes all cached files (of one instrument if given). '''
+        for name in os.listdir(self.directory):
+            if instrument is None or name.startswith(instrument + '_'):
+                os.remove(os.path.join(self.directory, name))
+
+    @staticmethod
+    def _merge_columns(columns, new):
+        if len(columns['time']) == 0:
+            return new
+        # newer downloads win for candles stored twice
+        times = np.concatenate([new['time'], columns['time']])
+        times, first = np.unique(times, return_index=True)
+        merged = {'time': times}
+        for col in COLUMNS:
+            merged[col] = np.concatenate([new[col], columns[col]])[first]
+        return merged
+
+    @staticmethod
+    def _merge_coverage(coverage, start, end):
+        intervals = sorted([tuple(c) for c in coverage] + [(start, end)])
+        merged = [list(intervals[0])]
+        for cov_start, cov_end in intervals[1:]:
+            if cov_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], cov_end)
+            else:
+                merged.append([cov_start, cov_end])
+        return np.array(merged, dtype='int64')
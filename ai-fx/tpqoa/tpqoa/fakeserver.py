@@ -0,0 +1,848 @@
+#
+# tpqoa fakeserver.py
+#
+# Local stand-in for the Oanda v20 REST and streaming endpoints,
+# serving synthetic or recorded candles, price streams and market
+# order fills for offline tests and benchmarks
+#
+#   python -m tpqoa.fakeserver --port 8080 --tick-rate 4
+#
+import argparse
+import gzip
+import json
+import math
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from .cache import CandleCache, to_utc
+from .sessions import TradingCalendar
+from .tpqoa import GRANULARITY_SECONDS, MAX_REQUEST_COUNT, PRICE_COMPONENTS
+
+ACCOUNT_ID = '101-001-0000000-001'
+ACCESS_TOKEN = 'fake-token'
+CURRENCY = 'USD'
+
+# name: (displayName, type, price level, pipLocation, displayPrecision,
+#        marginRate)
+INSTRUMENTS = {
+    'EUR_USD': ('EUR/USD', 'CURRENCY', 1.15, -4, 5, '0.0333'),
+    'GBP_USD': ('GBP/USD', 'CURRENCY', 1.35, -4, 5, '0.05'),
+    'USD_JPY': ('USD/JPY', 'CURRENCY', 110.0, -2, 3, '0.04'),
+    'USD_CHF': ('USD/CHF', 'CURRENCY', 0.92, -4, 5, '0.05'),
+    'AUD_CAD': ('AUD/CAD', 'CURRENCY', 0.95, -4, 5, '0.05'),
+    'EUR_GBP': ('EUR/GBP', 'CURRENCY', 0.85, -4, 5, '0.05'),
+    'XAU_USD': ('Gold', 'METAL', 1800.0, -2, 3, '0.05'),
+}
+SPREAD_PIPS = 1.5
+HEARTBEAT_INTERVAL = 5.0
+DEFAULT_COUNT = 500
+# gzip level and minimum size of compressed responses (nginx defaults)
+COMPRESS_LEVEL = 1
+COMPRESS_MIN_LENGTH = 20
+# bytes sent at a time with limited bandwidth
+DRIP_SIZE = 256
+CALENDAR = TradingCalendar()
+
+
+def rfc3339(seconds):
+    ''' Formats epoch seconds like Oanda, with nanoseconds. '''
+    whole = int(seconds)
+    return '{}.{:09d}Z'.format(
+        time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(whole)),
+        int(round((seconds - whole) * 1e9)) % 1000000000)
+
+
+def epoch(value):
+    ''' Parses an RFC3339 or UNIX time parameter to epoch seconds. '''
+    try:
+        return float(value)
+    except ValueError:
+        return to_utc(value).value / 1e9
+
+
+def market_open(seconds):
+    ''' Returns whether the FX market is open at the epoch seconds (array),
+    see TradingCalendar. '''
+    seconds = np.asarray(seconds)
+    times = pd.DatetimeIndex(np.atleast_1d(seconds).astype('int64') *
+                             1000000000)
+    result = CALENDAR.is_open(times)
+    return result if seconds.ndim else bool(result[0])
+
+
+class FakeOanda(object):
+    ''' FakeOanda is a local HTTP server answering the v20 endpoints used
+    by tpqoa: instruments, candles, pricing, the pricing stream, orders
+    (market orders are filled at the current price), positions, account
+    summary and transactions.
+
+    Prices follow a deterministic function of time per instrument, so
+    candles and ticks are consistent with each other. With cache_dir,
+    candles recorded by a tpqoa CandleCache are served where available.
+
+    Usage:
+
+        with FakeOanda() as fake:
+            fake.write_config('oanda.cfg')
+            oanda = tpqoa('oanda.cfg')
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0, tick_rate=4.0,
+                 cache_dir=None, instruments=None, balance=100000.0,
+                 latency=0.0, rate_limit=None, market_hours=True,
+                 compress=True, bandwidth=None):
+        ''' Parameters
+        ==========
+        host, port: string, int
+            address to listen on (port 0 picks a free port)
+        tick_rate: float
+            prices per second and instrument on the pricing stream
+        cache_dir: string
+            CandleCache directory with recorded candles to serve
+        instruments: dict
+            instrument definitions like INSTRUMENTS (default)
+        balance: float
+            initial account balance
+        latency: float
+            seconds added to every REST response
+        rate_limit: int
+            REST requests per second answered before 429 responses
+        market_hours: boolean
+            whether prices are non-tradeable on weekends
+        compress: boolean
+            whether REST responses are gzip-compressed for clients
+            accepting it
+        bandwidth: float
+            bytes per second at which REST response bodies are sent,
+            DRIP_SIZE bytes at a time (default unlimited)
+        '''
+        self.tick_rate = tick_rate
+        self.cache = CandleCache(cache_dir) if cache_dir else None
+        self.instruments = instruments or INSTRUMENTS
+        self.balance = balance
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.market_hours = market_hours
+        self.compress = compress
+        self.bandwidth = bandwidth
+
+        self.lock = threading.Lock()
+        # notified on every new transaction
+        self.changed = threading.Condition(self.lock)
+        self.transactions = []
+        self.trades = {}
+        self.requests = {}
+        self.recent = []
+        self.running = False
+        # for simulating interrupted streams
+        self.stream_generation = 0
+        self.stream_ends = 0
+        self.silent_until = 0.0
+
+        self.server = ThreadingHTTPServer((host, port), FakeOandaHandler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    @property
+    def host(self):
+        return self.server.server_address[0]
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        ''' Serves requests on a background thread. '''
+        self.running = True
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        ''' Stops serving and ends open streams. '''
+        self.running = False
+        self.server.shutdown()
+        self.server.server_close()
+
+    def drop_streams(self):
+        ''' Closes the open pricing streams abruptly. '''
+        self.stream_generation += 1
+
+    def end_streams(self):
+        ''' Ends the open pricing streams normally, as the server does
+        e.g. when it restarts. '''
+        self.stream_ends += 1
+
+    def pause_streams(self, seconds):
+        ''' Lets the pricing streams send nothing, not even heartbeats,
+        for the given seconds (a stalled connection). '''
+        self.silent_until = time.time() + seconds
+
+    def write_config(self, path, **options):
+        ''' Writes a tpqoa configuration file pointing to the server;
+        options are added to the [oanda] section. '''
+        lines = ['[oanda]',
+                 'account_id = {}'.format(ACCOUNT_ID),
+                 'access_token = {}'.format(ACCESS_TOKEN),
+                 'account_type = practice',
+                 'hostname = {}'.format(self.host),
+                 'stream_hostname = {}'.format(self.host),
+                 'port = {}'.format(self.port),
+                 'ssl = false']
+        lines += ['{} = {}'.format(key, value)
+                  for key, value in options.items()]
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path
+
+    # prices
+
+    def mid(self, instrument, seconds):
+        ''' Returns the mid price of instrument at the epoch seconds. '''
+        level = self.instruments[instrument][2]
+        phase = zlib.crc32(instrument.encode()) % 1000
+        seconds = np.asarray(seconds, dtype='float64')
+        return level * (1 + 0.01 * np.sin(2 * np.pi * seconds / 604800 +
+                                          phase)
+                        + 0.002 * np.sin(2 * np.pi * seconds / 3600 + phase)
+                        + 0.0004 * np.sin(2 * np.pi * seconds / 97 + phase)
+                        + 0.0001 * np.sin(2 * np.pi * seconds / 7))
+
+    def half_spread(self, instrument):
+        return SPREAD_PIPS * 10.0 ** self.instruments[instrument][3] / 2
+
+    def home_factor(self, instrument, seconds):
+        ''' Returns the factor converting amounts in the quote currency of
+        instrument to the account currency at the epoch seconds (1 if
+        there is no instrument to convert with). '''
+        quote = instrument.split('_')[-1]
+        if quote == CURRENCY:
+            return 1.0
+        if CURRENCY + '_' + quote in self.instruments:
+            return 1 / float(self.mid(CURRENCY + '_' + quote, seconds))
+        if quote + '_' + CURRENCY in self.instruments:
+            return float(self.mid(quote + '_' + CURRENCY, seconds))
+        return 1.0
+
+    def tradeable(self, seconds):
+        return not self.market_hours or bool(market_open(seconds))
+
+    def price(self, instrument, seconds):
+        ''' Returns the price dict of instrument at the epoch seconds. '''
+        precision = self.instruments[instrument][4]
+        mid = float(self.mid(instrument, seconds))
+        half = self.half_spread(instrument)
+        bid = '{:.{}f}'.format(mid - half, precision)
+        ask = '{:.{}f}'.format(mid + half, precision)
+        tradeable = self.tradeable(seconds)
+        return {
+            'type': 'PRICE', 'instrument': instrument,
+            'time': rfc3339(seconds), 'tradeable': tradeable,
+            'status': 'tradeable' if tradeable else 'non-tradeable',
+            'bids': [{'price': bid, 'liquidity': 10000000}],
+            'asks': [{'price': ask, 'liquidity': 10000000}],
+            'closeoutBid': bid, 'closeoutAsk': ask
+        }
+
+    # candles
+
+    def candle_times(self, granularity, start, end=None, count=None,
+                     include_first=True):
+        ''' Returns the epoch second start times of the candles from start
+        up to end (inclusive) or of count candles, skipping closed market
+        periods (with market_hours). '''
+        length = GRANULARITY_SECONDS[granularity]
+        # daily and weekly candles start at 21:00 UTC (Sunday for weekly)
+        offset = {'D': 75600, 'W': 324000}.get(granularity, 0)
+        first = math.ceil((start - offset) / length) * length + offset
+        if not include_first and first == start:
+            first += length
+        now = time.time()
+        last = now if end is None else min(end, now)
+        times = []
+        found = 0
+        block = max(count or 0, 1000)
+        while first <= last and (count is None or found < count):
+            stop = min(last, first + (block - 1) * length)
+            block_times = np.arange(first, stop + 1, length, dtype='int64')
+            if not self.market_hours:
+                pass
+            elif length < 86400:
+                block_times = block_times[market_open(block_times)]
+            elif granularity == 'D':
+                # no candle for the day starting Friday 21:00
+                block_times = block_times[(block_times // 86400 + 3) % 7 != 4]
+            times.append(block_times)
+            found += len(block_times)
+            first = stop + length
+            block *= 2
+        times = np.concatenate(times) if times else np.empty(0, 'int64')
+        return times[:count] if count is not None else times
+
+    def recorded(self, instrument, granularity, price, start, end, count,
+                 include_first):
+        ''' Returns the recorded candle columns per component, or None. '''
+        if self.cache is None:
+            return None
+        columns = {}
+        for p in price:
+            if not self.cache.read(instrument, granularity, p)[1].size:
+                return None
+            columns[p] = self.cache.read(instrument, granularity, p)[0]
+        times = columns[price[0]]['time']
+        for p in price[1:]:
+            times = np.intersect1d(times, columns[p]['time'])
+        times = times // 1000000000
+        times = times[times > start if not include_first else times >= start]
+        if end is not None:
+            times = times[times <= end]
+        if count is not None:
+            times = times[:count]
+        if len(times) == 0:
+            return None
+        result = {}
+        for p in price:
+            positions = np.searchsorted(columns[p]['time'] // 1000000000,
+                                        times)
+            result[p] = {key: values[positions]
+                         for key, values in columns[p].items()}
+        return result
+
+    def candles(self, instrument, params):
+        ''' Returns the body of a candles request. '''
+        granularity = params.get('granularity', 'S5')
+        price = params.get('price', 'M')
+        include_first = params.get('includeFirst', 'true').lower() != 'false'
+        start = epoch(params['from']) if 'from' in params else None
+        end = epoch(params['to']) if 'to' in params else None
+        count = int(params['count']) if 'count' in params else None
+        if count is None and (start is None or end is None):
+            count = DEFAULT_COUNT
+        if count is not None and count > MAX_REQUEST_COUNT:
+            return 400, {'errorMessage':
+                         "Maximum value for 'count' exceeded"}
+        if start is None:
+            # the most recent count candles
+            end = time.time() if end is None else end
+            start = end - count * GRANULARITY_SECONDS[granularity] * 3
+            times = self.candle_times(granularity, start, end)[-count:]
+        else:
+            times = self.candle_times(granularity, start, end, count,
+                                      include_first)
+        if len(times) > MAX_REQUEST_COUNT:
+            return 400, {'errorMessage':
+                         "Maximum value for 'count' exceeded"}
+
+        precision = self.instruments[instrument][4]
+        form = '{:.%df}' % precision
+        recorded = self.recorded(instrument, granularity, price, start, end,
+                                 count, include_first)
+        if recorded is not None:
+            times = recorded[price[0]]['time'] // 1000000000
+            volume = recorded[price[0]]['volume']
+            complete = recorded[price[0]]['complete']
+            ohlc = {p: [recorded[p][col] for col in 'ohlc'] for p in price}
+        else:
+            length = GRANULARITY_SECONDS[granularity]
+            # o, h, l, c from prices within the candle
+            o = self.mid(instrument, times)
+            c = self.mid(instrument, times + length - 1)
+            m = self.mid(instrument, times + length / 2)
+            h = np.maximum(np.maximum(o, c), m)
+            l = np.minimum(np.minimum(o, c), m)
+            volume = (times // length) % 97 + 1
+            complete = times + length <= time.time()
+            half = self.half_spread(instrument)
+            shift = {'M': 0, 'B': -half, 'A': half}
+            ohlc = {p: [col + shift[p] for col in (o, h, l, c)]
+                    for p in price}
+
+        candles = []
+        for i in range(len(times)):
+            candle = {'complete': bool(complete[i]),
+                      'volume': int(volume[i]),
+                      'time': rfc3339(int(times[i]))}
+            for p in price:
+                candle[PRICE_COMPONENTS[p]] = {
+                    col: form.format(values[i])
+                    for col, values in zip('ohlc', ohlc[p])}
+            candles.append(candle)
+        return 200, {'instrument': instrument, 'granularity': granularity,
+                     'candles': candles}
+
+    # orders and account
+
+    def transaction(self, kind, **fields):
+        ''' Appends a transaction to the account history (with lock). '''
+        transaction = {'id': str(len(self.transactions) + 1),
+                       'time': rfc3339(time.time()), 'type': kind,
+                       'accountID': ACCOUNT_ID, 'batchID':
+                       str(len(self.transactions) + 1)}
+        transaction.update(fields)
+        self.transactions.append(transaction)
+        self.changed.notify_all()
+        return transaction
+
+    def create_order(self, order):
+        ''' Executes an order request, returns status and body. '''
+        instrument = order.get('instrument')
+        if instrument not in self.instruments:
+            return 400, {'errorMessage': 'Invalid value specified for '
+                                         "'instrument'"}
+        units = float(order['units'])
+        extra = {key: order[key] for key in
+                 ('stopLossOnFill', 'trailingStopLossOnFill',
+                  'takeProfitOnFill', 'clientExtensions', 'price')
+                 if key in order}
+        now = time.time()
+        with self.lock:
+            create = self.transaction(
+                order['type'] + '_ORDER' if order['type'] != 'MARKET'
+                else 'MARKET_ORDER', instrument=instrument,
+                units=order['units'], timeInForce=order.get(
+                    'timeInForce', 'FOK' if order['type'] == 'MARKET'
+                    else 'GTC'),
+                positionFill='DEFAULT', reason='CLIENT_ORDER', **extra)
+            body = {'orderCreateTransaction': create}
+            if order['type'] != 'MARKET':
+                body['lastTransactionID'] = create['id']
+                return 201, body
+            if not self.tradeable(now):
+                cancel = self.transaction('ORDER_CANCEL', orderID=create['id'],
+                                          reason='MARKET_HALTED')
+                body['orderCancelTransaction'] = cancel
+                body['lastTransactionID'] = cancel['id']
+                return 201, body
+            body['orderFillTransaction'] = self.fill(create, instrument,
+                                                     units, now)
+            body['relatedTransactionIDs'] = [
+                create['id'], body['orderFillTransaction']['id']]
+            body['lastTransactionID'] = body['orderFillTransaction']['id']
+        return 201, body
+
+    def fill(self, create, instrument, units, now):
+        ''' Fills a market order against the open trades (FIFO). '''
+        price = self.price(instrument, now)
+        fill_price = float(price['asks'][0]['price'] if units > 0
+                           else price['bids'][0]['price'])
+        trade_id = str(len(self.transactions) + 1)
+        factor = self.home_factor(instrument, now)
+        fill = {'orderID': create['id'], 'instrument': instrument,
+                'units': str(units), 'price': str(fill_price),
+                'fullVWAP': str(fill_price), 'reason': 'MARKET_ORDER',
+                'financing': '0.0', 'commission': '0.0',
+                'guaranteedExecutionFee': '0.0',
+                'halfSpreadCost': str(abs(units) *
+                                      self.half_spread(instrument)),
+                'fullPrice': {'type': 'PRICE', 'bids': price['bids'],
+                              'asks': price['asks'],
+                              'closeoutBid': price['closeoutBid'],
+                              'closeoutAsk': price['closeoutAsk']}}
+        pl = 0.0
+        closed = []
+        remaining = units
+        for trade in [t for t in self.trades.values()
+                      if t['instrument'] == instrument]:
+            if remaining == 0 or (trade['units'] > 0) == (remaining > 0):
+                continue
+            amount = -trade['units'] if abs(trade['units']) <= \
+                abs(remaining) else remaining
+            realized = -amount * (fill_price - trade['price']) * factor
+            pl += realized
+            trade['units'] += amount
+            remaining -= amount
+            closed.append({'tradeID': trade['id'], 'units': str(amount),
+                           'price': str(fill_price),
+                           'realizedPL': str(round(realized, 4)),
+                           'financing': '0.0',
+                           'guaranteedExecutionFee': '0.0',
+                           'halfSpreadCost': '0.0'})
+            if trade['units'] == 0:
+                del self.trades[trade['id']]
+        done = [c for c in closed if c['tradeID'] not in self.trades]
+        reduced = [c for c in closed if c['tradeID'] in self.trades]
+        if done:
+            fill['tradesClosed'] = done
+        if reduced:
+            fill['tradeReduced'] = reduced[0]
+        if remaining != 0:
+            self.trades[trade_id] = {'id': trade_id,
+                                     'instrument': instrument,
+                                     'units': remaining,
+                                     'price': fill_price,
+                                     'openTime': rfc3339(now)}
+            fill['tradeOpened'] = {
+                'tradeID': trade_id, 'units': str(remaining),
+                'price': str(fill_price), 'guaranteedExecutionFee': '0.0',
+                'halfSpreadCost': '0.0', 'initialMarginRequired': str(
+                    abs(remaining) * fill_price *
+                    float(self.instruments[instrument][5]))}
+        self.balance += pl
+        fill['pl'] = str(round(pl, 4))
+        fill['gainQuoteHomeConversionFactor'] = str(factor)
+        fill['lossQuoteHomeConversionFactor'] = str(factor)
+        fill['accountBalance'] = str(round(self.balance, 4))
+        return self.transaction('ORDER_FILL', **fill)
+
+    def positions(self):
+        ''' Returns the open positions (long and short side). '''
+        positions = {}
+        for trade in self.trades.values():
+            position = positions.setdefault(trade['instrument'], {
+                'instrument': trade['instrument'],
+                'long': {'units': 0.0, 'tradeIDs': [], 'value': 0.0},
+                'short': {'units': 0.0, 'tradeIDs': [], 'value': 0.0}})
+            side = position['long' if trade['units'] > 0 else 'short']
+            side['units'] += trade['units']
+            side['value'] += trade['units'] * trade['price']
+            side['tradeIDs'].append(trade['id'])
+        now = time.time()
+        result = []
+        for position in positions.values():
+            unrealized = 0.0
+            factor = self.home_factor(position['instrument'], now)
+            for name in ('long', 'short'):
+                side = position[name]
+                value = side.pop('value')
+                if side['units']:
+                    side['averagePrice'] = str(value / side['units'])
+                    price = self.price(position['instrument'], now)
+                    closeout = float(price['closeoutBid'] if name == 'long'
+                                     else price['closeoutAsk'])
+                    pl = (side['units'] * closeout - value) * factor
+                    side['unrealizedPL'] = str(pl)
+                    unrealized += pl
+                else:
+                    side['unrealizedPL'] = '0.0'
+                side['units'] = str(side['units'])
+                side['pl'] = '0.0'
+            position['unrealizedPL'] = str(unrealized)
+            position['pl'] = '0.0'
+            result.append(position)
+        return result
+
+    def trade_unrealized(self, trade):
+        ''' Returns the unrealized P&L of an open trade in the account
+        currency. '''
+        now = time.time()
+        price = self.price(trade['instrument'], now)
+        closeout = float(price['closeoutBid'] if trade['units'] > 0
+                         else price['closeoutAsk'])
+        return (trade['units'] * (closeout - trade['price']) *
+                self.home_factor(trade['instrument'], now))
+
+    def account(self, detailed=False):
+        ''' Returns the account (summary) record. '''
+        positions = self.positions()
+        unrealized = sum(float(p['unrealizedPL']) for p in positions)
+        account = {
+            'id': ACCOUNT_ID, 'currency': CURRENCY,
+            'balance': str(round(self.balance, 4)),
+            'NAV': str(round(self.balance + unrealized, 4)),
+            'unrealizedPL': str(round(unrealized, 4)),
+            'pl': str(round(sum(float(t.get('pl', 0))
+                                for t in self.transactions), 4)),
+            'openTradeCount': len(self.trades),
+            'openPositionCount': len(positions),
+            'pendingOrderCount': 0,
+            'marginRate': '0.0333',
+            'lastTransactionID': str(len(self.transactions))}
+        if detailed:
+            account['positions'] = positions
+            account['trades'] = [
+                {'id': t['id'], 'instrument': t['instrument'],
+                 'price': str(t['price']), 'openTime': t['openTime'],
+                 'initialUnits': str(t['units']),
+                 'currentUnits': str(t['units']), 'state': 'OPEN',
+                 'unrealizedPL': str(self.trade_unrealized(t))}
+                for t in self.trades.values()]
+            account['orders'] = []
+        return account
+
+    def allow(self):
+        ''' Returns False if the rate limit is exceeded. '''
+        if self.rate_limit is None:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            self.recent = [t for t in self.recent if t > now - 1]
+            if len(self.recent) >= self.rate_limit:
+                return False
+            self.recent.append(now)
+            return True
+
+
+class FakeOandaHandler(BaseHTTPRequestHandler):
+    ''' Request handler of FakeOanda. '''
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately
+    disable_nagle_algorithm = True
+
+    routes = [
+        ('GET', r'/v3/instruments/(?P<instrument>[^/]+)/candles$',
+         'get_candles'),
+        ('GET', r'/v3/accounts/[^/]+/instruments$', 'get_instruments'),
+        ('GET', r'/v3/accounts/[^/]+/pricing$', 'get_pricing'),
+        ('GET', r'/v3/accounts/[^/]+/pricing/stream$', 'get_stream'),
+        ('POST', r'/v3/accounts/[^/]+/orders$', 'post_order'),
+        ('GET', r'/v3/accounts/[^/]+/openPositions$', 'get_positions'),
+        ('GET', r'/v3/accounts/[^/]+/summary$', 'get_summary'),
+        ('GET', r'/v3/accounts/[^/]+$', 'get_account'),
+        ('GET', r'/v3/accounts/[^/]+/transactions/sinceid$',
+         'get_transactions'),
+        ('GET', r'/v3/accounts/[^/]+/transactions/stream$',
+         'get_transaction_stream'),
+        ('GET', r'/v3/accounts/[^/]+/transactions/(?P<tid>\d+)$',
+         'get_transaction'),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        params = {key: values[-1]
+                  for key, values in parse_qs(url.query).items()}
+        for route_method, pattern, name in self.routes:
+            match = re.match(pattern, url.path)
+            if route_method == method and match:
+                break
+        else:
+            return self.reply(404, {'errorMessage': 'Not found'})
+        with self.fake.lock:
+            self.fake.requests[name] = self.fake.requests.get(name, 0) + 1
+        if self.headers.get('Authorization') != \
+                'Bearer {}'.format(ACCESS_TOKEN):
+            return self.reply(401, {'errorMessage': 'Insufficient '
+                                    'authorization to perform request.'})
+        if not name.endswith('stream'):
+            if not self.fake.allow():
+                return self.reply(429, {'errorMessage': 'Too many '
+                                        'requests'}, {'Retry-After': '1'})
+            if self.fake.latency:
+                time.sleep(self.fake.latency)
+        try:
+            getattr(self, name)(params, **match.groupdict())
+        except (KeyError, ValueError) as e:
+            self.reply(400, {'errorMessage': 'Invalid request: {}'.format(e)})
+
+    def reply(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if self.fake.compress and len(data) >= COMPRESS_MIN_LENGTH and \
+                'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = gzip.compress(data, COMPRESS_LEVEL)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        bandwidth = self.fake.bandwidth
+        if not bandwidth:
+            return self.wfile.write(data)
+        # the body trickles in piece by piece
+        for offset in range(0, len(data), DRIP_SIZE):
+            piece = data[offset:offset + DRIP_SIZE]
+            time.sleep(len(piece) / bandwidth)
+            self.wfile.write(piece)
+
+    def last_id(self):
+        return str(len(self.fake.transactions))
+
+    def get_candles(self, params, instrument):
+        if instrument not in self.fake.instruments:
+            return self.reply(400, {'errorMessage': 'Invalid value '
+                                    "specified for 'instrument'"})
+        self.reply(*self.fake.candles(instrument, params))
+
+    def get_instruments(self, params):
+        instruments = []
+        for name, (display, kind, _, pip, precision, margin) in \
+                self.fake.instruments.items():
+            instruments.append({
+                'name': name, 'type': kind, 'displayName': display,
+                'pipLocation': pip, 'displayPrecision': precision,
+                'tradeUnitsPrecision': 0, 'minimumTradeSize': '1',
+                'maximumTrailingStopDistance': '1.0',
+                'minimumTrailingStopDistance': '0.0005',
+                'maximumPositionSize': '0',
+                'maximumOrderUnits': '100000000', 'marginRate': margin})
+        self.reply(200, {'instruments': instruments,
+                         'lastTransactionID': self.last_id()})
+
+    def get_pricing(self, params):
+        now = time.time()
+        prices = [self.fake.price(name, now)
+                  for name in params['instruments'].split(',')
+                  if name in self.fake.instruments]
+        self.reply(200, {'time': rfc3339(now), 'prices': prices})
+
+    def get_stream(self, params):
+        instruments = [name for name in params['instruments'].split(',')
+                       if name in self.fake.instruments]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        start = last_heartbeat = time.time()
+        sent = 0
+        generation = self.fake.stream_generation
+        ends = self.fake.stream_ends
+        try:
+            if params.get('snapshot', 'true').lower() != 'false':
+                self.send_lines([self.fake.price(name, start)
+                                 for name in instruments])
+            while self.fake.running and ends == self.fake.stream_ends:
+                if generation != self.fake.stream_generation:
+                    # dropped: no terminating chunk
+                    self.close_connection = True
+                    return
+                now = time.time()
+                due = int((now - start) * self.fake.tick_rate)
+                if now < self.fake.silent_until:
+                    sent = due
+                    time.sleep(0.01)
+                    continue
+                if self.fake.tradeable(now) and due > sent:
+                    self.send_lines([self.fake.price(name, now)
+                                     for _ in range(due - sent)
+                                     for name in instruments])
+                sent = due
+                if now - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    self.send_lines([{'type': 'HEARTBEAT',
+                                      'time': rfc3339(now)}])
+                    last_heartbeat = now
+                time.sleep(min(0.01, 1 / self.fake.tick_rate))
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+    def get_transaction_stream(self, params):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        with self.fake.lock:
+            sent = len(self.fake.transactions)
+        last_heartbeat = 0
+        try:
+            while self.fake.running:
+                with self.fake.changed:
+                    self.fake.changed.wait_for(
+                        lambda: len(self.fake.transactions) > sent or
+                        not self.fake.running, timeout=0.25)
+                    new = self.fake.transactions[sent:]
+                sent += len(new)
+                if new:
+                    self.send_lines(new)
+                now = time.time()
+                if now - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    self.send_lines([{'type': 'HEARTBEAT',
+                                      'lastTransactionID': str(sent),
+                                      'time': rfc3339(now)}])
+                    last_heartbeat = now
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+    def send_lines(self, messages):
+        data = ''.join(json.dumps(m) + '\n' for m in messages).encode()
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def post_order(self, params):
+        length = int(self.headers.get('Content-Length', 0))
+        order = json.loads(self.rfile.read(length))['order']
+        self.reply(*self.fake.create_order(order))
+
+    def get_positions(self, params):
+        with self.fake.lock:
+            self.reply(200, {'positions': self.fake.positions(),
+                             'lastTransactionID': self.last_id()})
+
+    def get_summary(self, params):
+        with self.fake.lock:
+            self.reply(200, {'account': self.fake.account(),
+                             'lastTransactionID': self.last_id()})
+
+    def get_account(self, params):
+        with self.fake.lock:
+            self.reply(200, {'account': self.fake.account(detailed=True),
+                             'lastTransactionID': self.last_id()})
+
+    def get_transactions(self, params):
+        since = int(params.get('id', 0))
+        with self.fake.lock:
+            self.reply(200, {'transactions': self.fake.transactions[since:],
+                             'lastTransactionID': self.last_id()})
+
+    def get_transaction(self, params, tid):
+        with self.fake.lock:
+            if not 0 < int(tid) <= len(self.fake.transactions):
+                return self.reply(404, {'errorMessage': 'Transaction not '
+                                        'found'})
+            self.reply(200, {'transaction': self.fake.transactions[
+                int(tid) - 1], 'lastTransactionID': self.last_id()})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Local stand-in for the Oanda v20 API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--tick-rate', type=float, default=4.0)
+    parser.add_argument('--cache-dir', default=None,
+                        help='CandleCache directory with recorded candles')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int, default=None)
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='bytes per second of response bodies')
+    parser.add_argument('--no-compress', action='store_true',
+                        help='never gzip-compress responses')
+    parser.add_argument('--always-open', action='store_true',
+                        help='ignore market hours for prices and orders')
+    parser.add_argument('--config', default=None,
+                        help='write a tpqoa configuration file')
+    args = parser.parse_args()
+    fake = FakeOanda(args.host, args.port, args.tick_rate, args.cache_dir,
+                     latency=args.latency, rate_limit=args.rate_limit,
+                     market_hours=not args.always_open,
+                     compress=not args.no_compress,
+                     bandwidth=args.bandwidth)
+    if args.config:
+        fake.write_config(args.config)
+    print('FakeOanda listening on {}:{}'.format(fake.host, fake.port))
+    fake.running = True
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,103 @@
+#
+# tpqoa instruments.py
+#
+# In-memory index of the instrument metadata of an account
+# for cheap lookups and filtering of the instrument universe
+#
+import time
+
+import pandas as pd
+
+# seconds the instrument metadata and the tradeable status are reused
+INSTRUMENTS_TTL = 24 * 3600
+TRADEABLE_TTL = 60
+
+NUMERIC = ['pipLocation', 'displayPrecision', 'tradeUnitsPrecision',
+           'minimumTradeSize', 'maximumTrailingStopDistance',
+           'minimumTrailingStopDistance', 'maximumPositionSize',
+           'maximumOrderUnits', 'marginRate']
+
+
+class InstrumentIndex(object):
+    ''' InstrumentIndex keeps the full instrument records of an account as
+    returned by Oanda, together with a DataFrame indexed by instrument
+    name for vectorized filtering (type, tradeable status, margin, ...).
+
+    The tradeable status comes from the pricing endpoint and is only
+    known after set_tradeable.
+    '''
+
+    def __init__(self, records):
+        ''' Parameters
+        ==========
+        records: list
+            instrument dicts as sent by Oanda (JSON-decoded)
+        '''
+        self.records = {record['name']: record for record in records}
+        frame = pd.DataFrame(records).set_index('name').sort_index()
+        for column in NUMERIC:
+            if column in frame:
+                frame[column] = pd.to_numeric(frame[column])
+        frame['tradeable'] = pd.Series(pd.NA, index=frame.index,
+                                       dtype='boolean')
+        self.frame = frame
+        self.created = time.monotonic()
+        self.tradeable_updated = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, instrument):
+        return instrument in self.records
+
+    def __getitem__(self, instrument):
+        ''' Returns the full record of instrument. '''
+        return self.records[instrument]
+
+    @property
+    def names(self):
+        ''' Returns the sorted instrument names. '''
+        return list(self.frame.index)
+
+    def age(self):
+        ''' Returns the seconds since the metadata was retrieved. '''
+        return time.monotonic() - self.created
+
+    def tradeable_age(self):
+        ''' Returns the seconds since the tradeable status was set
+        (infinite if never). '''
+        if self.tradeable_updated is None:
+            return float('inf')
+        return time.monotonic() - self.tradeable_updated
+
+    def set_tradeable(self, status):
+        ''' Sets the tradeable status from a dict mapping instrument names
+        to booleans; instruments not in status are not tradeable. '''
+        self.frame['tradeable'] = pd.array(
+            [bool(status.get(name, False)) for name in self.frame.index],
+            dtype='boolean')
+        self.tradeable_updated = time.monotonic()
+
+    def select(self, type=None, tradeable=None):
+        ''' Returns the sorted names of the instruments of the given type
+        (e.g. 'CURRENCY', 'CFD' or 'METAL') and tradeable status. '''
+        mask = pd.Series(True, index=self.frame.index)
+        if type is not None:
+            mask &= self.frame['type'] == type
+        if tradeable is not None:
+            if self.tradeable_updated is None:
+                raise ValueError('tradeable status not retrieved yet.')
+            mask &= self.frame['tradeable'] == tradeable
+        return list(self.frame.index[mask.values])
+
+    def precision(self, instrument):
+        ''' Returns the number of decimals of the prices of instrument. '''
+        return int(self.frame.at[instrument, 'displayPrecision'])
+
+    def pip(self, instrument):
+        ''' Returns the size of one pip of instrument, e.g. 0.0001. '''
+        return 10.0 ** int(self.frame.at[instrument, 'pipLocation'])
+
+    def round_price(self, instrument, price):
+        ''' Rounds price to the precision Oanda quotes instrument with. '''
+        return round(price, self.precision(instrument))
@@ -0,0 +1,457 @@
+#
+# tpqoa scheduler.py
+#
+# Client-side rate limiting and prioritization of the
+# REST requests sent to Oanda
+#
+import collections
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+import urllib3
+import v20
+from v20.errors import V20ConnectionError, V20Timeout
+from v20.response import Response
+
+ORDER, PRICING, HISTORY = 0, 1, 2
+PRIORITY_NAMES = {ORDER: 'order', PRICING: 'pricing', HISTORY: 'history'}
+
+# Oanda allows 120 requests per second on a REST connection
+REQUEST_RATE = 100.0
+REQUEST_BURST = 20
+MAX_CONCURRENCY = 20
+LATENCY_TARGET = 2.0
+THROTTLE_RETRIES = 3
+THROTTLE_PAUSE = 1.0
+# seconds until a request of a priority class is abandoned
+DEADLINES = {ORDER: 10.0, PRICING: 5.0, HISTORY: 20.0}
+# retries of failed reads (timeouts, connection errors, 5xx)
+READ_RETRIES = 2
+RETRY_BACKOFF = 0.25
+# latencies kept per priority class for the quantiles
+LATENCY_SAMPLES = 500
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+# compressed responses are decoded while they are read
+ACCEPT_ENCODING = 'gzip, deflate'
+# bytes read from the connection at a time
+CHUNK_SIZE = 65536
+
+
+def request_priority(method, path):
+    ''' Returns the priority class of a REST request: orders and all
+    other account changes first, then pricing and account reads, then
+    bulk history (candles). '''
+    if method != 'GET' or '/orders' in path or '/trades' in path:
+        return ORDER
+    if '/candles' in path:
+        return HISTORY
+    return PRICING
+
+
+class RequestScheduler(object):
+    ''' RequestScheduler admits REST requests according to a token bucket
+    and an adaptive concurrency limit, serving waiting requests strictly
+    by priority class (ORDER before PRICING before HISTORY).
+
+    The concurrency limit grows by one after a limit's worth of fast
+    responses and is halved on a 429 (too many requests) or on a
+    response slower than latency_target. A 429 also halves the token
+    rate and pauses admission for the Retry-After period; the rate then
+    recovers step by step up to its configured maximum. Bulk downloads
+    thus settle at the highest rate Oanda sustains, while waiting
+    orders are always admitted first.
+    '''
+
+    def __init__(self, rate=REQUEST_RATE, burst=REQUEST_BURST,
+                 max_concurrency=MAX_CONCURRENCY,
+                 latency_target=LATENCY_TARGET):
+        ''' Parameters
+        ==========
+        rate: float
+            maximum number of requests per second
+        burst: int
+            number of requests that may be sent at once after idling
+        max_concurrency: int
+            upper bound of the adaptive number of requests in flight
+        latency_target: float
+            response time in seconds above which concurrency is reduced
+        '''
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.latency_target = latency_target
+
+        self.condition = threading.Condition()
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.in_flight = 0
+        self.successes = 0
+        self.waiting = {priority: 0 for priority in PRIORITY_NAMES}
+
+        self.requests = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.wait_time = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.throttled = 0
+        self.slow = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_won = 0
+        self.latencies = {priority: collections.deque(maxlen=LATENCY_SAMPLES)
+                          for priority in PRIORITY_NAMES}
+        self.transfer = {'responses': 0, 'compressed': 0, 'wire_bytes': 0,
+                         'body_bytes': 0, 'seconds': 0.0}
+
+    def _refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _delay(self, priority, now):
+        ''' Returns 0 if a request of the priority may start now,
+        else the time to wait before checking again. '''
+        if any(self.waiting[p] for p in PRIORITY_NAMES if p < priority):
+            return None
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= self.concurrency:
+            return None
+        self._refill(now)
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0
+
+    def acquire(self, priority=HISTORY):
+        ''' Blocks until a request of the given priority may be sent. '''
+        start = time.monotonic()
+        with self.condition:
+            self.enqueue(priority)
+            try:
+                while True:
+                    delay = self.try_acquire(priority, start)
+                    if delay == 0:
+                        return
+                    self.condition.wait(delay)
+            except BaseException:
+                self.dequeue(priority)
+                raise
+
+    def enqueue(self, priority):
+        ''' Registers a request of the given priority as waiting, so that
+        lower priorities are held back until try_acquire admits it (or
+        dequeue gives it up). '''
+        with self.condition:
+            self.waiting[priority] += 1
+
+    def dequeue(self, priority):
+        ''' Gives up a waiting request registered by enqueue. '''
+        with self.condition:
+            self.waiting[priority] -= 1
+            self.condition.notify_all()
+
+    def try_acquire(self, priority, start):
+        ''' Admits a waiting request (see enqueue) if it may be sent now
+        and returns 0, else returns the seconds after which to try again
+        (None: after the next release), without blocking; start is the
+        time it began to wait, for the wait time statistics. Used by
+        acquire and by the asyncio client, whose waits must not block a
+        thread. '''
+        with self.condition:
+            delay = self._delay(priority, time.monotonic())
+            if delay != 0:
+                return delay
+            self.waiting[priority] -= 1
+            self.tokens -= 1
+            self.in_flight += 1
+            name = PRIORITY_NAMES[priority]
+            self.requests[name] += 1
+            self.wait_time[name] += time.monotonic() - start
+            # lower priorities may be next now
+            self.condition.notify_all()
+            return 0
+
+    def release(self, priority, status, latency, retry_after=None):
+        ''' Records the outcome of a request admitted by acquire and
+        adapts rate and concurrency; status is None for requests that
+        failed without a response (e.g. timeouts). '''
+        with self.condition:
+            self.in_flight -= 1
+            if status is not None:
+                self.latencies[priority].append(latency)
+            if status == 429:
+                self.throttled += 1
+                self.successes = 0
+                self.concurrency = max(1, self.concurrency // 2)
+                self.rate = max(1.0, self.rate / 2)
+                pause = retry_after if retry_after else THROTTLE_PAUSE
+                self.paused_until = max(self.paused_until,
+                                        time.monotonic() + pause)
+            elif status is None or latency > self.latency_target:
+                self.slow += 1
+                self.successes = 0
+                self.concurrency = max(1, self.concurrency // 2)
+            else:
+                self.successes += 1
+                if self.successes >= self.concurrency:
+                    self.successes = 0
+                    self.concurrency = min(self.max_concurrency,
+                                           self.concurrency + 1)
+                    self.rate = min(self.max_rate,
+                                    self.rate + self.max_rate / 10)
+            self.condition.notify_all()
+
+    def record(self, counter):
+        ''' Increments one of the counters 'retried', 'hedged' or
+        'hedge_won'. '''
+        with self.condition:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_transfer(self, wire_bytes, body_bytes, seconds):
+        ''' Records the size of a response body as received (possibly
+        compressed) and as decoded, and the seconds it took. '''
+        with self.condition:
+            self.transfer['responses'] += 1
+            self.transfer['compressed'] += wire_bytes < body_bytes
+            self.transfer['wire_bytes'] += wire_bytes
+            self.transfer['body_bytes'] += body_bytes
+            self.transfer['seconds'] += seconds
+
+    def latency_quantile(self, priority, q, min_samples=HEDGE_MIN_SAMPLES):
+        ''' Returns the q-quantile of the recent latencies of a priority
+        class, or None with fewer than min_samples responses. '''
+        with self.condition:
+            samples = sorted(self.latencies[priority])
+        if len(samples) < max(min_samples, 1):
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def stats(self):
+        ''' Returns the request counters, the latency quantiles per
+        priority class, the transferred bytes and the current limits. '''
+        latency = {name: {key: self.latency_quantile(priority, q, 1)
+                          for key, q in [('p50', 0.5), ('p95', 0.95),
+                                         ('p99', 0.99)]}
+                   for priority, name in PRIORITY_NAMES.items()}
+        with self.condition:
+            return {
+                'requests': dict(self.requests),
+                'wait_time': dict(self.wait_time),
+                'latency': latency,
+                'throttled': self.throttled,
+                'slow': self.slow,
+                'retried': self.retried,
+                'hedged': self.hedged,
+                'hedge_won': self.hedge_won,
+                'transfer': dict(self.transfer),
+                'in_flight': self.in_flight,
+                'concurrency': self.concurrency,
+                'rate': self.rate,
+            }
+
+
+def retry_after(headers):
+    ''' Returns the Retry-After header in seconds, if any. '''
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(attempt):
+    ''' Returns a jittered, exponentially growing retry delay. '''
+    return random.uniform(0, RETRY_BACKOFF * 2 ** attempt)
+
+
+class ScheduledContext(v20.Context):
+    ''' v20.Context sending every request through a RequestScheduler.
+
+    Every request is abandoned after the deadline of its priority class,
+    counted from sending it to the end of the response body (as with the
+    total timeout of the asyncio client); a response trickling in more
+    slowly raises V20Timeout.
+    Reads (GET) failing with a timeout, a connection error or a 5xx
+    status are retried up to READ_RETRIES times after a jittered
+    backoff; orders are never sent twice. With hedge set, a read still
+    pending after the recent p95 latency of its class is sent a second
+    time and the first response wins, which cuts the tail latency.
+
+    Requests answered with 429 are sent again (up to THROTTLE_RETRIES
+    times) once the scheduler admits them; Oanda rejects throttled
+    requests before processing them, so this is safe for orders too.
+
+    Responses are requested gzip-compressed and decompressed while
+    they are read; the bytes received and decoded are recorded by the
+    scheduler.
+    '''
+
+    def __init__(self, *args, scheduler=None, deadlines=None, hedge=False,
+                 **kwargs):
+        super(ScheduledContext, self).__init__(*args, **kwargs)
+        self.scheduler = scheduler or RequestScheduler()
+        self.deadlines = dict(DEADLINES, **(deadlines or {}))
+        self.hedge = hedge
+        self.hedge_pool = None
+        self.hedge_lock = threading.Lock()
+        self.set_header('Accept-Encoding', ACCEPT_ENCODING)
+
+    def request(self, request):
+        priority = request_priority(request.method, request.path)
+        retries = READ_RETRIES if request.method == 'GET' \
+            and not request.stream else 0
+        for attempt in range(retries + 1):
+            try:
+                if self.hedge and retries:
+                    response = self._hedged(request, priority)
+                else:
+                    response = self._scheduled(request, priority)
+                if response.status < 500 or attempt == retries:
+                    return response
+            except (V20Timeout, V20ConnectionError):
+                if attempt == retries:
+                    raise
+            self.scheduler.record('retried')
+            time.sleep(retry_delay(attempt))
+
+    def _hedged(self, request, priority):
+        ''' Sends the request and, if it is slower than the recent p95
+        latency, a duplicate; returns the first response. '''
+        delay = self.scheduler.latency_quantile(priority, HEDGE_QUANTILE)
+        if delay is None:
+            return self._scheduled(request, priority)
+        with self.hedge_lock:
+            if self.hedge_pool is None:
+                self.hedge_pool = ThreadPoolExecutor(
+                    max_workers=2 * self.scheduler.max_concurrency)
+        sent = threading.Event()
+        primary = self.hedge_pool.submit(self._scheduled, request, priority,
+                                         sent)
+        # the delay counts from sending, not from waiting for admission
+        sent.wait()
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        self.scheduler.record('hedged')
+        hedge = self.hedge_pool.submit(self._scheduled, request, priority)
+        pending = [primary, hedge]
+        while True:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            # prefer a successful response over a failed attempt
+            for future in done:
+                pending.remove(future)
+                if future.exception() is None or not pending:
+                    if future is hedge:
+                        self.scheduler.record('hedge_won')
+                    return future.result()
+
+    def _scheduled(self, request, priority, sent=None):
+        ''' Sends the request once admitted by the scheduler, again
+        after a 429 response; sets the event sent when first admitted. '''
+        for attempt in range(THROTTLE_RETRIES + 1):
+            self.scheduler.acquire(priority)
+            if sent is not None:
+                sent.set()
+            start = time.monotonic()
+            status = headers = None
+            try:
+                response = self._send(request, self.deadlines[priority])
+                status, headers = response.status, response.headers
+            finally:
+                self.scheduler.release(priority, status,
+                                       time.monotonic() - start,
+                                       retry_after(headers or {}))
+            if status != 429:
+                break
+        return response
+
+    def _send(self, request, timeout):
+        ''' Same as v20.Context.request, abandoned after timeout seconds
+        in total (streams: without data for stream_timeout seconds). '''
+        url = '{}{}'.format(self._base_url, request.path)
+        if request.stream is True:
+            timeout = self.stream_timeout
+        start = time.monotonic()
+        try:
+            # bodies are read by read_content to enforce the deadline
+            http_response = self._session.request(
+                request.method,
+                url,
+                headers=self._headers,
+                params=request.params,
+                data=request.body,
+                stream=True,
+                timeout=timeout
+            )
+            if not request.stream:
+                content = read_content(http_response, start + timeout)
+        except requests.exceptions.ConnectTimeout:
+            raise V20Timeout(url, 'connect')
+        except (requests.exceptions.ReadTimeout, socket.timeout,
+                urllib3.exceptions.ReadTimeoutError):
+            raise V20Timeout(url, 'read')
+        except (requests.exceptions.ConnectionError,
+                urllib3.exceptions.HTTPError, OSError):
+            raise V20ConnectionError(url)
+
+        request.headers = http_response.request.headers
+        response = Response(
+            request,
+            request.method,
+            http_response.url,
+            http_response.status_code,
+            http_response.reason,
+            http_response.headers
+        )
+        if request.stream:
+            response.set_line_parser(request.line_parser)
+            response.set_lines(
+                http_response.iter_lines(self.stream_chunk_size))
+        else:
+            response.set_raw_body(
+                content.decode(http_response.encoding or 'utf-8'))
+            self.scheduler.record_transfer(
+                wire_bytes(http_response, len(content)), len(content),
+                time.monotonic() - start)
+        return response
+
+
+def read_content(http_response, deadline):
+    ''' Reads the (decompressed) body of a requests response sent with
+    stream=True; every read waits at most until the deadline (a
+    time.monotonic() value), after which socket.timeout is raised. '''
+    raw = http_response.raw
+    # read1 returns what has arrived instead of waiting for a full chunk
+    read = getattr(raw, 'read1', None) or raw.read
+    connection = getattr(raw, 'connection', None)
+    sock = getattr(connection, 'sock', None)
+    chunks = []
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout('deadline exceeded')
+            if sock is not None:
+                sock.settimeout(remaining)
+            chunk = read(CHUNK_SIZE, decode_content=True)
+            if not chunk:
+                # the connection goes back to the pool for the next request
+                raw.release_conn()
+                return b''.join(chunks)
+            chunks.append(chunk)
+    except Exception:
+        http_response.close()
+        raise
+
+
+def wire_bytes(http_response, default):
+    ''' Returns the number of body bytes a requests response received
+    over the network (before decompression). '''
+    try:
+        return http_response.raw.tell() or default
+    except (AttributeError, OSError):
+        return default
@@ -0,0 +1,208 @@
+#
+# tpqoa sessions.py
+#
+# Trading calendar of the FX market: the open sessions in UTC,
+# for skipping closed ranges and aligning bars to sessions
+#
+import numpy as np
+import pandas as pd
+
+from .cache import to_utc
+
+# trading days roll over at 17:00 New York time; the week opens on
+# Sunday and closes on Friday at that time (daylight saving aware)
+SESSION_TIMEZONE = 'America/New_York'
+ROLLOVER = '17:00'
+# years of sessions computed at once
+CALENDAR_YEARS = 5
+
+
+def parse_holidays(holidays):
+    ''' Splits holidays ('YYYY-MM-DD' dates or 'MM-DD' for every year,
+    as a list or comma-separated string) into dates and month-days. '''
+    if isinstance(holidays, str):
+        holidays = holidays.split(',')
+    dates, yearly = set(), set()
+    for holiday in holidays:
+        holiday = str(holiday).strip()
+        if not holiday:
+            continue
+        if len(holiday) == 5:
+            yearly.add((int(holiday[:2]), int(holiday[3:])))
+        else:
+            dates.add(pd.Timestamp(holiday).normalize())
+    return dates, yearly
+
+
+class TradingCalendar(object):
+    ''' TradingCalendar knows the open sessions of the FX market.
+
+    A trading day (Monday to Friday, New York date) lasts from 17:00
+    New York time of the previous day to 17:00 of the day itself;
+    consecutive trading days form one session, usually from Sunday to
+    Friday. Holidays are trading days without trading. Sessions are
+    computed for whole years when first needed and kept as arrays of
+    UTC open and close times.
+
+    All times are naive UTC (tz-aware inputs are converted).
+    '''
+
+    def __init__(self, holidays=(), timezone=SESSION_TIMEZONE,
+                 rollover=ROLLOVER):
+        ''' Parameters
+        ==========
+        holidays: list or string
+            days without trading, 'YYYY-MM-DD' or 'MM-DD' (every year),
+            e.g. ['12-25', '01-01'] or '12-25, 01-01'
+        timezone: string
+            time zone of the rollover time
+        rollover: string
+            local time at which trading days start and end
+        '''
+        self.holidays, self.yearly_holidays = parse_holidays(holidays)
+        self.timezone = timezone
+        self.rollover = pd.Timedelta(rollover + ':00')
+        self.first_year = self.last_year = None
+        self.opens = np.empty(0, dtype='int64')
+        self.closes = np.empty(0, dtype='int64')
+
+    def _build(self, first_year, last_year):
+        days = pd.date_range('{}-12-20'.format(first_year - 1),
+                             '{}-01-10'.format(last_year + 1), freq='D')
+        trading = days.weekday < 5
+        trading &= ~days.isin(list(self.holidays))
+        trading &= ~np.array([(d.month, d.day) in self.yearly_holidays
+                              for d in days])
+        days = days[trading]
+        starts = (days - pd.Timedelta(days=1) + self.rollover).tz_localize(
+            self.timezone).tz_convert('UTC').tz_localize(None).asi8
+        ends = (days + self.rollover).tz_localize(
+            self.timezone).tz_convert('UTC').tz_localize(None).asi8
+        # a new session starts wherever a trading day does not follow
+        # on the previous one
+        new = np.ones(len(days), dtype=bool)
+        new[1:] = starts[1:] != ends[:-1]
+        last = np.ones(len(days), dtype=bool)
+        last[:-1] = new[1:]
+        self.opens, self.closes = starts[new], ends[last]
+        self.first_year, self.last_year = first_year, last_year
+
+    def _cover(self, start, end):
+        ''' Makes sure the sessions around [start, end] are known. '''
+        first, last = start.year, end.year
+        if self.first_year is None or first < self.first_year or \
+                last > self.last_year:
+            if self.first_year is not None:
+                first = min(first, self.first_year)
+                last = max(last, self.last_year)
+            self._build(first, max(last, first + CALENDAR_YEARS - 1))
+
+    def sessions(self, start, end):
+        ''' Returns the sessions overlapping [start, end] as an
+        IntervalIndex of [open, close) times. '''
+        start, end = to_utc(start), to_utc(end)
+        self._cover(start, end)
+        lo = np.searchsorted(self.closes, start.value, side='right')
+        hi = np.searchsorted(self.opens, end.value, side='right')
+        return pd.IntervalIndex.from_arrays(
+            pd.to_datetime(self.opens[lo:hi]),
+            pd.to_datetime(self.closes[lo:hi]), closed='left')
+
+    def is_open(self, times):
+        ''' Returns whether the market is open at the given time(s), as a
+        boolean or a boolean array. '''
+        scalar = np.ndim(times) == 0 and not isinstance(times, pd.Index)
+        index = pd.DatetimeIndex([times] if scalar else times)
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        if len(index) == 0:
+            return np.empty(0, dtype=bool)
+        self._cover(index.min(), index.max())
+        values = index.asi8
+        session = np.searchsorted(self.opens, values, side='right') - 1
+        result = (session >= 0) & (values < self.closes[np.maximum(session,
+                                                                   0)])
+        return bool(result[0]) if scalar else result
+
+    def open_ranges(self, start, end):
+        ''' Returns the open parts of [start, end] as (start, end)
+        Timestamps. '''
+        start, end = to_utc(start), to_utc(end)
+        return [(max(start, session.left), min(end, session.right))
+                for session in self.sessions(start, end)
+                if max(start, session.left) < min(end, session.right)]
+
+    def open_seconds(self, start, end):
+        ''' Returns the number of seconds the market is open within
+        [start, end]. '''
+        return sum((range_end - range_start).total_seconds()
+                   for range_start, range_end in self.open_ranges(start,
+                                                                  end))
+
+    def bar_index(self, start, end, freq):
+        ''' Returns the start times of the bars of length freq within
+        [start, end], counted from the open of every session, so no bar
+        lies in a closed market and none spans two sessions. '''
+        start, end = to_utc(start), to_utc(end)
+        freq = pd.Timedelta(freq)
+        bars = [np.arange(session.left.value, session.right.value,
+                          freq.value, dtype='int64')
+                for session in self.sessions(start, end)]
+        bars = pd.DatetimeIndex(np.concatenate(bars) if bars else
+                                np.empty(0, dtype='int64'), name='time')
+        return bars[(bars >= start) & (bars <= end)]
+
+    def resample(self, data, freq, how='last', label='left'):
+        ''' Resamples data (with a UTC DatetimeIndex) to bars of length
+        freq aligned to the session opens; rows in closed markets are
+        dropped and bars without rows are left out, not padded.
+
+        Parameters
+        ==========
+        data: pd.DataFrame or pd.Series
+            data to be resampled
+        freq: string or timedelta
+            bar length, e.g. '5min' or '4h'
+        how: string
+            aggregation, e.g. 'last', 'mean' or 'ohlc'
+        label: string
+            'left' labels bars with their start, 'right' with their end
+            (the session close for the last bar of a session)
+        '''
+        index = data.index
+        tz = index.tz
+        if tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        freq = pd.Timedelta(freq)
+        if len(index) == 0:
+            return data.groupby(level=0).agg(how)
+        self._cover(index.min(), index.max())
+        values = index.asi8
+        session = np.searchsorted(self.opens, values, side='right') - 1
+        opens = self.opens[np.maximum(session, 0)]
+        closes = self.closes[np.maximum(session, 0)]
+        inside = (session >= 0) & (values < closes)
+        bars = opens + (values - opens) // freq.value * freq.value
+        if label == 'right':
+            bars = np.minimum(bars + freq.value, closes)
+        bars = pd.DatetimeIndex(bars[inside], name=data.index.name)
+        if tz is not None:
+            bars = bars.tz_localize('UTC').tz_convert(tz)
+        return data[inside].groupby(bars).agg(how)
+
+    def missing_bars(self, index, freq):
+        ''' Returns the bars of length freq between the first and the last
+        time of index that have no data although the market was open,
+        i.e. real data gaps as opposed to closed markets. '''
+        if len(index) == 0:
+            return pd.DatetimeIndex([], name='time')
+        tz = getattr(index, 'tz', None)
+        times = pd.DatetimeIndex(index)
+        if tz is not None:
+            times = times.tz_convert('UTC').tz_localize(None)
+        expected = self.bar_index(times.min(), times.max(), freq)
+        present = self.resample(pd.Series(1, index=times), freq).index
+        missing = expected.difference(present)
+        if tz is not None:
+            missing = missing.tz_localize('UTC').tz_convert(tz)
+        return missing
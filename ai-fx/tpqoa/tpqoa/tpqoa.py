@@ -28,18 +28,279 @@
 # to the extent permitted by applicable law.
 #
 import _thread
+import collections
 import configparser
 import json
+import os
 import signal
 import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
 
+import numpy as np
 import pandas as pd
+import requests
 import v20
+from v20.errors import ResponseNoField, V20ConnectionError, V20Timeout
+from v20.order import MarketOrderRequest, LimitOrderRequest
+from v20.order import MarketIfTouchedOrderRequest
+from v20.request import Request
 from v20.transaction import StopLossDetails, ClientExtensions
 from v20.transaction import TrailingStopLossDetails, TakeProfitDetails
 
+from .account import AccountState, MAX_RECONNECT_DELAY, STALE_AFTER
+from .cache import CandleCache, COLUMNS, to_utc
+from .instruments import InstrumentIndex, INSTRUMENTS_TTL, TRADEABLE_TTL
+from .scheduler import RequestScheduler, ScheduledContext, REQUEST_RATE
+from .scheduler import retry_delay
+from .sessions import TradingCalendar
+
 MAX_REQUEST_COUNT = float(5000)
+DEFAULT_POOL_SIZE = 10
+PRICE_COMPONENTS = {'A': 'ask', 'B': 'bid', 'M': 'mid'}
+# characters of the instruments parameter of one pricing request
+MAX_INSTRUMENTS_LENGTH = 2000
+# closed market time is only skipped this far from the session bounds,
+# quotes may start shortly before the open
+CLOSED_MARGIN = pd.Timedelta(hours=1)
+# candle length in seconds ('M' is the longest month)
+GRANULARITY_SECONDS = {
+    'S5': 5, 'S10': 10, 'S15': 15, 'S30': 30,
+    'M1': 60, 'M2': 120, 'M4': 240, 'M5': 300, 'M10': 600, 'M15': 900,
+    'M30': 1800, 'H1': 3600, 'H2': 7200, 'H3': 10800, 'H4': 14400,
+    'H6': 21600, 'H8': 28800, 'H12': 43200, 'D': 86400, 'W': 604800,
+    'M': 2678400
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def history_columns(price, columns=None):
+    ''' Returns the column names of history data for a price spec.
+
+    A single price component keeps the plain names ('o', ..., 'c'),
+    several components such as 'BA' or 'MBA' get prefixed price columns
+    ('bid_o', ..., 'ask_c') in the order of the spec; 'volume' and
+    'complete' are never prefixed.
+    '''
+    if len(price) == 0 or len(set(price)) != len(price) or \
+            any(p not in PRICE_COMPONENTS for p in price):
+        raise ValueError("price must be either 'B', 'A' or 'M' "
+                         "or a combination such as 'BA' or 'MBA'.")
+    if columns is None:
+        columns = COLUMNS
+    if len(price) == 1:
+        return list(columns)
+    names = [f'{PRICE_COMPONENTS[p]}_{col}' for p in price
+             for col in columns if col in 'ohlc']
+    return names + [col for col in columns if col not in 'ohlc']
+
+
+def decode_candles(candles, price, columns=None):
+    ''' Decodes the candles of a raw (JSON-decoded) candles response
+    column by column into a DataFrame indexed by UTC time.
+
+    Parameters
+    ==========
+    candles: list
+        list of candle dicts as sent by Oanda
+    price: string
+        one of 'A' (ask), 'B' (bid) or 'M' (middle) or a combination
+        such as 'BA' (see history_columns for the column names)
+    columns: list
+        subset of 'o', 'h', 'l', 'c', 'volume', 'complete' to decode
+        (default: all)
+    '''
+    names = history_columns(price, columns)
+    if len(candles) == 0:
+        # empty DataFrame with the columns if no data
+        return pd.DataFrame(columns=names, index=pd.DatetimeIndex(
+            [], name='time', tz='UTC'))
+    count = len(candles)
+
+    # RFC3339 times with nanoseconds, e.g. '2021-03-01T00:00:00.000000000Z'
+    time = np.array([cs['time'][:-1] for cs in candles],
+                    dtype='datetime64[ns]')
+    index = pd.DatetimeIndex(time, name='time').tz_localize('UTC')
+
+    data = {}
+    for name in names:
+        if name == 'volume':
+            data[name] = np.fromiter((cs['volume'] for cs in candles),
+                                     dtype='int64', count=count)
+        elif name == 'complete':
+            data[name] = np.fromiter((cs['complete'] for cs in candles),
+                                     dtype='bool', count=count)
+        else:
+            component, col = (name.split('_') if len(price) > 1
+                              else (PRICE_COMPONENTS[price], name))
+            data[name] = np.array([cs[component][col] for cs in candles],
+                                  dtype='float64')
+    return pd.DataFrame(data, index=index)
+
+
+def split_components(data, price):
+    ''' Splits history data of a combined price spec into one frame
+    with plain column names per price component. '''
+    if len(price) == 1 or data.empty:
+        return {p: data for p in price}
+    frames = {}
+    for p in price:
+        prefix = PRICE_COMPONENTS[p] + '_'
+        frame = data[[name for name in data.columns
+                      if name.startswith(prefix) or name in COLUMNS]]
+        frames[p] = frame.rename(columns=lambda name: name.replace(prefix, ''))
+    return frames
+
+
+def join_components(frames, price):
+    ''' Joins per-component history data into the columns of a
+    combined price spec, the inverse of split_components. '''
+    if len(price) == 1:
+        return frames[price]
+    if any(frames[p].empty for p in price):
+        return decode_candles([], price)
+    joined = []
+    for i, p in enumerate(price):
+        frame = frames[p]
+        if i > 0:
+            frame = frame.drop(columns=['volume', 'complete'])
+        joined.append(frame.rename(columns=lambda col: col if col in (
+            'volume', 'complete') else f'{PRICE_COMPONENTS[p]}_{col}'))
+    return pd.concat(joined, axis=1, join='inner')[history_columns(price)]
+
+
+def join_batches(frames, price, columns=None):
+    ''' Joins the frames of consecutive history batches with one
+    concatenation, dropping candles repeated on batch boundaries. '''
+    frames = [frame for frame in frames if not frame.empty]
+    if len(frames) == 0:
+        return decode_candles([], price, columns)
+    data = pd.concat(frames)
+    return data[~data.index.duplicated(keep='first')]
+
+
+def instrument_chunks(instruments, max_length=MAX_INSTRUMENTS_LENGTH):
+    ''' Joins instrument names into comma-separated request parameters
+    of at most max_length characters each. '''
+    chunks, chunk, length = [], [], -1
+    for name in instruments:
+        if chunk and length + 1 + len(name) > max_length:
+            chunks.append(','.join(chunk))
+            chunk, length = [], -1
+        chunk.append(name)
+        length += 1 + len(name)
+    if chunk:
+        chunks.append(','.join(chunk))
+    return chunks
+
+
+def decode_prices(prices):
+    ''' Decodes the prices of raw (JSON-decoded) pricing responses into
+    a DataFrame with the columns instrument, time (UTC), bid and ask
+    (closeout prices), spread and tradeable. '''
+    count = len(prices)
+    time = np.array([p['time'][:-1] for p in prices], dtype='datetime64[ns]')
+    bid = np.array([p['closeoutBid'] for p in prices], dtype='float64')
+    ask = np.array([p['closeoutAsk'] for p in prices], dtype='float64')
+    return pd.DataFrame({
+        'instrument': np.array([p['instrument'] for p in prices],
+                               dtype='object'),
+        'time': time,
+        'bid': bid,
+        'ask': ask,
+        'spread': ask - bid,
+        'tradeable': np.fromiter((p.get('tradeable', False) for p in prices),
+                                 dtype='bool', count=count)
+    })
+
+
+def resample_pages(pages, rule, how='last', label='right'):
+    ''' Resamples the page frames of tpqoa.iter_history incrementally.
+
+    Yields one resampled frame per page. The candles of the last bar of
+    a page are held back and resampled together with the next page, so
+    the concatenated result equals resampling the whole range at once.
+    Only fixed-length rules such as '5min' or '1H' are supported.
+
+    Parameters
+    ==========
+    pages: iterable
+        DataFrames in time order, e.g. from tpqoa.iter_history
+    rule: string
+        resampling rule, e.g. '1min'
+    how: string
+        aggregation of the resampler, e.g. 'last', 'max' or 'sum'
+    label: string
+        bar edge used as label, 'left' or 'right'
+    '''
+    length = pd.Timedelta(rule)
+    origin = carry = None
+    for page in pages:
+        if carry is not None:
+            page = pd.concat([carry, page])
+        if page.empty:
+            continue
+        if origin is None:
+            # bars start at midnight of the first day, as with resample
+            origin = page.index[0].normalize()
+        bars = (page.index - origin) // length
+        last_bar = bars == bars[-1]
+        carry = page[last_bar]
+        if not last_bar.all():
+            yield page[~last_bar].resample(
+                rule, label=label, origin=origin).agg(how)
+    if carry is not None and not carry.empty:
+        yield carry.resample(rule, label=label, origin=origin).agg(how)
+
+
+def guarded(on_gap):
+    ''' Wraps an on_gap callable of a supervised stream so that its
+    errors (e.g. a failed backfill request) are printed instead of
+    ending the stream. '''
+    def call(instrument, last, time):
+        try:
+            on_gap(instrument, last, time)
+        except Exception:
+            print(traceback.format_exc())
+    return call
+
+
+def price_ticks(response, msgs=None):
+    ''' Yields (instrument, time, bid, ask) for every price message of a
+    v20 pricing stream response and None for every heartbeat, appending
+    the v20 message objects to msgs if given. '''
+    for msg_type, msg in response.parts():
+        if msgs is not None:
+            msgs.append(msg)
+        if msg_type == 'pricing.ClientPrice':
+            yield (msg.instrument, msg.time,
+                   float(msg.bids[0].price), float(msg.asks[0].price))
+        else:
+            yield None
+
+
+def raw_price_ticks(response, msgs=None):
+    ''' Same as price_ticks, but decodes the raw stream lines directly
+    instead of building v20 message objects. Heartbeats are recognized
+    without decoding, msgs receives the raw lines. '''
+    try:
+        for line in response.lines:
+            if msgs is not None:
+                msgs.append(line)
+            if b'HEARTBEAT' in line:
+                yield None
+                continue
+            msg = json.loads(line)
+            yield (msg['instrument'], msg['time'],
+                   float(msg['bids'][0]['price']),
+                   float(msg['asks'][0]['price']))
+    except requests.exceptions.ConnectionError:
+        raise V20Timeout(response.path, 'stream')
+    except requests.exceptions.ChunkedEncodingError:
+        raise V20ConnectionError(response.path)
 
 
 class Job(threading.Thread):
@@ -93,7 +354,7 @@ def service_shutdown(signum, frame):
 class tpqoa(object):
     ''' tpqoa is a Python wrapper class for the Oanda v20 API. '''
 
-    def __init__(self, conf_file):
+    def __init__(self, conf_file, cache_dir=None):
         ''' Init function is expecting a configuration file with
         the following content:
 
@@ -101,12 +362,23 @@ class tpqoa(object):
         account_id = XYZ-ABC-...
         access_token = ZYXCAB...
         account_type = practice (default) or live
+        cache_dir = /home/me/candles (optional)
+        request_rate = 100 (optional, maximum REST requests per second)
+        hedge_requests = false (optional, duplicate slow reads)
+        hostname = 127.0.0.1 (optional, e.g. for a FakeOanda server)
+        stream_hostname = 127.0.0.1 (optional)
+        port = 443 (optional)
+        ssl = true (optional)
+        holidays = 12-25, 01-01 (optional, days without trading)
 
         Parameters
         ==========
         conf_file: string
             path to and filename of the configuration file,
             e.g. '/home/me/oanda.cfg'
+        cache_dir: string
+            directory of the on-disk candle cache used by get_history,
+            overrides cache_dir from the configuration file
         '''
         self.config = configparser.ConfigParser()
         self.config.read(conf_file)
@@ -114,37 +386,78 @@ class tpqoa(object):
         self.account_id = self.config['oanda']['account_id']
         self.account_type = self.config['oanda']['account_type']
 
+        if cache_dir is None:
+            cache_dir = self.config['oanda'].get('cache_dir')
+        self.cache = CandleCache(cache_dir) if cache_dir else None
+
         if self.account_type == 'live':
             self.hostname = 'api-fxtrade.oanda.com'
             self.stream_hostname = 'stream-fxtrade.oanda.com'
         else:
             self.hostname = 'api-fxpractice.oanda.com'
             self.stream_hostname = 'stream-fxpractice.oanda.com'
+        self.hostname = self.config['oanda'].get('hostname', self.hostname)
+        self.stream_hostname = self.config['oanda'].get(
+            'stream_hostname', self.stream_hostname)
+        self.port = self.config['oanda'].getint('port', 443)
+        self.ssl = self.config['oanda'].getboolean('ssl', True)
 
-        self.ctx = v20.Context(
+        self.scheduler = RequestScheduler(rate=float(
+            self.config['oanda'].get('request_rate', REQUEST_RATE)))
+        self.ctx = ScheduledContext(
             hostname=self.hostname,
-            port=443,
+            port=self.port,
+            ssl=self.ssl,
             token=self.access_token,
-            poll_timeout=10
+            poll_timeout=10,
+            scheduler=self.scheduler,
+            hedge=self.config['oanda'].getboolean('hedge_requests', False)
         )
         self.ctx_stream = v20.Context(
             hostname=self.stream_hostname,
-            port=443,
+            port=self.port,
+            ssl=self.ssl,
             token=self.access_token,
         )
 
         self.suffix = '.000000000Z'
         self.stop_stream = False
+        self.pool_size = DEFAULT_POOL_SIZE
+        self.instruments = None
+        # closed market ranges of currency pairs are not requested
+        # (None requests all, see instrument_calendar)
+        self.calendar = TradingCalendar(
+            self.config['oanda'].get('holidays', ''))
 
     def get_instruments(self):
         ''' Retrieves and returns all instruments for the given account. '''
-        resp = self.ctx.account.instruments(self.account_id)
-        instruments = resp.get('instruments')
-        instruments = [ins.dict() for ins in instruments]
-        instruments = [(ins['displayName'], ins['name'])
-                       for ins in instruments]
+        index = self.instrument_index()
+        instruments = [(index[name]['displayName'], name)
+                       for name in index.names]
         return sorted(instruments)
 
+    def instrument_index(self, ttl=INSTRUMENTS_TTL, tradeable=False):
+        ''' Returns the InstrumentIndex with the full instrument records of
+        the account, retrieved again only once older than ttl seconds.
+
+        Parameters
+        ==========
+        ttl: int
+            maximum age of the instrument metadata in seconds
+        tradeable: boolean
+            whether to (re)load the tradeable status from the pricing
+            endpoint if older than TRADEABLE_TTL seconds
+        '''
+        if self.instruments is None or self.instruments.age() > ttl:
+            resp = self.ctx.account.instruments(self.account_id)
+            index = InstrumentIndex(json.loads(resp.raw_body)['instruments'])
+            self.instruments = index
+        if tradeable and self.instruments.tradeable_age() > TRADEABLE_TTL:
+            prices = self.get_prices_batch(self.instruments.names)
+            self.instruments.set_tradeable(
+                dict(zip(prices.instrument, prices.tradeable)))
+        return self.instruments
+
     def get_prices(self, instrument):
         ''' Returns the current BID/ASK prices for instrument. '''
         r = self.ctx.pricing.get(self.account_id, instruments=instrument)
@@ -153,47 +466,85 @@ class tpqoa(object):
         ask = float(r['prices'][0]['closeoutAsk'])
         return r['time'], bid, ask
 
+    def get_prices_batch(self, instruments=None):
+        ''' Returns the current BID/ASK prices of many instruments with as
+        few requests as the URL length allows.
+
+        Parameters
+        ==========
+        instruments: list
+            instrument names (default: all instruments of the account)
+
+        Returns
+        =======
+        prices: pd.DataFrame
+            one row per instrument with the columns instrument, time,
+            bid, ask, spread and tradeable
+        '''
+        if instruments is None:
+            instruments = self.instrument_index().names
+        prices = []
+        for chunk in instrument_chunks(instruments):
+            request = Request('GET', '/v3/accounts/{accountID}/pricing')
+            request.set_path_param('accountID', self.account_id)
+            request.set_param('instruments', chunk)
+            response = self.ctx.request(request)
+            body = json.loads(response.raw_body)
+            if 'prices' not in body:
+                response.body = body
+                raise ResponseNoField(response, 'prices')
+            prices.extend(body['prices'])
+        return decode_prices(prices)
+
     def transform_datetime(self, dati):
-        ''' Transforms Python datetime object to string. '''
-        if isinstance(dati, str):
-            dati = pd.Timestamp(dati).to_pydatetime()
-        return dati.isoformat('T') + self.suffix
-
-    def retrieve_data(self, instrument, start, end, granularity, price):
-        raw = self.ctx.instrument.candles(
-            instrument=instrument,
-            fromTime=start, toTime=end,
-            granularity=granularity, price=price)
-        raw = raw.get('candles')
-        raw = [cs.dict() for cs in raw]
-        if price == 'A':
-            for cs in raw:
-                cs.update(cs['ask'])
-                del cs['ask']
-        elif price == 'B':
-            for cs in raw:
-                cs.update(cs['bid'])
-                del cs['bid']
-        elif price == 'M':
-            for cs in raw:
-                cs.update(cs['mid'])
-                del cs['mid']
-        else:
-            raise ValueError("price must be either 'B', 'A' or 'M'.")
-        if len(raw) == 0:
-            return pd.DataFrame()  # return empty DataFrame if no data
-        data = pd.DataFrame(raw)
-        data['time'] = pd.to_datetime(data['time'])
-        data = data.set_index('time')
-        data.index = pd.DatetimeIndex(data.index)
-        for col in list('ohlc'):
-            data[col] = data[col].astype(float)
-        return data
-
-    def get_history(self, instrument, start, end,
-                    granularity, price, localize=True):
+        ''' Transforms a datetime (object or string, naive times are UTC)
+        to an RFC 3339 string with nanoseconds, e.g. of stream ticks. '''
+        dati = pd.Timestamp(dati)
+        if dati.tzinfo is not None:
+            dati = dati.tz_convert('UTC').tz_localize(None)
+        if not dati.microsecond and not dati.nanosecond:
+            return dati.isoformat('T') + self.suffix
+        return '{}.{:06d}{:03d}Z'.format(dati.strftime('%Y-%m-%dT%H:%M:%S'),
+                                        dati.microsecond, dati.nanosecond)
+
+    def request_candles(self, instrument, granularity, price, **params):
+        ''' Requests candles and returns the JSON-decoded response body,
+        bypassing the per-candle object model of the v20 package.
+
+        params are passed on as query parameters, e.g. 'from', 'to'
+        or 'count'.
+        '''
+        request = Request('GET', '/v3/instruments/{instrument}/candles')
+        request.set_path_param('instrument', instrument)
+        request.set_param('granularity', granularity)
+        request.set_param('price', price)
+        for key, value in params.items():
+            request.set_param(key, value)
+        response = self.ctx.request(request)
+        body = json.loads(response.raw_body)
+        if 'candles' not in body:
+            response.body = body
+            raise ResponseNoField(response, 'candles')
+        return body
+
+    def retrieve_data(self, instrument, start, end, granularity, price,
+                      columns=None):
+        ''' Retrieves the candles between start and end with a single
+        request, see decode_candles for the columns parameter. '''
+        history_columns(price)
+        body = self.request_candles(instrument, granularity, price,
+                                    **{'from': start, 'to': end})
+        return decode_candles(body['candles'], price, columns)
+
+    def get_history(self, instrument, start, end, granularity, price,
+                    localize=True, workers=None, columns=None):
         ''' Retrieves historical data for instrument.
 
+        With a candle cache configured, only the parts of [start, end]
+        not yet on disk are downloaded; the rest is read from the cache.
+        Only complete candles are cached, a range ending at the current
+        candle returns it all the same (downloaded again every time).
+
         Parameters
         ==========
         instrument: string
@@ -203,43 +554,280 @@ class tpqoa(object):
         granularity: string
             a string like 'S5', 'M1' or 'D'
         price: string
-            one of 'A' (ask), 'B' (bid) or 'M' (middle)
+            one of 'A' (ask), 'B' (bid) or 'M' (middle) or a combination
+            like 'BA' or 'MBA', retrieved with the same requests and
+            returned as prefixed columns (bid_o, ..., ask_c, ...)
+        localize: boolean
+            whether to remove the time zone from the index
+        workers: int
+            number of concurrent requests used to download long ranges
+            in time chunks (default: one page after the other)
+        columns: list
+            columns to return, e.g. ['c'] (default: o, h, l, c,
+            volume, complete); without a cache only these are decoded
 
         Returns
         =======
         data: pd.DataFrame
             pandas DataFrame object with data
         '''
-        if granularity.startswith('S') or granularity.startswith('M'):
-            multiplier = float("".join(filter(str.isdigit, granularity)))
-            if granularity.startswith('S'):
-                # freq = '1h'
-                freq = f"{int(MAX_REQUEST_COUNT * multiplier / float(3600))}H"
-            else:
-                # freq = 'D'
-                freq = f"{int(MAX_REQUEST_COUNT * multiplier / float(1440))}D"
-            data = pd.DataFrame()
-            dr = pd.date_range(start, end, freq=freq)
-
-            for t in range(len(dr)):
-                batch_start = self.transform_datetime(dr[t])
-                if t != len(dr) - 1:
-                    batch_end = self.transform_datetime(dr[t + 1])
-                else:
-                    batch_end = self.transform_datetime(end)
-
-                batch = self.retrieve_data(instrument, batch_start, batch_end,
-                                           granularity, price)
-                data = data.append(batch)
+        if columns is None:
+            columns = COLUMNS
+        if self.cache is None:
+            data = self.download_history(instrument, start, end, granularity,
+                                         price, workers, columns)
         else:
-            start = self.transform_datetime(start)
-            end = self.transform_datetime(end)
-            data = self.retrieve_data(instrument, start, end,
-                                      granularity, price)
+            data = self.cached_history(instrument, start, end, granularity,
+                                       price, workers)
         if localize:
             data.index = data.index.tz_localize(None)
 
-        return data[['o', 'h', 'l', 'c', 'volume', 'complete']]
+        return data[history_columns(price, columns)]
+
+    def iter_history(self, instrument, start, end, granularity, price,
+                     localize=True, columns=None):
+        ''' Yields historical data for instrument page by page, as
+        DataFrames of at most MAX_REQUEST_COUNT candles in time order,
+        each one as soon as it has arrived.
+
+        Only one page is held in memory at a time, so long ranges can be
+        processed incrementally (see resample_pages). The parameters are
+        those of get_history; the candle cache is not used.
+        '''
+        if columns is None:
+            columns = COLUMNS
+        for candles in self.candle_pages(instrument, start, end,
+                                         granularity, price):
+            data = decode_candles(candles, price, columns)
+            if localize:
+                data.index = data.index.tz_localize(None)
+            yield data
+
+    def cached_history(self, instrument, start, end, granularity, price,
+                       workers=None):
+        ''' Returns historical data from the candle cache after downloading
+        the ranges not yet covered for any of the price components.
+
+        Incomplete candles (the current one) are not cached, but returned
+        as downloaded, so the result equals that without a cache. '''
+        current = []
+        for gap_start, gap_end in self.missing_history(
+                instrument, start, end, granularity, price):
+            batch = self.download_history(instrument, gap_start, gap_end,
+                                          granularity, price, workers)
+            self.store_history(instrument, gap_start, gap_end,
+                               granularity, price, batch)
+            if not batch.empty:
+                current.append(batch[~batch['complete'].astype(bool)])
+        data = self.load_history(instrument, start, end, granularity, price)
+        # the incomplete candles follow all cached ones
+        return join_batches([data] + current, price)
+
+    def missing_history(self, instrument, start, end, granularity, price):
+        ''' Returns the (start, end) ranges the candle cache is missing
+        for any of the price components. '''
+        gaps = []
+        for gap in sorted(gap for p in price for gap in self.cache.missing(
+                instrument, granularity, p, start, end)):
+            if gaps and gap[0] <= gaps[-1][1]:
+                gaps[-1] = (gaps[-1][0], max(gaps[-1][1], gap[1]))
+            else:
+                gaps.append(gap)
+        return gaps
+
+    def store_history(self, instrument, start, end, granularity, price, data):
+        ''' Stores downloaded data per price component in the cache. '''
+        for p, frame in split_components(data, price).items():
+            self.cache.store(instrument, granularity, p, frame, start, end)
+
+    def load_history(self, instrument, start, end, granularity, price):
+        ''' Loads the cached data of all price components. '''
+        frames = {p: self.cache.load(instrument, granularity, p, start, end)
+                  for p in price}
+        return join_components(frames, price)
+
+    def download_history(self, instrument, start, end, granularity, price,
+                         workers=None, columns=None):
+        ''' Downloads historical data for instrument from Oanda.
+
+        One at a time, the range is paged through with full requests of
+        MAX_REQUEST_COUNT candles (see candle_pages). With workers set,
+        the time chunks of history_batches are requested concurrently.
+        '''
+        if workers is not None and workers > 1:
+            batches = self.history_batches(start, end, granularity,
+                                           instrument)
+            return self.retrieve_batches(instrument, batches, granularity,
+                                         price, workers, columns)
+        candles = [cs for page in self.candle_pages(instrument, start, end,
+                                                    granularity, price)
+                   for cs in page]
+        return decode_candles(candles, price, columns)
+
+    def candle_pages(self, instrument, start, end, granularity, price):
+        ''' Yields the raw candle lists of consecutive requests covering
+        [start, end] with the minimum number of requests.
+
+        Every request but the last asks for MAX_REQUEST_COUNT candles
+        from the time of the last candle received (excluding it), so
+        weekends and other gaps do not lead to partly filled pages. The
+        last request is bounded by end as soon as the remaining range
+        cannot hold more than MAX_REQUEST_COUNT candles, counting only
+        the trading ranges (see trading_ranges).
+        '''
+        history_columns(price)
+        start, end = to_utc(start), to_utc(end)
+        count = int(MAX_REQUEST_COUNT)
+        cursor = start
+        params = {'from': self.transform_datetime(start)}
+        while cursor <= end:
+            capacity = self.candle_capacity(cursor, end, granularity,
+                                            instrument)
+            if capacity == 0:
+                # the market is closed for the rest of the range
+                return
+            if capacity <= count:
+                params['to'] = self.transform_datetime(end)
+                candles = self.request_candles(instrument, granularity,
+                                               price, **params)['candles']
+                if candles:
+                    yield candles
+                return
+            candles = self.request_candles(instrument, granularity, price,
+                                           count=count, **params)['candles']
+            if not candles:
+                return
+            cursor = to_utc(candles[-1]['time'])
+            if cursor > end:
+                # only possible on the last page
+                candles = [cs for cs in candles
+                           if to_utc(cs['time']) <= end]
+            if candles:
+                yield candles
+            if len(candles) < count or cursor >= end:
+                return
+            params = {'from': candles[-1]['time'], 'includeFirst': False}
+
+    def instrument_calendar(self, instrument):
+        ''' Returns the calendar of the market hours of instrument:
+        self.calendar for currency pairs (type CURRENCY in the instrument
+        index), None for all other instruments (and without instrument),
+        whose ranges are requested in full. '''
+        if self.calendar is None or instrument is None:
+            return None
+        index = self.instrument_index()
+        if instrument not in index or index[instrument]['type'] != 'CURRENCY':
+            return None
+        return self.calendar
+
+    def trading_ranges(self, start, end, granularity, instrument=None):
+        ''' Returns the (start, end) parts of [start, end] that may hold
+        candles of instrument: the open market sessions of its calendar
+        (see instrument_calendar), widened by CLOSED_MARGIN, or the whole
+        range without calendar. Monthly candles may start in a closed
+        market and are never skipped. '''
+        start, end = to_utc(start), to_utc(end)
+        calendar = self.instrument_calendar(instrument)
+        if calendar is None or granularity == 'M':
+            return [(start, end)]
+        ranges = []
+        for range_start, range_end in calendar.open_ranges(
+                start - CLOSED_MARGIN, end + CLOSED_MARGIN):
+            range_start = max(start, range_start - CLOSED_MARGIN)
+            range_end = min(end, range_end + CLOSED_MARGIN)
+            if range_start > range_end:
+                continue
+            if ranges and range_start <= ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], range_end))
+            else:
+                ranges.append((range_start, range_end))
+        return ranges
+
+    def candle_capacity(self, start, end, granularity, instrument=None):
+        ''' Returns the maximum number of candles of instrument between
+        start and end (inclusive) within the trading ranges. '''
+        seconds = GRANULARITY_SECONDS[granularity]
+        return sum(int((range_end - range_start).total_seconds() // seconds)
+                   + 1 for range_start, range_end in self.trading_ranges(
+                       start, end, granularity, instrument))
+
+    def history_batches(self, start, end, granularity, instrument=None):
+        ''' Returns the (start, end) request strings of consecutive time
+        chunks covering the trading ranges of [start, end], each short
+        enough to hold at most MAX_REQUEST_COUNT candles, for concurrent
+        retrieval. Closed market time (of currency pairs, see
+        instrument_calendar) is neither requested on its own nor counted
+        against the limit. '''
+        seconds = GRANULARITY_SECONDS[granularity]
+        count = int(MAX_REQUEST_COUNT)
+        batches = []
+        # [start, end, candles] of the batch being filled
+        batch = None
+        for range_start, range_end in self.trading_ranges(
+                start, end, granularity, instrument):
+            while True:
+                if batch is None:
+                    batch = [range_start, range_start, 0]
+                need = int((range_end - range_start).total_seconds() //
+                           seconds) + 1
+                room = count - batch[2]
+                if need <= room:
+                    batch[1:] = [range_end, batch[2] + need]
+                    break
+                if room < 2:
+                    batches.append(batch[:2])
+                    batch = None
+                    continue
+                # the end of a request is inclusive
+                split = range_start + pd.Timedelta(seconds=(room - 1) *
+                                                   seconds)
+                batches.append([batch[0], split])
+                batch = None
+                range_start = split
+        if batch is not None:
+            batches.append(batch[:2])
+        return [(self.transform_datetime(batch_start),
+                 self.transform_datetime(batch_end))
+                for batch_start, batch_end in batches]
+
+    def retrieve_batches(self, instrument, batches, granularity, price,
+                         workers=None, columns=None):
+        ''' Retrieves the (start, end) batches and joins them in order.
+
+        With workers set, the batches are requested concurrently on a
+        bounded thread pool. The result is the same in either case:
+        one concatenation in batch order, with candles repeated on
+        batch boundaries dropped.
+        '''
+        def retrieve(batch):
+            return self.retrieve_data(instrument, batch[0], batch[1],
+                                      granularity, price, columns)
+
+        if workers is None or workers <= 1:
+            frames = [retrieve(batch) for batch in batches]
+        else:
+            self.set_pool_size(workers)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                frames = list(executor.map(retrieve, batches))
+        return join_batches(frames, price, columns)
+
+    def set_pool_size(self, size):
+        ''' Grows the HTTP connection pool of the REST context so that
+        concurrent requests do not discard connections. '''
+        if size > self.pool_size:
+            adapter = requests.adapters.HTTPAdapter(pool_connections=size,
+                                                    pool_maxsize=size)
+            self.ctx._session.mount('https://', adapter)
+            self.ctx._session.mount('http://', adapter)
+            self.pool_size = size
+
+    def request_stats(self):
+        ''' Returns the counters of the REST request scheduler: requests,
+        total waiting time and latency quantiles per priority class,
+        throttled (429) and slow responses, retried reads, hedged reads
+        and how often the hedge won, and the current concurrency and
+        rate limits. '''
+        return self.scheduler.stats()
 
     def create_order(self, instrument, units, price=None, sl_distance=None,
                      tsl_distance=None, tp_price=None, comment=None,
@@ -271,6 +859,32 @@ class tpqoa(object):
         ret: boolean
             whether to return the order object
         '''
+        order = self.order_request(instrument, units, price, sl_distance,
+                                   tsl_distance, tp_price, comment, touch)
+        request = self.ctx.order.create(self.account_id, order=order)
+
+        # First checking if the order is rejected
+        if 'orderRejectTransaction' in request.body:
+            order = request.get('orderRejectTransaction')
+        elif 'orderFillTransaction' in request.body:
+            order = request.get('orderFillTransaction')
+        elif 'orderCreateTransaction' in request.body:
+            order = request.get('orderCreateTransaction')
+        else:
+            # This case does not happen.  But keeping this for completeness.
+            order = None
+
+        if not suppress and order is not None:
+            print('\n\n', order.dict(), '\n')
+        if ret is True:
+            return order.dict() if order is not None else None
+
+    def order_request(self, instrument, units, price=None, sl_distance=None,
+                      tsl_distance=None, tp_price=None, comment=None,
+                      touch=False):
+        ''' Returns the v20 order request for the create_order parameters:
+        a market order without price, a market-if-touched order with
+        touch and a limit order otherwise. '''
         client_ext = ClientExtensions(
             comment=comment) if comment is not None else None
         sl_details = (StopLossDetails(distance=sl_distance,
@@ -283,8 +897,7 @@ class tpqoa(object):
             price=tp_price, clientExtensions=client_ext)
             if tp_price is not None else None)
         if price is None:
-            request = self.ctx.order.market(
-                self.account_id,
+            return MarketOrderRequest(
                 instrument=instrument,
                 units=units,
                 stopLossOnFill=sl_details,
@@ -292,8 +905,7 @@ class tpqoa(object):
                 takeProfitOnFill=tp_details,
             )
         elif touch:
-            request = self.ctx.order.market_if_touched(
-                self.account_id,
+            return MarketIfTouchedOrderRequest(
                 instrument=instrument,
                 price=price,
                 units=units,
@@ -302,8 +914,7 @@ class tpqoa(object):
                 takeProfitOnFill=tp_details
             )
         else:
-            request = self.ctx.order.limit(
-                self.account_id,
+            return LimitOrderRequest(
                 instrument=instrument,
                 price=price,
                 units=units,
@@ -312,64 +923,147 @@ class tpqoa(object):
                 takeProfitOnFill=tp_details
             )
 
-        # First checking if the order is rejected
-        if 'orderRejectTransaction' in request.body:
-            order = request.get('orderRejectTransaction')
-        elif 'orderFillTransaction' in request.body:
-            order = request.get('orderFillTransaction')
-        elif 'orderCreateTransaction' in request.body:
-            order = request.get('orderCreateTransaction')
-        else:
-            # This case does not happen.  But keeping this for completeness.
-            order = None
-
-        if not suppress and order is not None:
-            print('\n\n', order.dict(), '\n')
-        if ret is True:
-            return order.dict() if order is not None else None
-
-    def stream_data(self, instrument, stop=None, ret=False, callback=None):
+    def stream_data(self, instrument, stop=None, ret=False, callback=None,
+                    history=None, raw=False, resume=False, on_gap=None):
         ''' Starts a real-time data stream.
 
         Parameters
         ==========
-        instrument: string
-            valid instrument name
+        instrument: string or list
+            valid instrument name or list of instrument names,
+            all streamed on one connection
+        stop: int
+            number of ticks per instrument after which the instrument
+            stops being dispatched; the stream ends once all instruments
+            are stopped
+        ret: boolean
+            whether to return the received messages
+        callback: callable or dict
+            called as callback(instrument, time, bid, ask) for every
+            tick instead of on_success; a dict maps instrument names to
+            their own callables (instruments without entry go to
+            on_success)
+        history: int
+            number of most recent messages kept (and returned with ret);
+            by default all messages with ret and none otherwise
+        raw: boolean
+            whether to decode the raw stream lines directly instead of
+            the v20 message objects (kept messages are then raw lines)
+        resume: boolean
+            whether to continue the tick counts, stopped instruments
+            and last tick times of the previous (interrupted) stream;
+            ticks not newer than the last one before are skipped
+        on_gap: callable
+            with resume, called as on_gap(instrument, last, time) before
+            the first new tick of every instrument, with the times of
+            the last tick before and the first tick after the gap
         '''
+        instruments = ([instrument] if isinstance(instrument, str)
+                       else list(instrument))
         self.stream_instrument = instrument
-        self.ticks = 0
+        if not resume:
+            self.ticks = 0
+            self.instrument_ticks = {name: 0 for name in instruments}
+            self.stopped_instruments = set()
+            self.last_tick_times = {}
+        gaps = set(self.last_tick_times) if resume else set()
         response = self.ctx_stream.pricing.stream(
             self.account_id, snapshot=True,
-            instruments=instrument)
-        msgs = []
-        for msg_type, msg in response.parts():
-            msgs.append(msg)
-            # print(msg_type, msg)
-            if msg_type == 'pricing.ClientPrice':
+            instruments=','.join(instruments))
+        if response.status == 429 or response.status >= 500:
+            raise V20ConnectionError(response.path)
+        if history is None:
+            history = None if ret else 0
+        msgs = collections.deque(maxlen=history)
+        decode = raw_price_ticks if raw else price_ticks
+        for tick in decode(response, msgs if history != 0 else None):
+            if tick is not None and tick[0] in self.instrument_ticks and \
+                    tick[0] not in self.stopped_instruments:
+                name, time, bid, ask = tick
+                if name in gaps:
+                    # the snapshot repeats the last price seen before
+                    if time <= self.last_tick_times[name]:
+                        continue
+                    gaps.discard(name)
+                    if on_gap is not None:
+                        on_gap(name, self.last_tick_times[name], time)
+                self.last_tick_times[name] = time
                 self.ticks += 1
-                self.time = msg.time
-                if callback is not None:
-                    callback(msg.instrument, msg.time,
-                             float(msg.bids[0].dict()['price']),
-                             float(msg.asks[0].dict()['price']))
+                self.instrument_ticks[name] += 1
+                self.time = time
+                handler = (callback.get(name)
+                           if isinstance(callback, dict) else callback)
+                if handler is not None:
+                    handler(name, time, bid, ask)
                 else:
-                    self.on_success(msg.time,
-                                    float(msg.bids[0].dict()['price']),
-                                    float(msg.asks[0].dict()['price']))
+                    self.on_success(time, bid, ask)
                 if stop is not None:
-                    if self.ticks >= stop:
-                        if ret:
-                            return msgs
-                        break
-            if self.stop_stream:
+                    if self.instrument_ticks[name] >= stop:
+                        self.stop_instrument(name)
+            if self.stop_stream or \
+                    len(self.stopped_instruments) == len(instruments):
                 if ret:
-                    return msgs
+                    return list(msgs)
                 break
 
+    def stop_instrument(self, instrument):
+        ''' Stops dispatching ticks of one instrument of a running stream;
+        the stream ends once all of its instruments are stopped. '''
+        self.stopped_instruments.add(instrument)
+
+    def stream_data_supervised(self, instrument, stop=None, callback=None,
+                               on_gap=None, raw=True,
+                               stale_after=STALE_AFTER):
+        ''' Same as stream_data, but reconnects whenever the stream is
+        interrupted and resumes it (see resume and on_gap of stream_data),
+        e.g. to backfill the missed interval from candles.
+
+        Parameters
+        ==========
+        instrument, stop, callback, raw:
+            as for stream_data
+        on_gap: callable
+            called as on_gap(instrument, last, time) after a reconnect;
+            its errors are printed and do not end the stream
+        stale_after: float
+            seconds without any message (Oanda sends a heartbeat every
+            5 seconds) after which the stream counts as interrupted
+
+        A stream that ends without being stopped (stop_stream set or
+        all instruments stopped) counts as interrupted as well. The first
+        reconnect is immediate, further ones follow after growing
+        jittered delays (up to MAX_RECONNECT_DELAY) until ticks arrive
+        again; self.reconnects counts them.
+        '''
+        self.ctx_stream.set_stream_timeout(stale_after)
+        self.reconnects = 0
+        if on_gap is not None:
+            on_gap = guarded(on_gap)
+        resume = False
+        attempt = 0
+        while True:
+            ticks = self.ticks if resume else 0
+            try:
+                self.stream_data(instrument, stop, callback=callback,
+                                 raw=raw, resume=resume, on_gap=on_gap)
+            except (V20Timeout, V20ConnectionError,
+                    requests.exceptions.RequestException):
+                pass
+            if self.stop_stream or len(self.stopped_instruments) == \
+                    len(self.instrument_ticks):
+                return
+            if self.ticks > ticks:
+                attempt = 0
+            if attempt:
+                sleep(min(MAX_RECONNECT_DELAY, retry_delay(attempt)))
+            attempt += 1
+            self.reconnects += 1
+            resume = True
+
     def _stream_data_failsafe_thread(self, args):
         try:
             print("Starting price streaming")
-            self.stream_data(args[0], callback=args[1])
+            self.stream_data_supervised(args[0], callback=args[1])
         except Exception as e:
             import sys
             import traceback
@@ -407,6 +1101,17 @@ class tpqoa(object):
         raw = response.get('account')
         return raw.dict()
 
+    def account_state(self, history=None):
+        ''' Returns an AccountState of the account, bootstrapped from a
+        snapshot and kept up to date by the transactions stream.
+
+        Parameters
+        ==========
+        history: int
+            number of most recent transactions kept (default all)
+        '''
+        return AccountState(self, history).start()
+
     def get_transaction(self, tid=0):
         ''' Retrieves and returns transaction data. '''
         response = self.ctx.transaction.get(self.account_id, tid)
@@ -439,3 +1144,20 @@ class tpqoa(object):
         response = self.ctx.position.list_open(self.account_id).body
         positions = [p.dict() for p in response.get('positions')]
         return positions
+
+
+def shared(conf_file, cache_dir=None):
+    ''' Returns the process-wide tpqoa client for the configuration file,
+    creating it on first use.
+
+    The client and its keep-alive connections are reused by all callers
+    with the same configuration file (and cache_dir), so repeated
+    backtests do not re-read the configuration or open new connections.
+    Meant for REST requests: streaming keeps state on the client, so
+    streams should use their own tpqoa object.
+    '''
+    key = (os.path.abspath(conf_file), cache_dir)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = tpqoa(conf_file, cache_dir=cache_dir)
+        return _clients[key]